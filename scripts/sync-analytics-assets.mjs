@@ -5,6 +5,7 @@ const cwd = process.cwd();
 const reportDir = resolve(cwd, "services", "analytics", "data", "reports", "sales_monthly", "v1");
 const publicDir = resolve(cwd, "public", "analytics");
 const monthPattern = /^kpi_(20\d{2}-\d{2})\.json$/;
+const quicklookAssetPattern = /^kpi_quicklook-[0-9a-f]+\.(css|js)$/;
 
 function readExistingInputSignature(indexPath) {
   if (!existsSync(indexPath)) {
@@ -66,11 +67,19 @@ function main() {
     throw new Error("No KPI output files found after sync.");
   }
 
+  for (const fileName of reportFiles) {
+    if (!quicklookAssetPattern.test(fileName)) {
+      continue;
+    }
+    copyFileSync(resolve(reportDir, fileName), resolve(publicDir, fileName));
+    expectedFiles.add(fileName);
+  }
+
   for (const fileName of readdirSync(publicDir)) {
     if (fileName === "index.json") {
       continue;
     }
-    if (!/^kpi_20\d{2}-\d{2}.*(\.json|_quicklook\.html)$/.test(fileName)) {
+    if (!/^kpi_20\d{2}-\d{2}.*(\.json|_quicklook\.html)$/.test(fileName) && !quicklookAssetPattern.test(fileName)) {
       continue;
     }
     if (!expectedFiles.has(fileName)) {
@@ -1,21 +1,32 @@
 from __future__ import annotations
 
 import argparse
-import hashlib
+import functools
 import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from pathlib import Path
 from typing import Any
 
+import pyarrow as pa
+import pyarrow.compute as pc
 import pyarrow.parquet as pq
 
+from common import atomic_write_bytes, encode_json, file_sha256
+
 CURATED_SCHEMA_ID = "sales_monthly_curated_v1"
+CURATED_BATCH_ROWS = 100_000
+CURATED_ROW_GROUP_ROWS = 100_000
 
 
 def utc_now_iso() -> str:
     return datetime.now(timezone.utc).replace(microsecond=0).isoformat()
 
 
+@functools.cache
 def require_duckdb():
     try:
         import duckdb  # type: ignore
@@ -26,12 +37,8 @@ def require_duckdb():
     return duckdb
 
 
-def file_sha256(path: Path) -> str:
-    hasher = hashlib.sha256()
-    with path.open("rb") as f:
-        for chunk in iter(lambda: f.read(1024 * 1024), b""):
-            hasher.update(chunk)
-    return hasher.hexdigest()
+def atomic_write_json(path: Path, payload: Any, *, indent: int | None) -> None:
+    atomic_write_bytes(path, encode_json(payload, indent=indent))
 
 
 def parse_month_from_partition_dir(path: Path) -> str:
@@ -42,17 +49,38 @@ def parse_month_from_partition_dir(path: Path) -> str:
     return name[len(prefix) :]
 
 
-def discover_raw_partitions(output_root: Path) -> tuple[dict[str, Path], list[dict[str, str]]]:
+def discover_raw_partitions(
+    output_root: Path,
+    selected_months: set[str] | None = None,
+) -> tuple[dict[str, Path], list[dict[str, str]]]:
     raw_base = output_root / "raw" / "sales_monthly" / "v1"
     selected: dict[str, dict[str, Any]] = {}
     skipped: list[dict[str, str]] = []
 
-    for raw_path in sorted(raw_base.glob("report_month_*/sales_monthly_v1.parquet")):
+    if not raw_base.is_dir():
+        return {}, skipped
+
+    raw_base = raw_base.resolve()
+
+    if selected_months is not None:
+        partition_dirs = [os.path.join(raw_base, f"report_month_{month}") for month in sorted(selected_months)]
+    else:
+        with os.scandir(raw_base) as entries:
+            partition_dirs = sorted(
+                entry.path for entry in entries if entry.name.startswith("report_month_") and entry.is_dir()
+            )
+
+    for partition_dir in partition_dirs:
+        raw_path_str = os.path.join(partition_dir, "sales_monthly_v1.parquet")
+        try:
+            stat = os.stat(raw_path_str)
+        except FileNotFoundError:
+            continue
+        raw_path = Path(raw_path_str)
         month = parse_month_from_partition_dir(raw_path.parent)
         current = selected.get(month)
-        stat = raw_path.stat()
         candidate = {
-            "path": raw_path.resolve(),
+            "path": raw_path,
             "mtime": stat.st_mtime,
             "size_bytes": stat.st_size,
         }
@@ -101,18 +129,21 @@ def load_state(state_path: Path) -> dict[str, Any]:
     }
 
 
-def save_state(state_path: Path, state: dict[str, Any]) -> None:
+def save_state(state_path: Path, state: dict[str, Any], updated_at: str | None = None) -> None:
     state_path.parent.mkdir(parents=True, exist_ok=True)
-    state["updated_at"] = utc_now_iso()
-    state_path.write_text(json.dumps(state, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+    state["updated_at"] = updated_at or utc_now_iso()
+    atomic_write_json(state_path, state, indent=2)
 
 
-def build_curated_table(raw_path: Path):
+def open_curated_connection():
     duckdb = require_duckdb()
     conn = duckdb.connect(database=":memory:")
     conn.execute("SET threads TO 4")
     conn.execute("SET memory_limit='1GB'")
+    return conn
+
 
+def build_curated_reader(conn, raw_paths: list[Path]):
     query = """
     WITH src AS (
       SELECT
@@ -133,7 +164,7 @@ def build_curated_table(raw_path: Path):
         snitt_inpris,
         lager_antal,
         source_file
-      FROM read_parquet(?)
+      FROM read_parquet(?, union_by_name = true)
     ),
     agg AS (
       SELECT
@@ -154,10 +185,10 @@ def build_curated_table(raw_path: Path):
         AVG(tg_percent) FILTER (WHERE tg_percent IS NOT NULL) AS tg_percent_avg,
         MAX(lager_antal) FILTER (WHERE lager_antal IS NOT NULL) AS lager_antal_max,
         COUNT(*) AS source_row_count,
-        COUNT(DISTINCT source_file) AS source_file_count,
-        SUM(CASE WHEN COALESCE(antal_salda, 0) < 0 THEN 1 ELSE 0 END) AS return_row_count,
-        SUM(CASE WHEN COALESCE(tb, 0) < 0 THEN 1 ELSE 0 END) AS negative_margin_row_count,
-        SUM(CASE WHEN ean IS NULL OR TRIM(ean) = '' THEN 1 ELSE 0 END) AS missing_ean_row_count
+        approx_count_distinct(source_file) AS source_file_count,
+        COUNT(*) FILTER (WHERE antal_salda < 0) AS return_row_count,
+        COUNT(*) FILTER (WHERE tb < 0) AS negative_margin_row_count,
+        COUNT(*) FILTER (WHERE ean IS NULL OR TRIM(ean) = '') AS missing_ean_row_count
       FROM src
       GROUP BY
         report_month,
@@ -169,46 +200,90 @@ def build_curated_table(raw_path: Path):
         varutext,
         huvudleverantor
     )
-    SELECT
-      report_month,
-      filial,
-      avdelning,
-      varugrupp,
-      artnr,
-      ean,
-      varutext,
-      huvudleverantor,
-      ROUND(antal_salda_sum, 4) AS antal_salda_sum,
-      ROUND(fors_sum_sum, 2) AS fors_sum_sum,
-      ROUND(tb_sum, 2) AS tb_sum,
-      ROUND(fors_m_moms_sum, 2) AS fors_m_moms_sum,
-      ROUND(ord_pris_avg, 4) AS ord_pris_avg,
-      ROUND(snitt_inpris_avg, 4) AS snitt_inpris_avg,
-      ROUND(tg_percent_avg, 4) AS tg_percent_avg,
-      ROUND(lager_antal_max, 4) AS lager_antal_max,
-      ROUND(
-        CASE WHEN fors_sum_sum = 0 THEN NULL ELSE (tb_sum / fors_sum_sum) * 100 END,
-        4
-      ) AS gross_margin_percent_calc,
-      ROUND(
-        CASE
-          WHEN snitt_inpris_avg IS NULL OR lager_antal_max IS NULL THEN NULL
-          ELSE snitt_inpris_avg * lager_antal_max
-        END,
-        2
-      ) AS estimated_stock_value,
-      source_row_count,
-      source_file_count,
-      return_row_count,
-      negative_margin_row_count,
-      missing_ean_row_count,
-      (tb_sum < 0) AS has_negative_margin,
-      (antal_salda_sum < 0 OR fors_sum_sum < 0) AS has_net_return
-    FROM agg
+    SELECT * FROM agg
     """
-    table = conn.execute(query, [str(raw_path)]).fetch_arrow_table()
-    conn.close()
-    return table
+    result = conn.execute(query, [[str(path) for path in raw_paths]])
+    if hasattr(result, "to_arrow_reader"):
+        reader = result.to_arrow_reader(CURATED_BATCH_ROWS)
+    else:
+        reader = result.fetch_record_batch(CURATED_BATCH_ROWS)
+    schema = derive_curated_columns(pa.RecordBatch.from_pylist([], schema=reader.schema)).schema
+    return pa.RecordBatchReader.from_batches(schema, (derive_curated_columns(batch) for batch in reader))
+
+
+def round_half_away(values: pa.Array, ndigits: int) -> pa.Array:
+    scale = 10.0**ndigits
+    return pc.divide(pc.round(pc.multiply(values, scale), round_mode="half_towards_infinity"), scale)
+
+
+def derive_curated_columns(batch: pa.RecordBatch) -> pa.RecordBatch:
+    fors_sum = batch.column("fors_sum_sum")
+    tb_sum = batch.column("tb_sum")
+    antal_sum = batch.column("antal_salda_sum")
+    snitt_inpris = batch.column("snitt_inpris_avg")
+    lager_antal = batch.column("lager_antal_max")
+
+    gross_margin = pc.if_else(
+        pc.equal(fors_sum, 0),
+        pa.nulls(len(batch), type=pa.float64()),
+        pc.multiply(pc.divide(tb_sum, fors_sum), 100),
+    )
+    columns = {
+        "report_month": batch.column("report_month"),
+        "filial": batch.column("filial"),
+        "avdelning": batch.column("avdelning"),
+        "varugrupp": batch.column("varugrupp"),
+        "artnr": batch.column("artnr"),
+        "ean": batch.column("ean"),
+        "varutext": batch.column("varutext"),
+        "huvudleverantor": batch.column("huvudleverantor"),
+        "antal_salda_sum": round_half_away(antal_sum, 4),
+        "fors_sum_sum": round_half_away(fors_sum, 2),
+        "tb_sum": round_half_away(tb_sum, 2),
+        "fors_m_moms_sum": round_half_away(batch.column("fors_m_moms_sum"), 2),
+        "ord_pris_avg": round_half_away(batch.column("ord_pris_avg"), 4),
+        "snitt_inpris_avg": round_half_away(snitt_inpris, 4),
+        "tg_percent_avg": round_half_away(batch.column("tg_percent_avg"), 4),
+        "lager_antal_max": round_half_away(lager_antal, 4),
+        "gross_margin_percent_calc": round_half_away(gross_margin, 4),
+        "estimated_stock_value": round_half_away(pc.multiply(snitt_inpris, lager_antal), 2),
+        "source_row_count": batch.column("source_row_count"),
+        "source_file_count": batch.column("source_file_count"),
+        "return_row_count": batch.column("return_row_count"),
+        "negative_margin_row_count": batch.column("negative_margin_row_count"),
+        "missing_ean_row_count": batch.column("missing_ean_row_count"),
+        "has_negative_margin": pc.less(tb_sum, 0),
+        "has_net_return": pc.or_kleene(pc.less(antal_sum, 0), pc.less(fors_sum, 0)),
+    }
+    return pa.RecordBatch.from_pydict(columns)
+
+
+def write_curated_parquet(conn, reader, curated_paths: dict[str, Path], staging_dir: Path) -> dict[str, int]:
+    cursor = conn.cursor()
+    try:
+        cursor.register("curated_batches", reader)
+        cursor.execute(
+            f"COPY curated_batches TO '{staging_dir.as_posix()}' ("
+            "FORMAT PARQUET, COMPRESSION ZSTD, "
+            f"ROW_GROUP_SIZE {CURATED_ROW_GROUP_ROWS}, "
+            "PARTITION_BY (report_month), WRITE_PARTITION_COLUMNS true, OVERWRITE_OR_IGNORE true)"
+        )
+    finally:
+        cursor.close()
+
+    row_counts: dict[str, int] = {}
+    for month, curated_path in curated_paths.items():
+        partition_dir = staging_dir / f"report_month={month}"
+        written = sorted(partition_dir.glob("*.parquet")) if partition_dir.is_dir() else []
+        if not written:
+            pq.write_table(reader.schema.empty_table(), curated_path, compression="zstd")
+            row_counts[month] = 0
+            continue
+        if len(written) != 1:
+            raise RuntimeError(f"Expected one parquet file for {month}, got {len(written)}")
+        os.replace(written[0], curated_path)
+        row_counts[month] = pq.ParquetFile(curated_path).metadata.num_rows
+    return row_counts
 
 
 def run_curated_build(
@@ -217,10 +292,12 @@ def run_curated_build(
     selected_months: list[str] | None = None,
     state_path: Path | None = None,
 ) -> dict[str, Any]:
-    raw_mapping, discovery_skipped = discover_raw_partitions(output_root)
-    if selected_months is not None:
-        selected_set = set(selected_months)
-        raw_mapping = {month: path for month, path in raw_mapping.items() if month in selected_set}
+    run_started = datetime.now(timezone.utc)
+    run_ts = run_started.replace(microsecond=0).isoformat()
+    raw_mapping, discovery_skipped = discover_raw_partitions(
+        output_root,
+        set(selected_months) if selected_months is not None else None,
+    )
 
     curated_base = output_root / "curated" / "sales_monthly" / "v1"
     report_dir = output_root / "reports" / "sales_monthly" / "v1"
@@ -240,16 +317,39 @@ def run_curated_build(
     unchanged: list[dict[str, Any]] = []
     failed: list[dict[str, Any]] = []
 
+    candidates: list[tuple[str, Path, os.stat_result, dict[str, Any], bool]] = []
     for month in sorted(raw_mapping.keys()):
         raw_path = raw_mapping[month]
-        raw_checksum = file_sha256(raw_path)
+        raw_stat = raw_path.stat()
         previous = state["months"].get(month, {})
+        curated_exists = Path(previous.get("curated_parquet_path", "")).exists()
 
-        previous_matches = (
-            previous.get("raw_sha256") == raw_checksum
-            and Path(previous.get("curated_parquet_path", "")).exists()
-        )
-        if previous_matches:
+        # Fast-path: unchanged by file metadata, avoid expensive checksum read.
+        same_size = previous.get("size_bytes") == raw_stat.st_size
+        same_mtime = previous.get("mtime_ns") == raw_stat.st_mtime_ns
+        if same_size and same_mtime and curated_exists:
+            unchanged.append(
+                {
+                    "report_month": month,
+                    "raw_parquet_path": str(raw_path),
+                    "curated_parquet_path": previous.get("curated_parquet_path"),
+                }
+            )
+            continue
+        candidates.append((month, raw_path, raw_stat, previous, curated_exists))
+
+    checksums: list[str] = []
+    if candidates:
+        max_workers = min(len(candidates), max(1, (os.cpu_count() or 2) // 2))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            checksums = list(executor.map(file_sha256, [raw_path for _, raw_path, _, _, _ in candidates]))
+
+    to_build: list[tuple[str, Path, str, os.stat_result]] = []
+    for (month, raw_path, raw_stat, previous, curated_exists), raw_checksum in zip(candidates, checksums):
+        if previous.get("raw_sha256") == raw_checksum and curated_exists:
+            # Content is unchanged (e.g. touched file or older state): record stat for next run.
+            previous["size_bytes"] = raw_stat.st_size
+            previous["mtime_ns"] = raw_stat.st_mtime_ns
             unchanged.append(
                 {
                     "report_month": month,
@@ -258,35 +358,66 @@ def run_curated_build(
                 }
             )
             continue
+        to_build.append((month, raw_path, raw_checksum, raw_stat))
+    unchanged.sort(key=lambda item: item["report_month"])
 
+    curated_paths = {
+        month: curated_base / f"report_month_{month}" / "sales_monthly_curated_v1.parquet"
+        for month, _, _, _ in to_build
+    }
+    row_counts: dict[str, int] = {}
+    column_count = 0
+    if to_build:
+        conn = open_curated_connection()
         try:
-            table = build_curated_table(raw_path)
-            out_dir = curated_base / f"report_month_{month}"
-            out_dir.mkdir(parents=True, exist_ok=True)
-            curated_path = out_dir / "sales_monthly_curated_v1.parquet"
-            pq.write_table(table, curated_path, compression="zstd")
-
+            for curated_path in curated_paths.values():
+                curated_path.parent.mkdir(parents=True, exist_ok=True)
+            reader = build_curated_reader(conn, [raw_path for _, raw_path, _, _ in to_build])
+            column_count = len(reader.schema)
+            staging_dir = Path(tempfile.mkdtemp(prefix=".staging_", dir=curated_base))
+            try:
+                row_counts = write_curated_parquet(conn, reader, curated_paths, staging_dir)
+            finally:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+        except Exception as error:  # pragma: no cover - operational path
+            for month, raw_path, _, _ in to_build:
+                failed.append(
+                    {
+                        "report_month": month,
+                        "raw_parquet_path": str(raw_path),
+                        "error": str(error),
+                    }
+                )
+            to_build = []
+        finally:
+            conn.close()
+
+    for month, raw_path, raw_checksum, raw_stat in to_build:
+        try:
+            curated_path = curated_paths[month]
             month_report = {
                 "schema_id": CURATED_SCHEMA_ID,
                 "report_month": month,
                 "raw_parquet_path": str(raw_path),
                 "raw_sha256": raw_checksum,
                 "curated_parquet_path": str(curated_path),
-                "row_count": table.num_rows,
-                "column_count": table.num_columns,
-                "generated_at_utc": utc_now_iso(),
+                "row_count": row_counts[month],
+                "column_count": column_count,
+                "generated_at_utc": run_ts,
             }
             month_report_path = report_dir / f"{month}_curated.json"
-            month_report_path.write_text(json.dumps(month_report, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+            atomic_write_json(month_report_path, month_report, indent=2)
 
             state["months"][month] = {
                 "raw_parquet_path": str(raw_path),
                 "raw_sha256": raw_checksum,
+                "size_bytes": raw_stat.st_size,
+                "mtime_ns": raw_stat.st_mtime_ns,
                 "curated_parquet_path": str(curated_path),
                 "curated_report_path": str(month_report_path),
-                "row_count": table.num_rows,
-                "column_count": table.num_columns,
-                "updated_at_utc": utc_now_iso(),
+                "row_count": row_counts[month],
+                "column_count": column_count,
+                "updated_at_utc": run_ts,
             }
             processed.append(month_report)
         except Exception as error:  # pragma: no cover - operational path
@@ -298,11 +429,11 @@ def run_curated_build(
                 }
             )
 
-    save_state(effective_state_path, state)
+    save_state(effective_state_path, state, updated_at=run_ts)
 
     run_summary = {
         "schema_id": CURATED_SCHEMA_ID,
-        "ran_at_utc": utc_now_iso(),
+        "ran_at_utc": run_ts,
         "output_root": str(output_root),
         "state_file": str(effective_state_path),
         "discovered_raw_month_count": len(raw_mapping),
@@ -316,11 +447,12 @@ def run_curated_build(
         "discovery_skipped": discovery_skipped,
     }
 
-    run_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    run_id = run_started.strftime("%Y%m%dT%H%M%SZ")
     run_report_path = runs_dir / f"{run_id}_curated_build.json"
     latest_path = report_dir / "latest_curated_build.json"
-    run_report_path.write_text(json.dumps(run_summary, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
-    latest_path.write_text(json.dumps(run_summary, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+    run_summary_blob = encode_json(run_summary, indent=None)
+    atomic_write_bytes(run_report_path, run_summary_blob)
+    atomic_write_bytes(latest_path, run_summary_blob)
 
     run_summary["run_report_path"] = str(run_report_path)
     run_summary["latest_report_path"] = str(latest_path)
@@ -1,19 +1,32 @@
 from __future__ import annotations
 
+import functools
+import hashlib
 import json
 import math
+import os
 import re
 import unicodedata
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any
+from typing import TYPE_CHECKING, Any, Callable
 
-import openpyxl
-import pyarrow as pa
+if TYPE_CHECKING:
+    import pyarrow as pa
+
+try:
+    import orjson  # type: ignore
+except ModuleNotFoundError:  # pragma: no cover - optional dependency
+    orjson = None
 
 SCHEMA_REL_PATH = Path("schemas") / "sales_monthly_v1.json"
 SCHEMA_ID = "sales_monthly_v1"
 EXPECTED_SOURCE_COLUMN_COUNT = 15
+WHITESPACE_RE = re.compile(r"\s+")
+REPORT_MONTH_RE = re.compile(r"(20\d{2}-\d{2})")
+WORKBOOK_ENGINES = ("calamine", "openpyxl")
+RAW_COMPRESSION_LEVEL = 3
+NUMERIC_TEXT_PATTERN = r"^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$"
 
 
 @dataclass(frozen=True)
@@ -21,10 +34,11 @@ class SchemaDefinition:
     schema_id: str
     expected_header_order: list[str]
     fields: list[dict[str, Any]]
+    expected_header_order_normalized: tuple[str, ...]
 
 
-def normalize_header(value: Any) -> str:
-    text = "" if value is None else str(value)
+@functools.lru_cache(maxsize=4096)
+def normalize_header(text: str) -> str:
     ascii_text = (
         unicodedata.normalize("NFKD", text)
         .encode("ascii", "ignore")
@@ -32,16 +46,47 @@ def normalize_header(value: Any) -> str:
         .strip()
         .lower()
     )
-    return re.sub(r"\s+", " ", ascii_text)
+    return WHITESPACE_RE.sub(" ", ascii_text)
 
 
 def parse_report_month(path: Path) -> str:
-    match = re.search(r"(20\d{2}-\d{2})", path.name)
+    match = REPORT_MONTH_RE.search(path.name)
     if match:
         return match.group(1)
     raise ValueError(f"Could not parse report month from file name: {path.name}")
 
 
+def encode_json(
+    payload: Any,
+    *,
+    indent: int | None,
+    default: Callable[[Any], Any] | None = None,
+) -> bytes:
+    """UTF-8 JSON with a trailing newline; indent is None (compact) or a space count."""
+    if orjson is not None and indent in (None, 2):
+        option = orjson.OPT_APPEND_NEWLINE | orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent == 2 else 0)
+        return orjson.dumps(payload, default=default, option=option)
+    separators = (",", ":") if indent is None else None
+    text = json.dumps(payload, ensure_ascii=False, indent=indent, separators=separators, default=default)
+    return (text + "\n").encode("utf-8")
+
+
+def file_sha256(path: Path) -> str:
+    with path.open("rb") as f:
+        if hasattr(hashlib, "file_digest"):
+            return hashlib.file_digest(f, "sha256").hexdigest()
+        hasher = hashlib.sha256()
+        for chunk in iter(lambda: f.read(4 * 1024 * 1024), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def atomic_write_bytes(path: Path, blob: bytes) -> None:
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    tmp_path.write_bytes(blob)
+    os.replace(tmp_path, path)
+
+
 def load_schema_definition(base_dir: Path) -> SchemaDefinition:
     schema_path = base_dir / SCHEMA_REL_PATH
     with schema_path.open("r", encoding="utf-8") as f:
@@ -60,14 +105,18 @@ def load_schema_definition(base_dir: Path) -> SchemaDefinition:
     if not fields:
         raise ValueError("Schema must define fields.")
 
+    expected_header_order = [str(x) for x in header_order]
     return SchemaDefinition(
         schema_id=schema_id,
-        expected_header_order=[str(x) for x in header_order],
+        expected_header_order=expected_header_order,
         fields=fields,
+        expected_header_order_normalized=tuple(normalize_header(x) for x in expected_header_order),
     )
 
 
 def build_arrow_schema(fields: list[dict[str, Any]]) -> pa.Schema:
+    import pyarrow as pa
+
     type_map: dict[str, Any] = {
         "string": pa.string(),
         "int32": pa.int32(),
@@ -87,23 +136,37 @@ def build_arrow_schema(fields: list[dict[str, Any]]) -> pa.Schema:
     return pa.schema(arrow_fields)
 
 
+def text_from_str(value: str) -> str | None:
+    text = value.strip()
+    return text if text else None
+
+
+def text_from_float(value: float) -> str | None:
+    if math.isnan(value):
+        return None
+    if value.is_integer():
+        return str(int(value))
+    text = format(value, "f").rstrip("0").rstrip(".")
+    return text if text else "0"
+
+
+TEXT_HANDLERS: dict[type, Callable[[Any], str | None]] = {
+    str: text_from_str,
+    bool: str,
+    int: str,
+    float: text_from_float,
+}
+
+
 def parse_text(value: Any) -> str | None:
     if value is None:
         return None
-    if isinstance(value, str):
-        text = value.strip()
-        return text if text else None
-    if isinstance(value, bool):
-        return str(value)
-    if isinstance(value, int):
-        return str(value)
-    if isinstance(value, float):
-        if math.isnan(value):
-            return None
-        if value.is_integer():
-            return str(int(value))
-        text = format(value, "f").rstrip("0").rstrip(".")
-        return text if text else "0"
+    handler = TEXT_HANDLERS.get(type(value))
+    if handler is not None:
+        return handler(value)
+    for kind, handler in TEXT_HANDLERS.items():
+        if isinstance(value, kind):
+            return handler(value)
     text = str(value).strip()
     return text if text else None
 
@@ -128,15 +191,80 @@ def parse_number(value: Any) -> float | None:
     return None
 
 
-def header_matches(actual_header: list[Any], expected_header: list[str]) -> bool:
-    if len(actual_header) < len(expected_header):
+def parse_number_column(values: list[Any]) -> pa.Array:
+    """Vectorized parse_number: numeric cells pass through, text cells are cleaned in Arrow."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    numbers: list[Any] = [None] * len(values)
+    text_positions: list[int] = []
+    text_values: list[str] = []
+    for index, value in enumerate(values):
+        value_type = type(value)
+        if value_type is float:
+            numbers[index] = value
+        elif value_type is int:
+            # Arrow refuses ints beyond 2**53 for float64; convert like parse_number does.
+            numbers[index] = float(value)
+        elif value_type is str:
+            text_positions.append(index)
+            text_values.append(value)
+        elif value is not None:
+            numbers[index] = parse_number(value)
+
+    if text_values:
+        cleaned = pc.utf8_trim_whitespace(pa.array(text_values, type=pa.string()))
+        cleaned = pc.replace_substring(cleaned, " ", "")
+        cleaned = pc.replace_substring(cleaned, "\u00A0", "")
+        cleaned = pc.replace_substring(cleaned, ",", ".")
+        valid = pc.match_substring_regex(cleaned, NUMERIC_TEXT_PATTERN)
+        parsed = pc.cast(pc.if_else(valid, cleaned, pa.scalar(None, pa.string())), pa.float64())
+        for index, raw, is_valid, number in zip(text_positions, text_values, valid.to_pylist(), parsed.to_pylist()):
+            # Anything the fast pattern rejects goes through the scalar parser for identical semantics.
+            numbers[index] = number if is_valid else parse_number(raw)
+
+    return pa.array(numbers, type=pa.float64(), from_pandas=True)
+
+
+def header_matches(actual_header: list[Any], schema: SchemaDefinition) -> bool:
+    expected_norm = schema.expected_header_order_normalized
+    if len(actual_header) < len(expected_norm):
         return False
-    actual_norm = [normalize_header(v) for v in actual_header[: len(expected_header)]]
-    expected_norm = [normalize_header(v) for v in expected_header]
+    actual_norm = tuple(normalize_header("" if v is None else str(v)) for v in actual_header[: len(expected_norm)])
     return actual_norm == expected_norm
 
 
-def open_workbook(path: Path):
+class CalamineSheet:
+    def __init__(self, sheet: Any) -> None:
+        self._sheet = sheet
+
+    def iter_rows(self, values_only: bool = True):
+        # skip_empty_area=False keeps row numbering aligned with openpyxl (row 1 = header).
+        for row in self._sheet.to_python(skip_empty_area=False):
+            yield tuple(row)
+
+
+class CalamineWorkbook:
+    def __init__(self, workbook: Any) -> None:
+        self._workbook = workbook
+        self.sheetnames = list(workbook.sheet_names)
+
+    def __getitem__(self, sheet_name: str) -> CalamineSheet:
+        return CalamineSheet(self._workbook.get_sheet_by_name(sheet_name))
+
+
+def open_workbook(path: Path, engine: str = "calamine"):
+    if engine not in WORKBOOK_ENGINES:
+        raise ValueError(f"Unsupported workbook engine: {engine}")
+    if engine == "calamine":
+        try:
+            from python_calamine import CalamineWorkbook as RustCalamineWorkbook  # type: ignore
+        except ModuleNotFoundError:
+            pass
+        else:
+            return CalamineWorkbook(RustCalamineWorkbook.from_path(str(path)))
+    import openpyxl
+
     return openpyxl.load_workbook(path, data_only=True, read_only=True)
 
 
@@ -1,23 +1,64 @@
 from __future__ import annotations
 
 import argparse
-import atexit
+import functools
+import hashlib
 import html
-import json
+import os
 import re
 import sys
+import tempfile
 from decimal import Decimal
 from datetime import datetime, timezone
 from pathlib import Path
 from typing import Any
 
+import pyarrow as pa
+
+from common import atomic_write_bytes, encode_json
+
 sys.dont_write_bytecode = True
 
+FETCH_BATCH_ROWS = 100_000
+ARTICLE_KEY_COLUMNS = ("filial", "avdelning", "artnr", "ean", "varutext")
+ARTICLE_RANKING_COLUMNS = {
+    "margin_risks": ARTICLE_KEY_COLUMNS
+    + ("net_sales", "gross_profit", "gross_margin_percent", "return_row_count", "negative_margin_row_count"),
+    "return_risks": ARTICLE_KEY_COLUMNS + ("units_sold", "net_sales", "gross_profit", "return_row_count"),
+    "product_top_sales": ARTICLE_KEY_COLUMNS + ("net_sales", "gross_profit", "gross_margin_percent", "units_sold"),
+    "product_top_profit": ARTICLE_KEY_COLUMNS + ("net_sales", "gross_profit", "gross_margin_percent", "units_sold"),
+    "low_margin_high_sales": ARTICLE_KEY_COLUMNS + ("net_sales", "gross_profit", "gross_margin_percent", "units_sold"),
+}
+REPORT_MONTH_VALUE_RE = re.compile(r"\d{4}-\d{2}")
+DUCKDB_MEMORY_LIMIT_RE = re.compile(r"\d+(\.\d+)?(KB|MB|GB|TB|%)")
+QUICKLOOK_ASSET_NAME_RE = re.compile(rb"kpi_quicklook-[0-9a-f]+\.(?:css|js)")
+KPI_COLUMNS = (
+    "report_month",
+    "filial",
+    "avdelning",
+    "artnr",
+    "ean",
+    "varutext",
+    "fors_sum_sum",
+    "tb_sum",
+    "antal_salda_sum",
+    "lager_antal_max",
+    "estimated_stock_value",
+    "ord_pris_avg",
+    "snitt_inpris_avg",
+    "gross_margin_percent_calc",
+    "return_row_count",
+    "negative_margin_row_count",
+    "has_negative_margin",
+    "has_net_return",
+)
+
 
 def utc_now_iso() -> str:
     return datetime.now(timezone.utc).replace(microsecond=0).isoformat()
 
 
+@functools.cache
 def require_duckdb():
     try:
         import duckdb  # type: ignore
@@ -31,25 +72,46 @@ def require_duckdb():
 def discover_curated_month_files(output_root: Path) -> dict[str, Path]:
     curated_base = output_root / "curated" / "sales_monthly" / "v1"
     mapping: dict[str, Path] = {}
-    for parquet_path in sorted(curated_base.glob("report_month_*/sales_monthly_curated_v1.parquet")):
-        partition_name = parquet_path.parent.name
-        if not partition_name.startswith("report_month_"):
+    if not curated_base.is_dir():
+        return mapping
+
+    curated_base = curated_base.resolve()
+    with os.scandir(curated_base) as entries:
+        partition_dirs = sorted(
+            (entry for entry in entries if entry.name.startswith("report_month_") and entry.is_dir()),
+            key=lambda entry: entry.name,
+        )
+
+    for entry in partition_dirs:
+        parquet_path = os.path.join(entry.path, "sales_monthly_curated_v1.parquet")
+        if not os.path.isfile(parquet_path):
             continue
-        month = partition_name[len("report_month_") :]
-        mapping[month] = parquet_path.resolve()
+        month = entry.name[len("report_month_") :]
+        mapping[month] = Path(parquet_path)
     return mapping
 
 
+def sql_quoted(value: Any) -> str:
+    return str(value).replace("'", "''")
+
+
+def build_scan_sql(months: list[str], mapping: dict[str, Path]) -> str:
+    paths_sql = ", ".join(f"'{sql_quoted(mapping[month])}'" for month in months)
+    return f"read_parquet([{paths_sql}], hive_partitioning = false, union_by_name = true)"
+
+
+@functools.lru_cache(maxsize=256)
 def is_valid_report_month(value: str) -> bool:
-    return bool(re.fullmatch(r"\d{4}-\d{2}", value))
+    return REPORT_MONTH_VALUE_RE.fullmatch(value) is not None
 
 
 def selected_history_months(
     all_months: list[str],
     target_month: str,
     history_months: int | None,
+    month_index: dict[str, int] | None = None,
 ) -> list[str]:
-    target_index = all_months.index(target_month)
+    target_index = month_index[target_month] if month_index is not None else all_months.index(target_month)
     months_up_to_target = all_months[: target_index + 1]
     if history_months is None:
         return months_up_to_target
@@ -58,186 +120,96 @@ def selected_history_months(
 
 def normalize_duckdb_memory_limit(value: str) -> str:
     cleaned = str(value).strip().upper().replace(" ", "")
-    if not re.fullmatch(r"\d+(\.\d+)?(KB|MB|GB|TB|%)", cleaned):
+    if not DUCKDB_MEMORY_LIMIT_RE.fullmatch(cleaned):
         raise ValueError("duckdb_memory_limit must be like 768MB, 1GB, or 50%.")
     return cleaned
 
 
-def fetch_rows(conn, sql: str, params: list[Any] | tuple[Any, ...] = ()) -> list[dict[str, Any]]:
+def configure_connection(conn, *, threads: int, memory_limit: str) -> None:
+    temp_directory = Path(tempfile.gettempdir()) / "duckdb_kpi"
+    conn.execute(f"SET threads TO {threads}")
+    conn.execute(f"SET memory_limit='{memory_limit}'")
+    conn.execute("SET preserve_insertion_order = false")
+    conn.execute("SET parquet_metadata_cache = true")
+    conn.execute(f"SET temp_directory='{sql_quoted(temp_directory.as_posix())}'")
+
+
+def open_kpi_connection(*, threads: int = 2, memory_limit: str = "768MB"):
+    duckdb = require_duckdb()
+    conn = duckdb.connect(database=":memory:")
+    configure_connection(
+        conn,
+        threads=max(1, int(threads)),
+        memory_limit=normalize_duckdb_memory_limit(memory_limit),
+    )
+    return conn
+
+
+def fetch_table(conn, sql: str, params: list[Any] | tuple[Any, ...] | dict[str, Any] = ()) -> pa.Table:
     result = conn.execute(sql, params)
-    columns = [desc[0] for desc in result.description]
-    return [dict(zip(columns, row)) for row in result.fetchall()]
+    if hasattr(result, "to_arrow_reader"):
+        table = result.to_arrow_reader(FETCH_BATCH_ROWS).read_all()
+    else:
+        table = result.fetch_record_batch(FETCH_BATCH_ROWS).read_all()
+    for index, field in enumerate(table.schema):
+        if pa.types.is_decimal(field.type):
+            target = pa.int64() if field.type.scale == 0 else pa.float64()
+            table = table.set_column(index, field.name, table.column(index).cast(target))
+    return table
+
+
+def fetch_rows(conn, sql: str, params: list[Any] | tuple[Any, ...] = ()) -> list[dict[str, Any]]:
+    return fetch_table(conn, sql, params).to_pylist()
+
+
+def fetch_ranked_sections(
+    conn,
+    sql: str,
+    params: dict[str, Any],
+    columns_by_section: dict[str, tuple[str, ...]],
+) -> dict[str, list[dict[str, Any]]]:
+    table = fetch_table(conn, sql, params).sort_by([("section", "ascending"), ("section_rank", "ascending")])
+    sections: dict[str, list[dict[str, Any]]] = {section: [] for section in columns_by_section}
+    for row in table.to_pylist():
+        section = row["section"]
+        sections[section].append({column: row[column] for column in columns_by_section[section]})
+    return sections
 
 
 def fetch_one(conn, sql: str, params: list[Any] | tuple[Any, ...] = ()) -> dict[str, Any]:
-    rows = fetch_rows(conn, sql, params)
-    return rows[0] if rows else {}
+    result = conn.execute(sql, params)
+    row = result.fetchone()
+    if row is None:
+        return {}
+    columns = [desc[0] for desc in result.description]
+    return dict(zip(columns, row))
 
 
-def to_json_compatible(value: Any) -> Any:
+def json_default(value: Any) -> Any:
     if isinstance(value, Decimal):
+        exponent = value.as_tuple().exponent
+        if isinstance(exponent, int) and exponent >= 0:
+            return int(value)
         if value == value.to_integral_value():
             return int(value)
         return float(value)
-    if isinstance(value, dict):
-        return {k: to_json_compatible(v) for k, v in value.items()}
-    if isinstance(value, list):
-        return [to_json_compatible(v) for v in value]
     if isinstance(value, tuple):
-        return [to_json_compatible(v) for v in value]
-    return value
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
 
 
-def json_for_html_script(payload: dict[str, Any]) -> str:
-    raw = json.dumps(payload, ensure_ascii=False)
-    return raw.replace("</", "<\\/")
+def json_for_html_script(payload: dict[str, Any]) -> bytes:
+    raw = encode_json(payload, indent=None, default=json_default).rstrip(b"\n")
+    return raw.replace(b"</", b"<\\/")
 
 
-def build_quicklook_html(payload: dict[str, Any]) -> str:
-    report_month = html.escape(str(payload.get("report_month", "")))
-    generated_at = html.escape(str(payload.get("generated_at_utc", "")))
-    payload_json = json_for_html_script(payload)
-    template = """<!doctype html>
+QUICKLOOK_TEMPLATE = """<!doctype html>
 <html lang="sv">
 <head>
   <meta charset="utf-8" />
   <meta name="viewport" content="width=device-width, initial-scale=1" />
   <title>KPI Quicklook __REPORT_MONTH__</title>
-  <style>
-    :root {
-      --bg: #f3f6fb;
-      --surface: #ffffff;
-      --text: #0f172a;
-      --muted: #4b5563;
-      --line: #d8e1ee;
-      --sales: #0284c7;
-      --profit: #16a34a;
-      --warn: #ea580c;
-    }
-    * { box-sizing: border-box; }
-    body { margin: 0; background: var(--bg); color: var(--text); font-family: Segoe UI, Arial, sans-serif; }
-    .page { max-width: 1240px; margin: 0 auto; padding: 20px; display: grid; gap: 14px; }
-    .card { background: var(--surface); border: 1px solid var(--line); border-radius: 14px; padding: 14px; }
-    h1, h2 { margin: 0 0 10px 0; }
-    .meta { color: var(--muted); font-size: 13px; }
-    .toolbar-sticky {
-      position: sticky;
-      top: 0;
-      z-index: 45;
-      margin: 0 -14px 10px;
-      padding: 8px 14px 10px;
-      border-bottom: 1px solid var(--line);
-      background: linear-gradient(180deg, rgba(255,255,255,0.98), rgba(255,255,255,0.92));
-      backdrop-filter: blur(2px);
-    }
-    .toolbar { display: flex; flex-wrap: wrap; gap: 8px; align-items: center; }
-    .btn { border: 1px solid var(--line); background: #fff; color: var(--text); border-radius: 10px; padding: 7px 10px; font-size: 13px; cursor: pointer; }
-    .dropdown { position: relative; display: inline-block; }
-    .dropdown-panel { position: absolute; top: calc(100% + 6px); left: 0; min-width: 280px; max-height: 320px; overflow: auto; border: 1px solid var(--line); background: #fff; border-radius: 12px; padding: 8px; z-index: 30; box-shadow: 0 8px 24px rgba(2, 6, 23, 0.12); display: none; }
-    .dropdown-panel.open { display: block; }
-    .check-row { display: flex; gap: 8px; align-items: center; font-size: 13px; padding: 5px 4px; }
-    .kpi-grid { margin-top: 10px; display: grid; grid-template-columns: repeat(auto-fit, minmax(170px, 1fr)); gap: 8px; }
-    .kpi-grid-secondary { margin-top: 8px; grid-template-columns: repeat(auto-fit, minmax(220px, 1fr)); }
-    .kpi { border: 1px solid var(--line); border-radius: 10px; padding: 10px; background: #fbfdff; }
-    .kpi span { display: block; color: var(--muted); font-size: 12px; margin-bottom: 3px; }
-    .kpi strong { font-size: 20px; }
-    .split { display: grid; grid-template-columns: 1fr 1fr; gap: 12px; }
-    .share-head, .share-row { display: grid; grid-template-columns: 180px 1fr 66px 1fr 66px; gap: 7px; align-items: center; }
-    .share-head { color: var(--muted); font-size: 12px; margin-bottom: 8px; }
-    .share-row { margin-bottom: 7px; font-size: 13px; }
-    .bar-wrap { height: 10px; border-radius: 999px; background: #edf2f8; overflow: hidden; }
-    .bar { height: 100%; border-radius: 999px; }
-    .bar-sales { background: var(--sales); }
-    .bar-profit { background: var(--profit); }
-    .viz-grid { display: grid; grid-template-columns: 1.3fr 1fr; gap: 12px; }
-    .viz-panel {
-      border: 1px solid var(--line);
-      border-radius: 14px;
-      padding: 14px;
-      background: linear-gradient(180deg, #ffffff 0%, #f8fbff 100%);
-      box-shadow: 0 14px 30px rgba(15, 23, 42, 0.07);
-    }
-    .viz-kicker {
-      display: inline-block;
-      margin: 0 0 6px 0;
-      font-size: 11px;
-      font-weight: 700;
-      letter-spacing: 0.08em;
-      text-transform: uppercase;
-      color: #1d4ed8;
-    }
-    .viz-panel h3 { margin: 0 0 4px 0; font-size: 16px; line-height: 1.3; }
-    .viz-panel .meta { margin: 0 0 10px 0; font-size: 12px; line-height: 1.4; }
-    .chart-frame {
-      border: 1px solid #dbe7f5;
-      border-radius: 10px;
-      background: radial-gradient(circle at 20% 0%, #f5fbff, #ffffff 58%);
-      padding: 10px;
-    }
-    .store-trend { margin-top: 0; }
-    .store-trend-chart { width: 100%; height: 280px; display: block; }
-    .store-trend-legend { margin-top: 10px; display: flex; flex-wrap: wrap; gap: 8px 10px; }
-    .trend-legend-item {
-      display: inline-flex;
-      align-items: center;
-      gap: 6px;
-      font-size: 12px;
-      color: var(--muted);
-      border: 1px solid #e5edf8;
-      background: #f8fbff;
-      border-radius: 999px;
-      padding: 3px 8px;
-    }
-    .trend-dot { width: 8px; height: 8px; border-radius: 999px; display: inline-block; }
-    .store-trend-empty { color: var(--muted); font-size: 12px; margin: 6px 0; }
-    .store-stock { margin-top: 0; }
-    .store-stock-empty { color: var(--muted); font-size: 12px; margin: 6px 0; }
-    .stock-bars { display: grid; gap: 10px; }
-    .stock-bar-row { display: grid; grid-template-columns: 132px 1fr 102px; gap: 8px; align-items: center; font-size: 12px; }
-    .stock-bar-label { color: var(--text); font-weight: 600; }
-    .stock-bar-track { height: 12px; border-radius: 999px; background: #e7eef7; overflow: hidden; }
-    .stock-bar-fill { height: 100%; border-radius: 999px; background: #2563eb; }
-    .stock-bar-value { text-align: right; color: #334155; font-weight: 600; }
-    .stock-ratio { margin-top: 10px; }
-    .stock-ratio-head { margin: 0 0 4px 0; font-size: 12px; color: var(--muted); }
-    .stock-ratio-empty { color: var(--muted); font-size: 12px; margin: 4px 0; }
-    .stock-ratio-bars { display: grid; gap: 8px; }
-    .stock-ratio-row { display: grid; grid-template-columns: 132px 1fr 132px; gap: 8px; align-items: center; font-size: 12px; }
-    .stock-ratio-track { height: 12px; border-radius: 999px; background: #e8edf4; overflow: hidden; }
-    .stock-ratio-fill { height: 100%; border-radius: 999px; background: #0ea5e9; }
-    .stock-ratio-value { text-align: right; color: #1f2937; font-weight: 600; font-variant-numeric: tabular-nums; }
-    table { width: 100%; border-collapse: collapse; font-size: 13px; }
-    th, td { padding: 8px 6px; border-bottom: 1px solid var(--line); text-align: left; }
-    .num { text-align: right; white-space: nowrap; font-variant-numeric: tabular-nums; }
-    .col-ean { font-family: ui-monospace, SFMono-Regular, Menlo, Consolas, monospace; font-size: 12px; letter-spacing: 0.02em; white-space: nowrap; }
-    .risk-pills { display: flex; flex-wrap: wrap; gap: 6px; }
-    .warn-pill-btn { display: inline-flex; align-items: center; border: 1px solid #fed7aa; background: #fff7ed; color: #9a3412; border-radius: 999px; padding: 5px 10px; font-size: 12px; font-weight: 600; cursor: pointer; }
-    .warn-pill-btn.active { background: #9a3412; color: #ffffff; border-color: #9a3412; }
-    .risk-analysis { margin-top: 10px; border: 1px solid var(--line); border-radius: 10px; padding: 10px; background: #fbfdff; }
-    .risk-analysis h3 { margin: 0 0 6px 0; font-size: 14px; }
-    .risk-kpi-grid { display: grid; grid-template-columns: repeat(auto-fit, minmax(160px, 1fr)); gap: 8px; margin-top: 8px; }
-    .risk-kpi { border: 1px solid var(--line); border-radius: 8px; padding: 8px; background: #fff; }
-    .risk-kpi span { display: block; color: var(--muted); font-size: 12px; margin-bottom: 3px; }
-    .risk-kpi strong { font-size: 16px; }
-    .risk-table-grid { margin-top: 10px; display: grid; grid-template-columns: repeat(auto-fit, minmax(340px, 1fr)); gap: 10px; }
-    .risk-table-wrap { border: 1px solid var(--line); border-radius: 10px; background: #ffffff; padding: 8px; overflow-x: auto; }
-    .risk-section-title { margin: 0 0 6px 0; font-size: 12px; font-weight: 700; color: #334155; text-transform: uppercase; letter-spacing: 0.04em; }
-    .risk-table { width: 100%; border-collapse: collapse; font-size: 12px; min-width: 520px; }
-    .risk-table th, .risk-table td { padding: 6px 7px; border-bottom: 1px solid #e6edf7; text-align: left; vertical-align: top; }
-    .risk-table th { color: #475569; font-weight: 700; background: #f8fbff; white-space: nowrap; }
-    .risk-table tbody tr:last-child td { border-bottom: none; }
-    .risk-empty { color: var(--muted); font-size: 12px; }
-    @media (max-width: 980px) {
-      .split { grid-template-columns: 1fr; }
-      .viz-grid { grid-template-columns: 1fr; }
-      .share-head, .share-row { grid-template-columns: 140px 1fr 58px 1fr 58px; }
-      .stock-bar-row { grid-template-columns: 110px 1fr 90px; }
-      .stock-ratio-row { grid-template-columns: 110px 1fr 110px; }
-      .toolbar-sticky { margin: 0 -14px 8px; padding: 8px 14px; }
-      .risk-table-grid { grid-template-columns: 1fr; }
-      .risk-table { min-width: 460px; }
-    }
-  </style>
+  <link rel="stylesheet" href="__CSS_HREF__" />
 </head>
 <body>
   <main class="page">
@@ -384,1072 +356,139 @@ def build_quicklook_html(payload: dict[str, Any]) -> str:
   </main>
 
   <script id="kpiPayload" type="application/json">__PAYLOAD_JSON__</script>
-  <script>
-    (function () {
-      const data = JSON.parse(document.getElementById("kpiPayload").textContent || "{}");
-      const topN = Number(data.top_n || 10);
-      const formatMoney = new Intl.NumberFormat("sv-SE", { maximumFractionDigits: 0 });
-      const formatQty = new Intl.NumberFormat("sv-SE", { maximumFractionDigits: 0 });
-      const formatDecimal = new Intl.NumberFormat("sv-SE", { minimumFractionDigits: 0, maximumFractionDigits: 2 });
-      const monthNames = ["Jan", "Feb", "Mar", "Apr", "Maj", "Jun", "Jul", "Aug", "Sep", "Okt", "Nov", "Dec"];
-
-      const deptToggle = document.getElementById("deptToggle");
-      const deptPanel = document.getElementById("deptPanel");
-      const deptOptions = document.getElementById("deptOptions");
-      const deptAll = document.getElementById("deptAll");
-      const deptNone = document.getElementById("deptNone");
-      const storeToggle = document.getElementById("storeToggle");
-      const storePanel = document.getElementById("storePanel");
-      const storeOptions = document.getElementById("storeOptions");
-      const storeAll = document.getElementById("storeAll");
-      const storeNone = document.getElementById("storeNone");
-      const yearToggle = document.getElementById("yearToggle");
-      const yearPanel = document.getElementById("yearPanel");
-      const yearOptions = document.getElementById("yearOptions");
-      const yearAll = document.getElementById("yearAll");
-      const yearNone = document.getElementById("yearNone");
-      const monthToggle = document.getElementById("monthToggle");
-      const monthPanel = document.getElementById("monthPanel");
-      const monthOptions = document.getElementById("monthOptions");
-      const monthAll = document.getElementById("monthAll");
-      const monthNone = document.getElementById("monthNone");
-      const selectedInfo = document.getElementById("selectedInfo");
-      const storeTrendEmpty = document.getElementById("storeTrendEmpty");
-      const storeTrendSvg = document.getElementById("storeTrendSvg");
-      const storeTrendLegend = document.getElementById("storeTrendLegend");
-      const storeStockEmpty = document.getElementById("storeStockEmpty");
-      const storeStockBars = document.getElementById("storeStockBars");
-      const storeStockRatioEmpty = document.getElementById("storeStockRatioEmpty");
-      const storeStockRatioBars = document.getElementById("storeStockRatioBars");
-
-      const fallbackMonth = String(data.report_month || "");
-      const fallbackYear = fallbackMonth.slice(0, 4);
-      const fallbackMonthNumber = Number(fallbackMonth.slice(5, 7)) || 1;
-      const riskState = { activeKey: "negative_margin" };
-
-      function esc(value) {
-        return String(value ?? "")
-          .replaceAll("&", "&amp;")
-          .replaceAll("<", "&lt;")
-          .replaceAll(">", "&gt;");
-      }
-
-      function toNumber(value) {
-        const n = Number(value);
-        return Number.isFinite(n) ? n : 0;
-      }
-
-      function pct(part, total) {
-        if (!Number.isFinite(part) || !Number.isFinite(total) || total === 0) return 0;
-        return (part / total) * 100;
-      }
-
-      function monthLabel(monthNumber) {
-        const n = Number(monthNumber);
-        if (!Number.isFinite(n) || n < 1 || n > 12) return String(monthNumber);
-        return String(n).padStart(2, "0") + " " + monthNames[n - 1];
-      }
-
-      function displayStoreName(value) {
-        const raw = String(value || "");
-        const withoutPrefix = raw.replace(/^EBB_/i, "");
-        return withoutPrefix.replaceAll("_", " ").trim() || raw;
-      }
-
-      function reportMonthLabel(reportMonth) {
-        const text = String(reportMonth || "");
-        if (text.length < 7) return text;
-        const year = text.slice(0, 4);
-        const month = Number(text.slice(5, 7));
-        return monthLabel(month) + " " + year;
-      }
-
-      function daysInReportMonth(reportMonth) {
-        const text = String(reportMonth || "");
-        if (!/^\\d{4}-\\d{2}$/.test(text)) return 30;
-        const year = Number(text.slice(0, 4));
-        const month = Number(text.slice(5, 7));
-        if (!Number.isFinite(year) || !Number.isFinite(month) || month < 1 || month > 12) return 30;
-        return new Date(year, month, 0).getDate();
-      }
-
-      function normalizeRows(rows, defaultMonth) {
-        const defaultMonthText = String(defaultMonth || fallbackMonth);
-        const defaultYear = defaultMonthText.slice(0, 4) || fallbackYear;
-        const defaultMonthNum = Number(defaultMonthText.slice(5, 7)) || fallbackMonthNumber;
-        return (rows || []).map((row) => {
-          const reportMonth = String(row.report_month || defaultMonthText);
-          const reportYear = String(row.report_year || reportMonth.slice(0, 4) || defaultYear);
-          const reportMonthNumber = Number(row.report_month_number || Number(reportMonth.slice(5, 7)) || defaultMonthNum);
-          return {
-            ...row,
-            report_month: reportMonth,
-            report_year: reportYear,
-            report_month_number: reportMonthNumber,
-          };
-        });
-      }
-
-      const historyRows = normalizeRows(
-        (data.time_store_department_breakdown && data.time_store_department_breakdown.length > 0)
-          ? data.time_store_department_breakdown
-          : (data.store_department_breakdown || []),
-        fallbackMonth
-      );
-      const marginRiskRows = normalizeRows(
-        (data.time_margin_risk_items_top_n && data.time_margin_risk_items_top_n.length > 0)
-          ? data.time_margin_risk_items_top_n
-          : (data.margin_risk_items_top_n || []),
-        fallbackMonth
-      );
-      const returnRiskRows = normalizeRows(
-        (data.time_return_risk_items_top_n && data.time_return_risk_items_top_n.length > 0)
-          ? data.time_return_risk_items_top_n
-          : (data.return_risk_items_top_n || []),
-        fallbackMonth
-      );
-      const lowMarginRows = normalizeRows(
-        (data.time_low_margin_high_sales_top_n && data.time_low_margin_high_sales_top_n.length > 0)
-          ? data.time_low_margin_high_sales_top_n
-          : (data.low_margin_high_sales_top_n || []),
-        fallbackMonth
-      );
-
-      const allDepartments = (data.available_departments && data.available_departments.length > 0)
-        ? data.available_departments.map((value) => String(value)).filter((value) => value.length > 0)
-        : Array.from(new Set(historyRows.map((row) => String(row.avdelning || "")).filter((value) => value.length > 0))).sort();
-      const allStores = (data.available_stores && data.available_stores.length > 0)
-        ? data.available_stores.map((value) => String(value)).filter((value) => value.length > 0)
-        : Array.from(new Set(historyRows.map((row) => String(row.filial || "")).filter((value) => value.length > 0))).sort();
-      const allYears = (data.available_report_years && data.available_report_years.length > 0)
-        ? data.available_report_years.map((value) => String(value)).filter((value) => value.length > 0)
-        : Array.from(new Set(historyRows.map((row) => String(row.report_year || "")).filter((value) => value.length > 0))).sort();
-      const allMonthNumbers = (data.available_month_numbers && data.available_month_numbers.length > 0)
-        ? data.available_month_numbers.map((value) => Number(value)).filter((value) => Number.isFinite(value)).sort((a, b) => a - b)
-        : Array.from(new Set(historyRows.map((row) => Number(row.report_month_number)).filter((value) => Number.isFinite(value)))).sort((a, b) => a - b);
-
-      const selectedDepartments = new Set(allDepartments);
-      const selectedStores = new Set(allStores);
-      const selectedYears = new Set(allYears);
-      const selectedMonthNumbers = new Set(allMonthNumbers);
-
-      function fmtMoney(value) { return formatMoney.format(toNumber(value)); }
-      function fmtQty(value) { return formatQty.format(toNumber(value)); }
-      function fmtDecimal(value) { return formatDecimal.format(toNumber(value)); }
-      function fmtPct(value, decimals = 1) { return toNumber(value).toFixed(decimals) + "%"; }
-      function sumBy(rows, key) { return rows.reduce((acc, row) => acc + toNumber(row[key]), 0); }
-      function formatEan(value) {
-        const text = String(value ?? "").trim();
-        return text.length > 0 ? text : "-";
-      }
-
-      function aggregateBy(rows, key, valueKey) {
-        const totals = new Map();
-        for (const row of rows) {
-          const group = String(row[key] || "Okand");
-          totals.set(group, (totals.get(group) || 0) + toNumber(row[valueKey]));
-        }
-        return Array.from(totals.entries()).map(([name, total]) => ({ name, total }));
-      }
-
-      function aggregateStoreOrDepartment(rows, key) {
-        const byKey = new Map();
-        for (const row of rows) {
-          const name = String(row[key] || "Okand");
-          const current = byKey.get(name) || {
-            name: name,
-            net_sales: 0,
-            gross_profit: 0,
-            units_sold: 0,
-            estimated_stock_value: 0,
-            stock_units: 0,
-            stock_margin_value: 0,
-          };
-          current.net_sales += toNumber(row.net_sales);
-          current.gross_profit += toNumber(row.gross_profit);
-          current.units_sold += toNumber(row.units_sold);
-          current.estimated_stock_value += toNumber(row.estimated_stock_value);
-          current.stock_units += toNumber(row.stock_units);
-          current.stock_margin_value += toNumber(row.stock_margin_value);
-          byKey.set(name, current);
-        }
-        return Array.from(byKey.values());
-      }
-
-      function aggregateArticles(rows, sortKey, ascending) {
-        const grouped = new Map();
-        for (const row of rows) {
-          const avdelning = String(row.avdelning || "Okand");
-          const artnr = String(row.artnr || "");
-          const ean = String(row.ean || "");
-          const varutext = String(row.varutext || "");
-          const key = avdelning + "||" + artnr + "||" + ean + "||" + varutext;
-          const current = grouped.get(key) || {
-            avdelning: avdelning,
-            artnr: artnr,
-            ean: ean,
-            varutext: varutext,
-            net_sales: 0,
-            gross_profit: 0,
-            units_sold: 0,
-          };
-          current.net_sales += toNumber(row.net_sales);
-          current.gross_profit += toNumber(row.gross_profit);
-          current.units_sold += toNumber(row.units_sold);
-          grouped.set(key, current);
-        }
-        return Array.from(grouped.values())
-          .map((row) => ({
-            ...row,
-            gross_margin_percent: pct(toNumber(row.gross_profit), toNumber(row.net_sales)),
-          }))
-          .sort((a, b) => {
-            const diff = toNumber(a[sortKey]) - toNumber(b[sortKey]);
-            return ascending ? diff : -diff;
-          });
-      }
-
-      function inSelectedFilters(row) {
-        const avdelning = String(row.avdelning || "");
-        const filial = String(row.filial || "");
-        const reportYear = String(row.report_year || "");
-        const reportMonthNumber = Number(row.report_month_number);
-        return selectedDepartments.has(avdelning)
-          && selectedStores.has(filial)
-          && selectedYears.has(reportYear)
-          && selectedMonthNumbers.has(reportMonthNumber);
-      }
-
-      function inSelectedFiltersWithoutDepartment(row) {
-        const filial = String(row.filial || "");
-        const reportYear = String(row.report_year || "");
-        const reportMonthNumber = Number(row.report_month_number);
-        return selectedStores.has(filial)
-          && selectedYears.has(reportYear)
-          && selectedMonthNumbers.has(reportMonthNumber);
-      }
-
-      function getFilteredRows() {
-        return historyRows.filter((row) => inSelectedFilters(row));
-      }
-
-      function getDepartmentFilterOrder() {
-        const salesByDepartment = new Map();
-        for (const row of historyRows) {
-          if (!inSelectedFiltersWithoutDepartment(row)) continue;
-          const department = String(row.avdelning || "");
-          if (!department) continue;
-          const current = salesByDepartment.get(department) || 0;
-          salesByDepartment.set(department, current + toNumber(row.net_sales));
-        }
-        return [...allDepartments].sort((a, b) => {
-          const salesDiff = (salesByDepartment.get(b) || 0) - (salesByDepartment.get(a) || 0);
-          if (Math.abs(salesDiff) > 0.000001) return salesDiff;
-          return a.localeCompare(b, "sv");
-        });
-      }
-
-      function getUniqueReportMonths(rows) {
-        return Array.from(new Set(rows.map((row) => String(row.report_month || ""))))
-          .filter((value) => value.length > 0)
-          .sort();
-      }
-
-      function getLatestReportMonth(rows) {
-        const months = getUniqueReportMonths(rows);
-        return months.length === 0 ? null : months[months.length - 1];
-      }
-
-      function renderCheckOptions(container, values, selectedSet, dataKey, labelFn, parseValueFn) {
-        if (!container) return;
-        container.innerHTML = values.map((value) => {
-          const valueText = String(value);
-          const checked = selectedSet.has(value) ? "checked" : "";
-          return '<label class="check-row"><input type="checkbox" data-' + dataKey + '="' + esc(valueText) + '" ' + checked + ' />' + esc(labelFn(value)) + "</label>";
-        }).join("");
-        container.querySelectorAll("input[type='checkbox']").forEach((node) => {
-          node.addEventListener("change", (event) => {
-            const target = event.target;
-            if (!(target instanceof HTMLInputElement)) return;
-            const raw = target.getAttribute("data-" + dataKey) || "";
-            const parsed = parseValueFn(raw);
-            if (target.checked) selectedSet.add(parsed); else selectedSet.delete(parsed);
-            render();
-          });
-        });
-      }
-
-      function renderShareRows(containerId, rows, labelKey) {
-        const container = document.getElementById(containerId);
-        if (!container) return;
-        if (rows.length === 0) {
-          container.innerHTML = '<p class="meta">Ingen data för valt urval.</p>';
-          return;
-        }
-        container.innerHTML = rows.map((row) => {
-          const salesPct = Math.max(0, Math.min(100, toNumber(row.sales_share_percent)));
-          const profitPct = Math.max(0, Math.min(100, toNumber(row.profit_share_percent)));
-          const rawLabel = String(row[labelKey] || "");
-          const label = labelKey === "filial" ? displayStoreName(rawLabel) : rawLabel;
-          return '<div class="share-row">'
-            + '<div>' + esc(label) + '</div>'
-            + '<div class="bar-wrap"><div class="bar bar-sales" style="width:' + salesPct.toFixed(2) + '%"></div></div>'
-            + '<div>' + fmtPct(salesPct, 1) + '</div>'
-            + '<div class="bar-wrap"><div class="bar bar-profit" style="width:' + profitPct.toFixed(2) + '%"></div></div>'
-            + '<div>' + fmtPct(profitPct, 1) + '</div>'
-            + '</div>';
-        }).join("");
-      }
-
-      function renderStoreTrend(filteredRows) {
-        if (!storeTrendEmpty || !storeTrendSvg || !storeTrendLegend) return;
-        const months = getUniqueReportMonths(filteredRows);
-        if (months.length < 2) {
-          storeTrendEmpty.textContent = "Välj minst två perioder för att visa grafen.";
-          storeTrendEmpty.style.display = "block";
-          storeTrendSvg.style.display = "none";
-          storeTrendSvg.innerHTML = "";
-          storeTrendLegend.innerHTML = "";
-          return;
-        }
-
-        const byStoreMonth = new Map();
-        const storeSet = new Set();
-        for (const row of filteredRows) {
-          const store = String(row.filial || "");
-          const month = String(row.report_month || "");
-          if (!store || !month) continue;
-          storeSet.add(store);
-          const key = store + "||" + month;
-          byStoreMonth.set(key, (byStoreMonth.get(key) || 0) + toNumber(row.net_sales));
-        }
-
-        const stores = Array.from(storeSet);
-        if (stores.length === 0) {
-          storeTrendEmpty.textContent = "Ingen butiksdata för valt urval.";
-          storeTrendEmpty.style.display = "block";
-          storeTrendSvg.style.display = "none";
-          storeTrendSvg.innerHTML = "";
-          storeTrendLegend.innerHTML = "";
-          return;
-        }
-
-        const series = stores.map((store) => {
-          const values = months.map((month) => toNumber(byStoreMonth.get(store + "||" + month) || 0));
-          const total = values.reduce((acc, value) => acc + value, 0);
-          return { store: store, values: values, total: total };
-        }).sort((a, b) => b.total - a.total);
-
-        let minValue = 0;
-        let maxValue = 0;
-        for (const row of series) {
-          for (const value of row.values) {
-            if (value < minValue) minValue = value;
-            if (value > maxValue) maxValue = value;
-          }
-        }
-        if (Math.abs(maxValue - minValue) < 0.000001) {
-          maxValue = minValue + 1;
-        }
-
-        const width = 760;
-        const height = 260;
-        const left = 44;
-        const right = 10;
-        const top = 12;
-        const bottom = 26;
-        const plotWidth = width - left - right;
-        const plotHeight = height - top - bottom;
-        const xStep = months.length > 1 ? plotWidth / (months.length - 1) : 0;
-        const palette = ["#0284c7", "#16a34a", "#ea580c", "#7c3aed", "#0f766e", "#be123c", "#0369a1", "#4338ca"];
-
-        function xAt(index) {
-          return left + (index * xStep);
-        }
-
-        function yAt(value) {
-          return top + ((maxValue - value) / (maxValue - minValue)) * plotHeight;
-        }
-
-        const parts = [];
-        const ticks = 4;
-        for (let index = 0; index <= ticks; index += 1) {
-          const value = maxValue - ((maxValue - minValue) * index / ticks);
-          const y = yAt(value);
-          parts.push('<line x1="' + left.toFixed(2) + '" y1="' + y.toFixed(2) + '" x2="' + (left + plotWidth).toFixed(2) + '" y2="' + y.toFixed(2) + '" stroke="#e6edf7" stroke-width="1" />');
-          parts.push('<text x="' + (left - 6).toFixed(2) + '" y="' + (y + 4).toFixed(2) + '" fill="#6b7280" font-size="10" text-anchor="end">' + esc(fmtMoney(value)) + "</text>");
-        }
-
-        if (minValue < 0 && maxValue > 0) {
-          const yZero = yAt(0);
-          parts.push('<line x1="' + left.toFixed(2) + '" y1="' + yZero.toFixed(2) + '" x2="' + (left + plotWidth).toFixed(2) + '" y2="' + yZero.toFixed(2) + '" stroke="#9ca3af" stroke-width="1.2" stroke-dasharray="3 3" />');
-        }
-
-        const labelStep = months.length > 8 ? Math.ceil(months.length / 8) : 1;
-        for (let index = 0; index < months.length; index += 1) {
-          const x = xAt(index);
-          if (index % labelStep === 0 || index === months.length - 1) {
-            parts.push('<text x="' + x.toFixed(2) + '" y="' + (height - 7).toFixed(2) + '" fill="#6b7280" font-size="10" text-anchor="middle">' + esc(reportMonthLabel(months[index])) + "</text>");
-          }
-        }
-
-        for (let seriesIndex = 0; seriesIndex < series.length; seriesIndex += 1) {
-          const row = series[seriesIndex];
-          const color = palette[seriesIndex % palette.length];
-          const points = row.values.map((value, valueIndex) => ({
-            x: xAt(valueIndex),
-            y: yAt(value),
-          }));
-          if (points.length > 1) {
-            const areaPath = points
-              .map((point, pointIndex) => (pointIndex === 0 ? "M" : "L") + point.x.toFixed(2) + "," + point.y.toFixed(2))
-              .join(" ")
-              + " L" + points[points.length - 1].x.toFixed(2) + "," + (top + plotHeight).toFixed(2)
-              + " L" + points[0].x.toFixed(2) + "," + (top + plotHeight).toFixed(2)
-              + " Z";
-            parts.push('<path d="' + areaPath + '" fill="' + color + '" opacity="0.06" />');
-          }
-          const path = points.map((point, pointIndex) =>
-            (pointIndex === 0 ? "M" : "L") + point.x.toFixed(2) + "," + point.y.toFixed(2)
-          ).join(" ");
-          parts.push('<path d="' + path + '" fill="none" stroke="' + color + '" stroke-width="2.2" stroke-linecap="round" stroke-linejoin="round" />');
-          const lastPoint = points[points.length - 1];
-          if (lastPoint) {
-            parts.push('<circle cx="' + lastPoint.x.toFixed(2) + '" cy="' + lastPoint.y.toFixed(2) + '" r="2.8" fill="' + color + '" />');
-          }
-        }
-
-        storeTrendEmpty.style.display = "none";
-        storeTrendSvg.style.display = "block";
-        storeTrendSvg.innerHTML = parts.join("");
-        storeTrendLegend.innerHTML = series.map((row, index) => {
-          const color = palette[index % palette.length];
-          return '<span class="trend-legend-item"><span class="trend-dot" style="background:' + color + '"></span>' + esc(displayStoreName(row.store)) + " (" + esc(fmtMoney(row.total)) + ")</span>";
-        }).join("");
-      }
-
-      function renderStoreStockBars(filteredRows) {
-        if (!storeStockEmpty || !storeStockBars || !storeStockRatioEmpty || !storeStockRatioBars) return;
-        const latestMonth = getLatestReportMonth(filteredRows);
-        if (!latestMonth) {
-          storeStockEmpty.textContent = "Ingen lagerdata för valt urval.";
-          storeStockEmpty.style.display = "block";
-          storeStockBars.innerHTML = "";
-          storeStockRatioEmpty.textContent = "Ingen data för dagberäkning.";
-          storeStockRatioEmpty.style.display = "block";
-          storeStockRatioBars.innerHTML = "";
-          return;
-        }
-
-        const latestRows = filteredRows.filter((row) => String(row.report_month || "") === latestMonth);
-        const storeStocks = aggregateStoreOrDepartment(latestRows, "filial")
-          .map((row) => ({
-            filial: row.name,
-            estimated_stock_value: Math.max(0, toNumber(row.estimated_stock_value)),
-            net_sales: toNumber(row.net_sales),
-          }))
-          .sort((a, b) => b.estimated_stock_value - a.estimated_stock_value);
-
-        if (storeStocks.length === 0) {
-          storeStockEmpty.textContent = "Ingen lagerdata i senaste valda period.";
-          storeStockEmpty.style.display = "block";
-          storeStockBars.innerHTML = "";
-          storeStockRatioEmpty.textContent = "Ingen data för dagberäkning.";
-          storeStockRatioEmpty.style.display = "block";
-          storeStockRatioBars.innerHTML = "";
-          return;
-        }
-
-        const maxStock = Math.max(...storeStocks.map((row) => row.estimated_stock_value), 1);
-        storeStockEmpty.textContent = "Senaste valda period: " + reportMonthLabel(latestMonth);
-        storeStockEmpty.style.display = "block";
-        storeStockBars.innerHTML = storeStocks.map((row) => {
-          const width = Math.max(0, Math.min(100, (row.estimated_stock_value / maxStock) * 100));
-          return '<div class="stock-bar-row">'
-            + '<div class="stock-bar-label">' + esc(displayStoreName(row.filial)) + '</div>'
-            + '<div class="stock-bar-track"><div class="stock-bar-fill" style="width:' + width.toFixed(2) + '%"></div></div>'
-            + '<div class="stock-bar-value">' + esc(fmtMoney(row.estimated_stock_value)) + '</div>'
-            + '</div>';
-        }).join("");
-
-        const daysInMonth = daysInReportMonth(latestMonth);
-        const ratioRows = storeStocks.map((row) => {
-          const daysInStock = row.net_sales > 0 ? (row.estimated_stock_value / row.net_sales) * daysInMonth : null;
-          return {
-            filial: row.filial,
-            stock_days: daysInStock,
-            estimated_stock_value: row.estimated_stock_value,
-            net_sales: row.net_sales,
-          };
-        }).sort((a, b) => {
-          if (a.stock_days === null && b.stock_days === null) return 0;
-          if (a.stock_days === null) return 1;
-          if (b.stock_days === null) return -1;
-          return b.stock_days - a.stock_days;
-        });
-
-        const validRatios = ratioRows
-          .map((row) => toNumber(row.stock_days))
-          .filter((value) => Number.isFinite(value) && value > 0);
-        const maxRatio = validRatios.length > 0 ? Math.max(...validRatios) : 1;
-
-        if (ratioRows.length === 0) {
-          storeStockRatioEmpty.textContent = "Ingen data för dagberäkning.";
-          storeStockRatioEmpty.style.display = "block";
-          storeStockRatioBars.innerHTML = "";
-          return;
-        }
-
-        storeStockRatioEmpty.textContent = "Formel: (Lagerestimat / Nettoförsäljning) x " + String(daysInMonth) + " dagar.";
-        storeStockRatioEmpty.style.display = "block";
-        storeStockRatioBars.innerHTML = ratioRows.map((row) => {
-          const ratioText = row.stock_days === null ? "-" : (fmtDecimal(row.stock_days) + " dagar");
-          const width = row.stock_days === null ? 0 : Math.max(0, Math.min(100, (toNumber(row.stock_days) / maxRatio) * 100));
-          return '<div class="stock-ratio-row">'
-            + '<div class="stock-bar-label">' + esc(displayStoreName(row.filial)) + '</div>'
-            + '<div class="stock-ratio-track"><div class="stock-ratio-fill" style="width:' + width.toFixed(2) + '%"></div></div>'
-            + '<div class="stock-ratio-value" title="Lagerestimat: ' + esc(fmtMoney(row.estimated_stock_value)) + ', Netto: ' + esc(fmtMoney(row.net_sales)) + ', Dagar i period: ' + String(daysInMonth) + '">' + esc(ratioText) + '</div>'
-            + '</div>';
-        }).join("");
-      }
-
-      function renderTopDepartments(rows) {
-        const tbody = document.getElementById("topDeptBody");
-        if (!tbody) return;
-        if (rows.length === 0) {
-          tbody.innerHTML = '<tr><td colspan="4">Ingen data</td></tr>';
-          return;
-        }
-        tbody.innerHTML = rows.map((row) =>
-          '<tr><td>' + esc(row.avdelning) + '</td><td>' + fmtMoney(row.net_sales) + '</td><td>' + fmtMoney(row.gross_profit) + '</td><td>' + fmtPct(row.gross_margin_percent, 2) + '</td></tr>'
-        ).join("");
-      }
-
-      function renderLowMargin(rows) {
-        const tbody = document.getElementById("lowMarginBody");
-        if (!tbody) return;
-        if (rows.length === 0) {
-          tbody.innerHTML = '<tr><td colspan="6">Ingen data</td></tr>';
-          return;
-        }
-        tbody.innerHTML = rows.map((row) =>
-          '<tr>'
-            + '<td>' + esc(row.avdelning) + '</td>'
-            + '<td>' + esc(row.varutext || row.artnr) + '</td>'
-            + '<td class="col-ean">' + esc(formatEan(row.ean)) + '</td>'
-            + '<td class="num">' + fmtQty(row.units_sold) + '</td>'
-            + '<td class="num">' + fmtMoney(row.net_sales) + '</td>'
-            + '<td class="num">' + fmtPct(row.gross_margin_percent, 2) + '</td>'
-          + '</tr>'
-        ).join("");
-      }
-
-      function buildRiskTable(title, headerHtml, rowHtml, emptyColspan, emptyText) {
-        const bodyHtml = rowHtml && rowHtml.length > 0
-          ? rowHtml
-          : '<tr><td colspan="' + String(emptyColspan) + '" class="risk-empty">' + esc(emptyText) + "</td></tr>";
-        return '<section class="risk-table-wrap">'
-          + '<h4 class="risk-section-title">' + esc(title) + "</h4>"
-          + '<table class="risk-table"><thead><tr>' + headerHtml + "</tr></thead><tbody>" + bodyHtml + "</tbody></table>"
-          + "</section>";
-      }
-
-      function renderRiskAnalysis(metrics, filteredDepartments) {
-        const container = document.getElementById("riskAnalysis");
-        if (!container) return;
-        if (filteredDepartments.length === 0) {
-          container.innerHTML = '<h3>Snabbanalys</h3><p class="meta">Välj minst en avdelning för att se riskanalys.</p>';
-          return;
-        }
-
-        if (riskState.activeKey === "departments") {
-          const topSalesDepartments = [...metrics.departmentRows]
-            .sort((a, b) => toNumber(b.net_sales) - toNumber(a.net_sales))
-            .slice(0, 8);
-          const topRows = topSalesDepartments.map((row, index) =>
-            '<tr><td class="num">' + String(index + 1) + "</td><td>" + esc(row.avdelning) + '</td><td class="num">' + fmtMoney(row.net_sales) + '</td><td class="num">' + fmtPct(row.gross_margin_percent, 2) + "</td></tr>"
-          ).join("");
-          container.innerHTML =
-            '<h3>Snabbanalys: valda avdelningar</h3>'
-            + '<div class="risk-kpi-grid">'
-            + '<div class="risk-kpi"><span>Valda avdelningar</span><strong>' + fmtQty(filteredDepartments.length) + '</strong></div>'
-            + '<div class="risk-kpi"><span>Netto för urval</span><strong>' + fmtMoney(metrics.totalSales) + '</strong></div>'
-            + '<div class="risk-kpi"><span>TB för urval</span><strong>' + fmtMoney(metrics.totalProfit) + '</strong></div>'
-            + '</div>'
-            + '<div class="risk-table-grid">'
-            + buildRiskTable(
-              "Storst avdelningar (netto)",
-              '<th class="num">#</th><th>Avdelning</th><th class="num">Netto</th><th class="num">TB %</th>',
-              topRows,
-              4,
-              "Ingen data för valt urval."
-            )
-            + '</div>';
-          return;
-        }
-
-        if (riskState.activeKey === "negative_margin") {
-          const rows = metrics.negativeRows;
-          const riskSales = sumBy(rows, "net_sales");
-          const riskProfit = sumBy(rows, "gross_profit");
-          const worstDepartments = aggregateBy(rows, "avdelning", "gross_profit")
-            .sort((a, b) => a.total - b.total)
-            .slice(0, 8);
-          const articleRows = aggregateArticles(rows, "gross_profit", true).slice(0, topN);
-          const deptTableRows = worstDepartments.map((item, index) =>
-            '<tr><td class="num">' + String(index + 1) + "</td><td>" + esc(item.name) + '</td><td class="num">' + fmtMoney(item.total) + "</td></tr>"
-          ).join("");
-          const articleTableRows = articleRows.map((item) =>
-            "<tr>"
-              + "<td>" + esc(item.avdelning) + "</td>"
-              + "<td>" + esc(item.varutext || item.artnr) + "</td>"
-              + '<td class="col-ean">' + esc(formatEan(item.ean)) + "</td>"
-              + '<td class="num">' + fmtQty(item.units_sold) + "</td>"
-              + '<td class="num">' + fmtMoney(item.net_sales) + "</td>"
-              + '<td class="num">' + fmtMoney(item.gross_profit) + "</td>"
-              + '<td class="num">' + fmtPct(item.gross_margin_percent, 2) + "</td>"
-            + "</tr>"
-          ).join("");
-          container.innerHTML =
-            '<h3>Snabbanalys: negativ marginal</h3>'
-            + '<div class="meta">Baserad på riskartiklar i topp-listan, filtrerad på valda avdelningar.</div>'
-            + '<div class="risk-kpi-grid">'
-            + '<div class="risk-kpi"><span>Riskartiklar (topp)</span><strong>' + fmtQty(rows.length) + '</strong></div>'
-            + '<div class="risk-kpi"><span>Netto i risklista</span><strong>' + fmtMoney(riskSales) + '</strong></div>'
-            + '<div class="risk-kpi"><span>TB i risklista</span><strong>' + fmtMoney(riskProfit) + '</strong></div>'
-            + '</div>'
-            + '<div class="risk-table-grid">'
-            + buildRiskTable(
-              "Avdelningar med storst negativ TB",
-              '<th class="num">#</th><th>Avdelning</th><th class="num">TB</th>',
-              deptTableRows,
-              3,
-              "Ingen negativ marginal i topp-listan för valt urval."
-            )
-            + buildRiskTable(
-              "Riskartiklar",
-              '<th>Avdelning</th><th>Artikel</th><th>EAN</th><th class="num">Antal</th><th class="num">Netto</th><th class="num">TB</th><th class="num">TB %</th>',
-              articleTableRows,
-              7,
-              "Inga riskartiklar för valt urval."
-            )
-            + '</div>';
-          return;
-        }
-
-        if (riskState.activeKey === "net_returns") {
-          const rows = metrics.returnRows;
-          const returnSales = sumBy(rows, "net_sales");
-          const returnUnits = sumBy(rows, "units_sold");
-          const worstDepartments = aggregateBy(rows, "avdelning", "net_sales")
-            .sort((a, b) => a.total - b.total)
-            .slice(0, 8);
-          const articleRows = aggregateArticles(rows, "net_sales", true).slice(0, topN);
-          const deptTableRows = worstDepartments.map((item, index) =>
-            '<tr><td class="num">' + String(index + 1) + "</td><td>" + esc(item.name) + '</td><td class="num">' + fmtMoney(item.total) + "</td></tr>"
-          ).join("");
-          const articleTableRows = articleRows.map((item) =>
-            "<tr>"
-              + "<td>" + esc(item.avdelning) + "</td>"
-              + "<td>" + esc(item.varutext || item.artnr) + "</td>"
-              + '<td class="col-ean">' + esc(formatEan(item.ean)) + "</td>"
-              + '<td class="num">' + fmtQty(item.units_sold) + "</td>"
-              + '<td class="num">' + fmtMoney(item.net_sales) + "</td>"
-              + '<td class="num">' + fmtMoney(item.gross_profit) + "</td>"
-            + "</tr>"
-          ).join("");
-          container.innerHTML =
-            '<h3>Snabbanalys: nettoreturer</h3>'
-            + '<div class="meta">Baserad på retur-riskartiklar i topp-listan, filtrerad på valda avdelningar.</div>'
-            + '<div class="risk-kpi-grid">'
-            + '<div class="risk-kpi"><span>Returartiklar (topp)</span><strong>' + fmtQty(rows.length) + '</strong></div>'
-            + '<div class="risk-kpi"><span>Nettoeffekt</span><strong>' + fmtMoney(returnSales) + '</strong></div>'
-            + '<div class="risk-kpi"><span>Enheter i retur</span><strong>' + fmtQty(returnUnits) + '</strong></div>'
-            + '</div>'
-            + '<div class="risk-table-grid">'
-            + buildRiskTable(
-              "Avdelningar med storst nettoretur",
-              '<th class="num">#</th><th>Avdelning</th><th class="num">Netto</th>',
-              deptTableRows,
-              3,
-              "Ingen nettoretur i topp-listan för valt urval."
-            )
-            + buildRiskTable(
-              "Returartiklar",
-              '<th>Avdelning</th><th>Artikel</th><th>EAN</th><th class="num">Antal</th><th class="num">Netto</th><th class="num">TB</th>',
-              articleTableRows,
-              6,
-              "Inga returartiklar för valt urval."
-            )
-            + '</div>';
-          return;
-        }
-
-        const ratio = metrics.tbRatio;
-        const status = ratio < 35 ? "Hog risk" : ratio < 45 ? "Bevaka" : "Stabil";
-        const lowMarginDepartments = [...metrics.departmentRows]
-          .sort((a, b) => toNumber(a.gross_margin_percent) - toNumber(b.gross_margin_percent))
-          .slice(0, 8);
-        const lowMarginRows = lowMarginDepartments.map((row, index) =>
-          '<tr><td class="num">' + String(index + 1) + "</td><td>" + esc(row.avdelning) + '</td><td class="num">' + fmtPct(row.gross_margin_percent, 2) + '</td><td class="num">' + fmtMoney(row.net_sales) + "</td></tr>"
-        ).join("");
-        container.innerHTML =
-          '<h3>Snabbanalys: TB/netto-forhallande</h3>'
-          + '<div class="risk-kpi-grid">'
-          + '<div class="risk-kpi"><span>TB/netto</span><strong>' + fmtPct(ratio, 2) + '</strong></div>'
-          + '<div class="risk-kpi"><span>Status</span><strong>' + esc(status) + '</strong></div>'
-          + '<div class="risk-kpi"><span>Netto för urval</span><strong>' + fmtMoney(metrics.totalSales) + '</strong></div>'
-          + '<div class="risk-kpi"><span>TB för urval</span><strong>' + fmtMoney(metrics.totalProfit) + '</strong></div>'
-          + '</div>'
-          + '<div class="risk-table-grid">'
-          + buildRiskTable(
-            "Avdelningar med lagst TB %",
-            '<th class="num">#</th><th>Avdelning</th><th class="num">TB %</th><th class="num">Netto</th>',
-            lowMarginRows,
-            4,
-            "Ingen data för valt urval."
-          )
-          + '</div>';
-      }
-
-      function renderRiskPills(filteredDepartments) {
-        const container = document.getElementById("riskPills");
-        if (!container) return;
-        const filteredRows = getFilteredRows();
-        const departmentRows = aggregateStoreOrDepartment(filteredRows, "avdelning").map((row) => ({
-          avdelning: row.name,
-          net_sales: row.net_sales,
-          gross_profit: row.gross_profit,
-          gross_margin_percent: pct(row.gross_profit, row.net_sales),
-          units_sold: row.units_sold,
-          estimated_stock_value: row.estimated_stock_value,
-        }));
-        const totalSales = sumBy(departmentRows, "net_sales");
-        const totalProfit = sumBy(departmentRows, "gross_profit");
-        const negativeRows = marginRiskRows.filter((row) => inSelectedFilters(row));
-        const returnRows = returnRiskRows.filter((row) => inSelectedFilters(row));
-        const metrics = {
-          departmentRows: departmentRows,
-          totalSales: totalSales,
-          totalProfit: totalProfit,
-          tbRatio: pct(totalProfit, totalSales),
-          negativeRows: negativeRows,
-          returnRows: returnRows,
-        };
-        const pills = [
-          { key: "departments", label: "Valda avdelningar", value: String(filteredDepartments.length) },
-          { key: "negative_margin", label: "Negativ marginal artiklar (topp)", value: String(negativeRows.length) },
-          { key: "net_returns", label: "Nettoretur artiklar (topp)", value: String(returnRows.length) },
-          { key: "tb_ratio", label: "Forhallande TB/netto", value: fmtPct(metrics.tbRatio, 2) },
-        ];
-        if (!pills.some((pill) => pill.key === riskState.activeKey)) {
-          riskState.activeKey = "negative_margin";
-        }
-        container.innerHTML = pills
-          .map((pill) => {
-            const isActive = pill.key === riskState.activeKey;
-            return '<button type="button" class="warn-pill-btn' + (isActive ? ' active' : '') + '" data-risk-key="' + esc(pill.key) + '" aria-pressed="' + (isActive ? 'true' : 'false') + '">'
-              + esc(pill.label) + ': ' + esc(pill.value)
-              + '</button>';
-          })
-          .join("");
-
-        container.querySelectorAll("button[data-risk-key]").forEach((node) => {
-          node.addEventListener("click", (event) => {
-            const target = event.currentTarget;
-            if (!(target instanceof HTMLElement)) return;
-            const key = target.getAttribute("data-risk-key") || "";
-            if (!key) return;
-            riskState.activeKey = key;
-            renderRiskPills(filteredDepartments);
-          });
-        });
-        renderRiskAnalysis(metrics, filteredDepartments);
-      }
-
-      function renderMoM(filteredRows) {
-        const card = document.getElementById("momCard");
-        if (!card) return;
-        const months = getUniqueReportMonths(filteredRows);
-        if (months.length < 2) {
-          card.style.display = "none";
-          return;
-        }
-        const currentMonth = months[months.length - 1];
-        const previousMonth = months[months.length - 2];
-        const currentRows = filteredRows.filter((row) => String(row.report_month) === currentMonth);
-        const previousRows = filteredRows.filter((row) => String(row.report_month) === previousMonth);
-
-        const currentSales = sumBy(currentRows, "net_sales");
-        const previousSales = sumBy(previousRows, "net_sales");
-        const currentProfit = sumBy(currentRows, "gross_profit");
-        const previousProfit = sumBy(previousRows, "gross_profit");
-
-        const salesDelta = currentSales - previousSales;
-        const salesDeltaPct = previousSales === 0 ? null : (salesDelta / previousSales) * 100;
-        const profitDelta = currentProfit - previousProfit;
-        const profitDeltaPct = previousProfit === 0 ? null : (profitDelta / previousProfit) * 100;
-
-        card.style.display = "block";
-        document.getElementById("momRange").textContent = previousMonth + " till " + currentMonth;
-        document.getElementById("momSalesDelta").textContent = fmtMoney(salesDelta);
-        document.getElementById("momSalesDeltaPct").textContent = salesDeltaPct === null ? "-" : fmtPct(salesDeltaPct, 2);
-        document.getElementById("momProfitDelta").textContent = fmtMoney(profitDelta);
-        document.getElementById("momProfitDeltaPct").textContent = profitDeltaPct === null ? "-" : fmtPct(profitDeltaPct, 2);
-      }
-
-      function render() {
-        const filteredRows = getFilteredRows();
-        const filteredMonths = getUniqueReportMonths(filteredRows);
-        if (selectedInfo) {
-          selectedInfo.textContent =
-            selectedDepartments.size + "/" + allDepartments.length + " avd, "
-            + selectedStores.size + "/" + allStores.length + " butiker, "
-            + selectedMonthNumbers.size + "/" + allMonthNumbers.length + " månader, "
-            + filteredMonths.length + " perioder";
-        }
-
-        const totalSales = sumBy(filteredRows, "net_sales");
-        const totalProfit = sumBy(filteredRows, "gross_profit");
-        const totalUnits = sumBy(filteredRows, "units_sold");
-        const avgSellingPrice = totalUnits > 0 ? totalSales / totalUnits : null;
-        const latestMonth = getLatestReportMonth(filteredRows);
-        const stockRows = latestMonth
-          ? filteredRows.filter((row) => String(row.report_month || "") === latestMonth)
-          : [];
-        const totalStock = sumBy(stockRows, "estimated_stock_value");
-        const totalStockUnits = sumBy(stockRows, "stock_units");
-        const totalStockMargin = sumBy(stockRows, "stock_margin_value");
-        const stockSellingValue = totalStock + totalStockMargin;
-        const stockMarginPct = stockSellingValue > 0 ? (totalStockMargin / stockSellingValue) * 100 : null;
-        const latestMonthSales = sumBy(stockRows, "net_sales");
-        const latestMonthProfit = sumBy(stockRows, "gross_profit");
-        const latestMonthCogs = latestMonthSales - latestMonthProfit;
-        const stockCoverageMonths = latestMonthCogs > 0 ? totalStock / latestMonthCogs : null;
-        const avgStockUnitValue = totalStockUnits > 0 ? totalStock / totalStockUnits : null;
-
-        document.getElementById("kpiSales").textContent = fmtMoney(totalSales);
-        document.getElementById("kpiProfit").textContent = fmtMoney(totalProfit);
-        document.getElementById("kpiMargin").textContent = fmtPct(pct(totalProfit, totalSales), 2);
-        document.getElementById("kpiUnits").textContent = fmtQty(totalUnits);
-        document.getElementById("kpiStock").textContent = fmtMoney(totalStock);
-        document.getElementById("kpiAvgStockUnitValue").textContent = avgStockUnitValue === null ? "-" : fmtMoney(avgStockUnitValue);
-        document.getElementById("kpiAvgSellingPrice").textContent = avgSellingPrice === null ? "-" : fmtMoney(avgSellingPrice);
-        document.getElementById("kpiStockMargin").textContent = fmtMoney(totalStockMargin);
-        document.getElementById("kpiStockMarginPct").textContent = stockMarginPct === null ? "-" : fmtPct(stockMarginPct, 2);
-        document.getElementById("kpiStockCoverageMonths").textContent = stockCoverageMonths === null ? "-" : (fmtDecimal(stockCoverageMonths) + " man");
-
-        const deptAgg = aggregateStoreOrDepartment(filteredRows, "avdelning");
-        const deptShare = deptAgg.map((row) => ({
-          avdelning: row.name,
-          sales_share_percent: pct(toNumber(row.net_sales), totalSales),
-          profit_share_percent: pct(toNumber(row.gross_profit), totalProfit),
-          net_sales: toNumber(row.net_sales),
-          gross_profit: toNumber(row.gross_profit),
-          gross_margin_percent: pct(toNumber(row.gross_profit), toNumber(row.net_sales)),
-          units_sold: toNumber(row.units_sold),
-          estimated_stock_value: toNumber(row.estimated_stock_value),
-          stock_units: toNumber(row.stock_units),
-          stock_margin_value: toNumber(row.stock_margin_value),
-        })).sort((a, b) => b.net_sales - a.net_sales);
-        renderShareRows("deptShareRows", deptShare, "avdelning");
-
-        const storeAgg = aggregateStoreOrDepartment(filteredRows, "filial").map((row) => ({
-          filial: row.name,
-          net_sales: row.net_sales,
-          gross_profit: row.gross_profit,
-        }));
-        const storeTotalSales = storeAgg.reduce((acc, row) => acc + row.net_sales, 0);
-        const storeTotalProfit = storeAgg.reduce((acc, row) => acc + row.gross_profit, 0);
-        const storeShare = storeAgg.map((row) => ({
-          filial: row.filial,
-          sales_share_percent: pct(row.net_sales, storeTotalSales),
-          profit_share_percent: pct(row.gross_profit, storeTotalProfit),
-          net_sales: row.net_sales,
-          gross_profit: row.gross_profit,
-        })).sort((a, b) => b.net_sales - a.net_sales);
-        renderShareRows("storeShareRows", storeShare, "filial");
-        renderStoreTrend(filteredRows);
-        renderStoreStockBars(filteredRows);
-
-        renderTopDepartments(deptShare.slice(0, topN));
-        renderLowMargin(aggregateArticles(lowMarginRows.filter((row) => inSelectedFilters(row)), "net_sales", false).slice(0, topN));
-        renderRiskPills(Array.from(selectedDepartments));
-        renderMoM(filteredRows);
-      }
-
-      function closePanels() {
-        [deptPanel, storePanel, yearPanel, monthPanel].forEach((panel) => {
-          if (panel) panel.classList.remove("open");
-        });
-      }
-
-      function bindToggle(toggle, panel) {
-        if (!toggle || !panel) return;
-        toggle.addEventListener("click", (event) => {
-          event.stopPropagation();
-          const wasOpen = panel.classList.contains("open");
-          closePanels();
-          if (!wasOpen) panel.classList.add("open");
-        });
-      }
-
-      bindToggle(deptToggle, deptPanel);
-      bindToggle(storeToggle, storePanel);
-      bindToggle(yearToggle, yearPanel);
-      bindToggle(monthToggle, monthPanel);
-
-      document.addEventListener("click", (event) => {
-        if (!(event.target instanceof Node)) return;
-        const wrappers = [
-          [deptPanel, deptToggle],
-          [storePanel, storeToggle],
-          [yearPanel, yearToggle],
-          [monthPanel, monthToggle],
-        ];
-        for (const pair of wrappers) {
-          const panel = pair[0];
-          const toggle = pair[1];
-          if (!panel || !toggle) continue;
-          if (!panel.contains(event.target) && !toggle.contains(event.target)) {
-            panel.classList.remove("open");
-          }
-        }
-      });
-
-      function setAll(selectedSet, values) {
-        selectedSet.clear();
-        values.forEach((value) => selectedSet.add(value));
-      }
-
-      function clearAll(selectedSet) {
-        selectedSet.clear();
-      }
-
-      function bindClick(node, handler) {
-        if (!node) return;
-        node.addEventListener("click", handler);
-      }
-
-      function renderFilterOptions() {
-        const sortedDepartments = getDepartmentFilterOrder();
-        renderCheckOptions(deptOptions, sortedDepartments, selectedDepartments, "dept", (value) => value, (value) => String(value));
-        renderCheckOptions(storeOptions, allStores, selectedStores, "store", (value) => displayStoreName(value), (value) => String(value));
-        renderCheckOptions(yearOptions, allYears, selectedYears, "year", (value) => value, (value) => String(value));
-        renderCheckOptions(monthOptions, allMonthNumbers, selectedMonthNumbers, "month", (value) => monthLabel(value), (value) => Number(value));
-      }
-
-      bindClick(deptAll, () => {
-        setAll(selectedDepartments, allDepartments);
-        renderFilterOptions();
-        render();
-      });
-      bindClick(deptNone, () => {
-        clearAll(selectedDepartments);
-        renderFilterOptions();
-        render();
-      });
-      bindClick(storeAll, () => {
-        setAll(selectedStores, allStores);
-        renderFilterOptions();
-        render();
-      });
-      bindClick(storeNone, () => {
-        clearAll(selectedStores);
-        renderFilterOptions();
-        render();
-      });
-      bindClick(yearAll, () => {
-        setAll(selectedYears, allYears);
-        renderFilterOptions();
-        render();
-      });
-      bindClick(yearNone, () => {
-        clearAll(selectedYears);
-        renderFilterOptions();
-        render();
-      });
-      bindClick(monthAll, () => {
-        setAll(selectedMonthNumbers, allMonthNumbers);
-        renderFilterOptions();
-        render();
-      });
-      bindClick(monthNone, () => {
-        clearAll(selectedMonthNumbers);
-        renderFilterOptions();
-        render();
-      });
-
-      renderFilterOptions();
-      render();
-    })();
-  </script>
+  <script src="__JS_SRC__"></script>
 </body>
 </html>
 """
-    return (
-        template.replace("__REPORT_MONTH__", report_month)
-        .replace("__GENERATED_AT__", generated_at)
-        .replace("__PAYLOAD_JSON__", payload_json)
+QUICKLOOK_TEMPLATE_PARTS = [
+    part if index % 2 else part.encode("utf-8")
+    for index, part in enumerate(
+        re.split(r"__(REPORT_MONTH|GENERATED_AT|PAYLOAD_JSON|CSS_HREF|JS_SRC)__", QUICKLOOK_TEMPLATE)
     )
-
-
-def generate_kpi_report(
+]
+QUICKLOOK_ASSET_DIR = Path(__file__).resolve().parent / "quicklook"
+QUICKLOOK_ASSET_SOURCES = {"css": "quicklook.css", "js": "quicklook.js"}
+QUICKLOOK_PAYLOAD_KEYS = (
+    "report_month",
+    "top_n",
+    "available_report_years",
+    "available_month_numbers",
+    "available_stores",
+    "available_departments",
+)
+QUICKLOOK_ROW_SECTIONS = {
+    "time_store_department_breakdown": "store_department_breakdown",
+    "time_margin_risk_items_top_n": "margin_risk_items_top_n",
+    "time_return_risk_items_top_n": "return_risk_items_top_n",
+    "time_low_margin_high_sales_top_n": "low_margin_high_sales_top_n",
+}
+QUICKLOOK_DERIVED_ROW_FIELDS = frozenset({"report_year", "report_month_number"})
+
+
+@functools.cache
+def load_quicklook_assets() -> dict[str, tuple[str, bytes]]:
+    assets: dict[str, tuple[str, bytes]] = {}
+    for kind, source_name in QUICKLOOK_ASSET_SOURCES.items():
+        content = (QUICKLOOK_ASSET_DIR / source_name).read_bytes()
+        digest = hashlib.sha256(content).hexdigest()[:12]
+        assets[kind] = (f"kpi_quicklook-{digest}.{kind}", content)
+    return assets
+
+
+def write_quicklook_assets(report_dir: Path) -> dict[str, str]:
+    names: dict[str, str] = {}
+    for kind, (name, content) in load_quicklook_assets().items():
+        target = report_dir / name
+        if not target.exists():
+            fd, tmp_name = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=report_dir)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(content)
+                os.replace(tmp_name, target)
+            except BaseException:
+                Path(tmp_name).unlink(missing_ok=True)
+                raise
+        names[kind] = name
+    return names
+
+
+def prune_quicklook_assets(report_dir: Path, current_names: set[str]) -> None:
+    stale = [path for path in report_dir.glob("kpi_quicklook-*.*") if path.name not in current_names]
+    if not stale:
+        return
+    # Older hashes stay while any month's quicklook page still links them.
+    referenced: set[str] = set()
+    for html_path in report_dir.glob("kpi_*_quicklook.html"):
+        referenced.update(match.decode("ascii") for match in QUICKLOOK_ASSET_NAME_RE.findall(html_path.read_bytes()))
+    for path in stale:
+        if path.name not in referenced:
+            path.unlink(missing_ok=True)
+
+
+def build_quicklook_payload(payload: dict[str, Any]) -> dict[str, Any]:
+    data = {key: payload[key] for key in QUICKLOOK_PAYLOAD_KEYS if key in payload}
+    for time_key, fallback_key in QUICKLOOK_ROW_SECTIONS.items():
+        rows = payload.get(time_key) or []
+        if rows:
+            data[time_key] = [
+                {key: value for key, value in row.items() if key not in QUICKLOOK_DERIVED_ROW_FIELDS} for row in rows
+            ]
+        elif fallback_key in payload:
+            data[fallback_key] = payload[fallback_key]
+    return data
+
+
+def write_quicklook_html(path: Path, payload: dict[str, Any], assets: dict[str, str]) -> None:
+    values = {
+        "REPORT_MONTH": html.escape(str(payload.get("report_month", ""))).encode("utf-8"),
+        "GENERATED_AT": html.escape(str(payload.get("generated_at_utc", ""))).encode("utf-8"),
+        "CSS_HREF": html.escape(assets["css"]).encode("utf-8"),
+        "JS_SRC": html.escape(assets["js"]).encode("utf-8"),
+    }
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    try:
+        with tmp_path.open("wb") as f:
+            for part in QUICKLOOK_TEMPLATE_PARTS:
+                if isinstance(part, bytes):
+                    chunk = part
+                elif part == "PAYLOAD_JSON":
+                    chunk = json_for_html_script(build_quicklook_payload(payload))
+                else:
+                    chunk = values[part]
+                f.write(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def query_kpi_sections(
+    conn,
     *,
-    output_root: Path,
-    report_month: str | None = None,
-    top_n: int = 10,
-    history_months: int | None = 12,
-    duckdb_threads: int = 2,
-    duckdb_memory_limit: str = "768MB",
-    output_path: Path | None = None,
-) -> tuple[dict[str, Any], Path, Path]:
-    if report_month is not None and not is_valid_report_month(report_month):
-        raise ValueError("report_month must have format YYYY-MM.")
-    if history_months is not None and history_months < 1:
-        raise ValueError("history_months must be >= 1, or None for all history.")
-    safe_threads = max(1, int(duckdb_threads))
-    safe_memory_limit = normalize_duckdb_memory_limit(duckdb_memory_limit)
-    safe_top_n = max(1, min(int(top_n), 200))
-    month_files = discover_curated_month_files(output_root)
-    if not month_files:
-        raise FileNotFoundError("No curated parquet files found under data/curated/sales_monthly/v1.")
-
-    available_months_all = sorted(month_files.keys())
-    target_month = report_month or available_months_all[-1]
-    if target_month not in month_files:
-        raise ValueError(f"Requested report month {target_month!r} not found. Available: {available_months_all}")
-
-    target_path = month_files[target_month]
-    available_months = selected_history_months(available_months_all, target_month, history_months)
-    previous_month = None
-    previous_path = None
-    if target_month in available_months_all:
-        idx = available_months_all.index(target_month)
-    if idx > 0:
-        previous_month = available_months_all[idx - 1]
-        previous_path = month_files[previous_month]
-
-    def sql_quoted_path(path: Path) -> str:
-        return str(path).replace("'", "''")
-
-    duckdb = require_duckdb()
-    conn = duckdb.connect(database=":memory:")
-    conn_close = conn.close
-    atexit.register(conn_close)
-    conn.execute(f"SET threads TO {safe_threads}")
-    conn.execute(f"SET memory_limit='{safe_memory_limit}'")
+    month_files: dict[str, Path],
+    scan_months: list[str],
+    available_months: list[str],
+    target_month: str,
+    previous_month: str | None,
+    top_n: int,
+) -> dict[str, Any]:
+    conn.execute(
+        f"""
+        CREATE OR REPLACE TEMP TABLE curated_scan AS
+        SELECT {", ".join(KPI_COLUMNS)}
+        FROM {build_scan_sql(scan_months, month_files)}
+        """
+    )
     conn.execute(
-        f"CREATE OR REPLACE TEMP VIEW curated_month AS SELECT * FROM read_parquet('{sql_quoted_path(target_path)}')"
+        f"CREATE OR REPLACE TEMP VIEW curated_month AS SELECT * FROM curated_scan WHERE report_month = '{sql_quoted(target_month)}'"
     )
-    if previous_path is not None:
+    if previous_month is not None:
         conn.execute(
-            f"CREATE OR REPLACE TEMP VIEW curated_prev AS SELECT * FROM read_parquet('{sql_quoted_path(previous_path)}')"
+            f"CREATE OR REPLACE TEMP VIEW curated_prev AS SELECT * FROM curated_scan WHERE report_month = '{sql_quoted(previous_month)}'"
         )
-    all_month_paths = [month_files[month] for month in available_months]
-    all_month_paths_sql = ", ".join(f"'{sql_quoted_path(path)}'" for path in all_month_paths)
+    history_months_sql = ", ".join(f"'{sql_quoted(month)}'" for month in available_months)
     conn.execute(
-        f"CREATE OR REPLACE TEMP VIEW curated_all AS SELECT * FROM read_parquet([{all_month_paths_sql}])"
+        f"CREATE OR REPLACE TEMP VIEW curated_all AS SELECT * FROM curated_scan WHERE report_month IN ({history_months_sql})"
     )
 
     summary = fetch_one(
@@ -1486,27 +525,57 @@ def generate_kpi_report(
         [target_month],
     )
 
+    conn.execute(
+        """
+        CREATE OR REPLACE TEMP TABLE curated_month_groups AS
+        SELECT
+          CASE GROUPING_ID(filial, avdelning)
+            WHEN 0 THEN 'store_department'
+            WHEN 1 THEN 'store'
+            WHEN 2 THEN 'department'
+            ELSE 'total'
+          END AS grouping_level,
+          filial,
+          avdelning,
+          SUM(fors_sum_sum) AS net_sales,
+          SUM(tb_sum) AS gross_profit,
+          SUM(antal_salda_sum) AS units_sold,
+          SUM(COALESCE(lager_antal_max, 0)) AS stock_units,
+          SUM(COALESCE(estimated_stock_value, 0)) AS estimated_stock_value,
+          SUM(
+            CASE
+              WHEN COALESCE(lager_antal_max, 0) > 0
+                THEN GREATEST(COALESCE(ord_pris_avg, 0) - COALESCE(snitt_inpris_avg, 0), 0) * COALESCE(lager_antal_max, 0)
+              ELSE 0
+            END
+          ) AS stock_margin_value
+        FROM curated_month
+        GROUP BY GROUPING SETS ((filial, avdelning), (filial), (avdelning), ())
+        """
+    )
+
     store_share = fetch_rows(
         conn,
         """
         WITH totals AS (
-          SELECT SUM(fors_sum_sum) AS total_sales, SUM(tb_sum) AS total_profit
-          FROM curated_month
+          SELECT net_sales AS total_sales, gross_profit AS total_profit
+          FROM curated_month_groups
+          WHERE grouping_level = 'total'
         )
         SELECT
           filial,
-          ROUND(SUM(fors_sum_sum), 2) AS net_sales,
-          ROUND(SUM(tb_sum), 2) AS gross_profit,
-          ROUND(CASE WHEN SUM(fors_sum_sum) = 0 THEN NULL ELSE (SUM(tb_sum) / SUM(fors_sum_sum)) * 100 END, 2)
+          ROUND(net_sales, 2) AS net_sales,
+          ROUND(gross_profit, 2) AS gross_profit,
+          ROUND(CASE WHEN net_sales = 0 THEN NULL ELSE (gross_profit / net_sales) * 100 END, 2)
             AS gross_margin_percent,
-          ROUND(SUM(COALESCE(estimated_stock_value, 0)), 2) AS estimated_stock_value,
-          ROUND(CASE WHEN totals.total_sales = 0 THEN NULL ELSE (SUM(fors_sum_sum) / totals.total_sales) * 100 END, 2)
+          ROUND(estimated_stock_value, 2) AS estimated_stock_value,
+          ROUND(CASE WHEN totals.total_sales = 0 THEN NULL ELSE (net_sales / totals.total_sales) * 100 END, 2)
             AS sales_share_percent,
-          ROUND(CASE WHEN totals.total_profit = 0 THEN NULL ELSE (SUM(tb_sum) / totals.total_profit) * 100 END, 2)
+          ROUND(CASE WHEN totals.total_profit = 0 THEN NULL ELSE (gross_profit / totals.total_profit) * 100 END, 2)
             AS profit_share_percent
-        FROM curated_month
+        FROM curated_month_groups
         CROSS JOIN totals
-        GROUP BY filial, totals.total_sales, totals.total_profit
+        WHERE grouping_level = 'store'
         ORDER BY net_sales DESC
         """,
     )
@@ -1515,24 +584,25 @@ def generate_kpi_report(
         conn,
         """
         WITH totals AS (
-          SELECT SUM(fors_sum_sum) AS total_sales, SUM(tb_sum) AS total_profit
-          FROM curated_month
+          SELECT net_sales AS total_sales, gross_profit AS total_profit
+          FROM curated_month_groups
+          WHERE grouping_level = 'total'
         )
         SELECT
           avdelning,
-          ROUND(SUM(fors_sum_sum), 2) AS net_sales,
-          ROUND(SUM(tb_sum), 2) AS gross_profit,
-          ROUND(SUM(antal_salda_sum), 2) AS units_sold,
-          ROUND(CASE WHEN SUM(fors_sum_sum) = 0 THEN NULL ELSE (SUM(tb_sum) / SUM(fors_sum_sum)) * 100 END, 2)
+          ROUND(net_sales, 2) AS net_sales,
+          ROUND(gross_profit, 2) AS gross_profit,
+          ROUND(units_sold, 2) AS units_sold,
+          ROUND(CASE WHEN net_sales = 0 THEN NULL ELSE (gross_profit / net_sales) * 100 END, 2)
             AS gross_margin_percent,
-          ROUND(SUM(COALESCE(estimated_stock_value, 0)), 2) AS estimated_stock_value,
-          ROUND(CASE WHEN totals.total_sales = 0 THEN NULL ELSE (SUM(fors_sum_sum) / totals.total_sales) * 100 END, 2)
+          ROUND(estimated_stock_value, 2) AS estimated_stock_value,
+          ROUND(CASE WHEN totals.total_sales = 0 THEN NULL ELSE (net_sales / totals.total_sales) * 100 END, 2)
             AS sales_share_percent,
-          ROUND(CASE WHEN totals.total_profit = 0 THEN NULL ELSE (SUM(tb_sum) / totals.total_profit) * 100 END, 2)
+          ROUND(CASE WHEN totals.total_profit = 0 THEN NULL ELSE (gross_profit / totals.total_profit) * 100 END, 2)
             AS profit_share_percent
-        FROM curated_month
+        FROM curated_month_groups
         CROSS JOIN totals
-        GROUP BY avdelning, totals.total_sales, totals.total_profit
+        WHERE grouping_level = 'department'
         ORDER BY net_sales DESC
         """,
     )
@@ -1543,25 +613,16 @@ def generate_kpi_report(
         SELECT
           filial,
           avdelning,
-          ROUND(SUM(fors_sum_sum), 2) AS net_sales,
-          ROUND(SUM(tb_sum), 2) AS gross_profit,
-          ROUND(SUM(antal_salda_sum), 2) AS units_sold,
-          ROUND(SUM(COALESCE(lager_antal_max, 0)), 2) AS stock_units,
-          ROUND(SUM(COALESCE(estimated_stock_value, 0)), 2) AS estimated_stock_value,
-          ROUND(
-            SUM(
-              CASE
-                WHEN COALESCE(lager_antal_max, 0) > 0
-                  THEN GREATEST(COALESCE(ord_pris_avg, 0) - COALESCE(snitt_inpris_avg, 0), 0) * COALESCE(lager_antal_max, 0)
-                ELSE 0
-              END
-            ),
-            2
-          ) AS stock_margin_value,
-          ROUND(CASE WHEN SUM(fors_sum_sum) = 0 THEN NULL ELSE (SUM(tb_sum) / SUM(fors_sum_sum)) * 100 END, 2)
+          ROUND(net_sales, 2) AS net_sales,
+          ROUND(gross_profit, 2) AS gross_profit,
+          ROUND(units_sold, 2) AS units_sold,
+          ROUND(stock_units, 2) AS stock_units,
+          ROUND(estimated_stock_value, 2) AS estimated_stock_value,
+          ROUND(stock_margin_value, 2) AS stock_margin_value,
+          ROUND(CASE WHEN net_sales = 0 THEN NULL ELSE (gross_profit / net_sales) * 100 END, 2)
             AS gross_margin_percent
-        FROM curated_month
-        GROUP BY filial, avdelning
+        FROM curated_month_groups
+        WHERE grouping_level = 'store_department'
         """,
     )
 
@@ -1570,18 +631,18 @@ def generate_kpi_report(
         """
         SELECT
           filial,
-          ROUND(SUM(fors_sum_sum), 2) AS net_sales,
-          ROUND(SUM(tb_sum), 2) AS gross_profit,
-          ROUND(CASE WHEN SUM(fors_sum_sum) = 0 THEN NULL ELSE (SUM(tb_sum) / SUM(fors_sum_sum)) * 100 END, 2)
+          ROUND(net_sales, 2) AS net_sales,
+          ROUND(gross_profit, 2) AS gross_profit,
+          ROUND(CASE WHEN net_sales = 0 THEN NULL ELSE (gross_profit / net_sales) * 100 END, 2)
             AS gross_margin_percent,
-          ROUND(SUM(antal_salda_sum), 2) AS units_sold,
-          ROUND(SUM(COALESCE(estimated_stock_value, 0)), 2) AS estimated_stock_value
-        FROM curated_month
-        GROUP BY filial
+          ROUND(units_sold, 2) AS units_sold,
+          ROUND(estimated_stock_value, 2) AS estimated_stock_value
+        FROM curated_month_groups
+        WHERE grouping_level = 'store'
         ORDER BY net_sales DESC
         LIMIT ?
         """,
-        [safe_top_n],
+        [top_n],
     )
 
     department_ranking = fetch_rows(
@@ -1589,124 +650,73 @@ def generate_kpi_report(
         """
         SELECT
           avdelning,
-          ROUND(SUM(fors_sum_sum), 2) AS net_sales,
-          ROUND(SUM(tb_sum), 2) AS gross_profit,
-          ROUND(CASE WHEN SUM(fors_sum_sum) = 0 THEN NULL ELSE (SUM(tb_sum) / SUM(fors_sum_sum)) * 100 END, 2)
+          ROUND(net_sales, 2) AS net_sales,
+          ROUND(gross_profit, 2) AS gross_profit,
+          ROUND(CASE WHEN net_sales = 0 THEN NULL ELSE (gross_profit / net_sales) * 100 END, 2)
             AS gross_margin_percent,
-          ROUND(SUM(antal_salda_sum), 2) AS units_sold
-        FROM curated_month
-        GROUP BY avdelning
+          ROUND(units_sold, 2) AS units_sold
+        FROM curated_month_groups
+        WHERE grouping_level = 'department'
         ORDER BY net_sales DESC
         LIMIT ?
         """,
-        [safe_top_n],
+        [top_n],
     )
 
-    margin_risks = fetch_rows(
+    article_rankings = fetch_ranked_sections(
         conn,
         """
-        SELECT
-          filial,
-          avdelning,
-          artnr,
-          ean,
-          varutext,
-          ROUND(fors_sum_sum, 2) AS net_sales,
-          ROUND(tb_sum, 2) AS gross_profit,
-          ROUND(gross_margin_percent_calc, 2) AS gross_margin_percent,
-          return_row_count,
-          negative_margin_row_count
-        FROM curated_month
+        WITH articles AS (
+          SELECT
+            filial,
+            avdelning,
+            artnr,
+            ean,
+            varutext,
+            ROUND(fors_sum_sum, 2) AS net_sales,
+            ROUND(tb_sum, 2) AS gross_profit,
+            ROUND(gross_margin_percent_calc, 2) AS gross_margin_percent,
+            ROUND(antal_salda_sum, 2) AS units_sold,
+            return_row_count,
+            negative_margin_row_count,
+            has_negative_margin,
+            has_net_return,
+            fors_sum_sum > 0
+              AND gross_margin_percent_calc IS NOT NULL
+              AND gross_margin_percent_calc < 35 AS is_low_margin_high_sales
+          FROM curated_month
+        )
+        SELECT 'margin_risks' AS section, ROW_NUMBER() OVER (ORDER BY gross_profit ASC) AS section_rank, *
+        FROM articles
         WHERE has_negative_margin
-        ORDER BY gross_profit ASC
-        LIMIT ?
-        """,
-        [safe_top_n],
-    )
-
-    return_risks = fetch_rows(
-        conn,
-        """
-        SELECT
-          filial,
-          avdelning,
-          artnr,
-          ean,
-          varutext,
-          ROUND(antal_salda_sum, 2) AS units_sold,
-          ROUND(fors_sum_sum, 2) AS net_sales,
-          ROUND(tb_sum, 2) AS gross_profit,
-          return_row_count
-        FROM curated_month
+        QUALIFY section_rank <= $top_n
+        UNION ALL
+        SELECT 'return_risks' AS section, ROW_NUMBER() OVER (ORDER BY units_sold ASC, net_sales ASC) AS section_rank, *
+        FROM articles
         WHERE has_net_return
-        ORDER BY units_sold ASC, net_sales ASC
-        LIMIT ?
-        """,
-        [safe_top_n],
-    )
-
-    product_top_sales = fetch_rows(
-        conn,
-        """
-        SELECT
-          filial,
-          avdelning,
-          artnr,
-          ean,
-          varutext,
-          ROUND(fors_sum_sum, 2) AS net_sales,
-          ROUND(tb_sum, 2) AS gross_profit,
-          ROUND(gross_margin_percent_calc, 2) AS gross_margin_percent,
-          ROUND(antal_salda_sum, 2) AS units_sold
-        FROM curated_month
-        ORDER BY net_sales DESC
-        LIMIT ?
-        """,
-        [safe_top_n],
-    )
-
-    product_top_profit = fetch_rows(
-        conn,
-        """
-        SELECT
-          filial,
-          avdelning,
-          artnr,
-          ean,
-          varutext,
-          ROUND(fors_sum_sum, 2) AS net_sales,
-          ROUND(tb_sum, 2) AS gross_profit,
-          ROUND(gross_margin_percent_calc, 2) AS gross_margin_percent,
-          ROUND(antal_salda_sum, 2) AS units_sold
-        FROM curated_month
-        ORDER BY gross_profit DESC
-        LIMIT ?
-        """,
-        [safe_top_n],
-    )
-
-    low_margin_high_sales = fetch_rows(
-        conn,
-        """
-        SELECT
-          filial,
-          avdelning,
-          artnr,
-          ean,
-          varutext,
-          ROUND(fors_sum_sum, 2) AS net_sales,
-          ROUND(tb_sum, 2) AS gross_profit,
-          ROUND(gross_margin_percent_calc, 2) AS gross_margin_percent,
-          ROUND(antal_salda_sum, 2) AS units_sold
-        FROM curated_month
-        WHERE fors_sum_sum > 0
-          AND gross_margin_percent_calc IS NOT NULL
-          AND gross_margin_percent_calc < 35
-        ORDER BY net_sales DESC
-        LIMIT ?
+        QUALIFY section_rank <= $top_n
+        UNION ALL
+        SELECT 'product_top_sales' AS section, ROW_NUMBER() OVER (ORDER BY net_sales DESC) AS section_rank, *
+        FROM articles
+        QUALIFY section_rank <= $top_n
+        UNION ALL
+        SELECT 'product_top_profit' AS section, ROW_NUMBER() OVER (ORDER BY gross_profit DESC) AS section_rank, *
+        FROM articles
+        QUALIFY section_rank <= $top_n
+        UNION ALL
+        SELECT 'low_margin_high_sales' AS section, ROW_NUMBER() OVER (ORDER BY net_sales DESC) AS section_rank, *
+        FROM articles
+        WHERE is_low_margin_high_sales
+        QUALIFY section_rank <= $top_n
         """,
-        [safe_top_n],
+        {"top_n": top_n},
+        ARTICLE_RANKING_COLUMNS,
     )
+    margin_risks = article_rankings["margin_risks"]
+    return_risks = article_rankings["return_risks"]
+    product_top_sales = article_rankings["product_top_sales"]
+    product_top_profit = article_rankings["product_top_profit"]
+    low_margin_high_sales = article_rankings["low_margin_high_sales"]
 
     inventory_hotspots = fetch_rows(
         conn,
@@ -1714,27 +724,31 @@ def generate_kpi_report(
         SELECT
           filial,
           avdelning,
-          ROUND(SUM(COALESCE(estimated_stock_value, 0)), 2) AS estimated_stock_value,
-          ROUND(SUM(fors_sum_sum), 2) AS net_sales,
-          ROUND(CASE WHEN SUM(fors_sum_sum) = 0 THEN NULL ELSE SUM(COALESCE(estimated_stock_value, 0)) / SUM(fors_sum_sum) END, 3)
+          ROUND(estimated_stock_value, 2) AS estimated_stock_value,
+          ROUND(net_sales, 2) AS net_sales,
+          ROUND(CASE WHEN net_sales = 0 THEN NULL ELSE estimated_stock_value / net_sales END, 3)
             AS stock_to_sales_ratio
-        FROM curated_month
-        GROUP BY filial, avdelning
+        FROM curated_month_groups
+        WHERE grouping_level = 'store_department'
         ORDER BY estimated_stock_value DESC
         LIMIT ?
         """,
-        [safe_top_n],
+        [top_n],
     )
 
     available_stores = [
-        str(row["filial"])
-        for row in fetch_rows(conn, "SELECT DISTINCT filial FROM curated_all ORDER BY filial")
-        if row.get("filial")
+        str(value)
+        for value in fetch_table(conn, "SELECT DISTINCT filial FROM curated_all ORDER BY filial")
+        .column("filial")
+        .to_pylist()
+        if value
     ]
     available_departments = [
-        str(row["avdelning"])
-        for row in fetch_rows(conn, "SELECT DISTINCT avdelning FROM curated_all ORDER BY avdelning")
-        if row.get("avdelning")
+        str(value)
+        for value in fetch_table(conn, "SELECT DISTINCT avdelning FROM curated_all ORDER BY avdelning")
+        .column("avdelning")
+        .to_pylist()
+        if value
     ]
     available_report_years = sorted({month[:4] for month in available_months if len(month) >= 7})
     available_month_numbers = sorted(
@@ -1819,7 +833,7 @@ def generate_kpi_report(
         WHERE rn <= ?
         ORDER BY report_month DESC, gross_profit ASC
         """,
-        [safe_top_n],
+        [top_n],
     )
 
     time_return_risks = fetch_rows(
@@ -1861,7 +875,7 @@ def generate_kpi_report(
         WHERE rn <= ?
         ORDER BY report_month DESC, units_sold ASC, net_sales ASC
         """,
-        [safe_top_n],
+        [top_n],
     )
 
     time_low_margin_high_sales = fetch_rows(
@@ -1906,21 +920,12 @@ def generate_kpi_report(
         WHERE rn <= ?
         ORDER BY report_month DESC, net_sales DESC
         """,
-        [safe_top_n],
+        [top_n],
     )
 
     month_over_month: dict[str, Any] | None = None
-    if previous_path is not None:
-        curr = fetch_one(
-            conn,
-            """
-            SELECT
-              ROUND(SUM(fors_sum_sum), 2) AS net_sales,
-              ROUND(SUM(tb_sum), 2) AS gross_profit,
-              ROUND(SUM(antal_salda_sum), 2) AS units_sold
-            FROM curated_month
-            """,
-        )
+    if previous_month is not None:
+        curr = summary
         prev = fetch_one(
             conn,
             """
@@ -1969,24 +974,7 @@ def generate_kpi_report(
             else None,
         }
 
-    conn_close()
-    try:
-        atexit.unregister(conn_close)
-    except Exception:
-        pass
-
-    payload = {
-        "generated_at_utc": utc_now_iso(),
-        "schema_id": "sales_monthly_curated_v1",
-        "report_month": target_month,
-        "source_curated_file": str(target_path),
-        "previous_month": previous_month,
-        "top_n": safe_top_n,
-        "available_report_months": available_months,
-        "available_report_months_full": available_months_all,
-        "history_months_applied": len(available_months),
-        "duckdb_threads": safe_threads,
-        "duckdb_memory_limit": safe_memory_limit,
+    return {
         "available_report_years": available_report_years,
         "available_month_numbers": available_month_numbers,
         "available_stores": available_stores,
@@ -2010,6 +998,78 @@ def generate_kpi_report(
         "month_over_month": month_over_month,
     }
 
+
+def generate_kpi_report(
+    *,
+    output_root: Path,
+    report_month: str | None = None,
+    top_n: int = 10,
+    history_months: int | None = 12,
+    duckdb_threads: int = 2,
+    duckdb_memory_limit: str = "768MB",
+    output_path: Path | None = None,
+    conn=None,
+) -> tuple[dict[str, Any], Path, Path]:
+    if report_month is not None and not is_valid_report_month(report_month):
+        raise ValueError("report_month must have format YYYY-MM.")
+    if history_months is not None and history_months < 1:
+        raise ValueError("history_months must be >= 1, or None for all history.")
+    safe_threads = max(1, int(duckdb_threads))
+    safe_memory_limit = normalize_duckdb_memory_limit(duckdb_memory_limit)
+    safe_top_n = max(1, min(int(top_n), 200))
+    month_files = discover_curated_month_files(output_root)
+    if not month_files:
+        raise FileNotFoundError("No curated parquet files found under data/curated/sales_monthly/v1.")
+
+    available_months_all = sorted(month_files.keys())
+    target_month = report_month or available_months_all[-1]
+    if target_month not in month_files:
+        raise ValueError(f"Requested report month {target_month!r} not found. Available: {available_months_all}")
+
+    target_path = month_files[target_month]
+    month_index = {month: index for index, month in enumerate(available_months_all)}
+    available_months = selected_history_months(available_months_all, target_month, history_months, month_index)
+    previous_month = None
+    idx = month_index[target_month]
+    if idx > 0:
+        previous_month = available_months_all[idx - 1]
+
+    scan_months = list(available_months)
+    if previous_month is not None and previous_month not in scan_months:
+        scan_months.insert(0, previous_month)
+
+    owns_connection = conn is None
+    if owns_connection:
+        conn = open_kpi_connection(threads=safe_threads, memory_limit=safe_memory_limit)
+    try:
+        sections = query_kpi_sections(
+            conn,
+            month_files=month_files,
+            scan_months=scan_months,
+            available_months=available_months,
+            target_month=target_month,
+            previous_month=previous_month,
+            top_n=safe_top_n,
+        )
+    finally:
+        if owns_connection:
+            conn.close()
+
+    payload = {
+        "generated_at_utc": utc_now_iso(),
+        "schema_id": "sales_monthly_curated_v1",
+        "report_month": target_month,
+        "source_curated_file": str(target_path),
+        "previous_month": previous_month,
+        "top_n": safe_top_n,
+        "available_report_months": available_months,
+        "available_report_months_full": available_months_all,
+        "history_months_applied": len(available_months),
+        "duckdb_threads": safe_threads,
+        "duckdb_memory_limit": safe_memory_limit,
+        **sections,
+    }
+
     report_dir = output_root / "reports" / "sales_monthly" / "v1"
     report_dir.mkdir(parents=True, exist_ok=True)
     final_output_path = (
@@ -2020,10 +1080,11 @@ def generate_kpi_report(
 
     html_output_path = report_dir / f"kpi_{target_month}_quicklook.html"
     payload["quicklook_html_path"] = str(html_output_path)
-    clean_payload = to_json_compatible(payload)
-    final_output_path.write_text(json.dumps(clean_payload, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
-    html_output_path.write_text(build_quicklook_html(clean_payload), encoding="utf-8")
-    return clean_payload, final_output_path, html_output_path
+    atomic_write_bytes(final_output_path, encode_json(payload, indent=2, default=json_default))
+    assets = write_quicklook_assets(report_dir)
+    write_quicklook_html(html_output_path, payload, assets)
+    prune_quicklook_assets(report_dir, set(assets.values()))
+    return payload, final_output_path, html_output_path
 
 
 def main() -> None:
@@ -2031,8 +1092,9 @@ def main() -> None:
     parser.add_argument("--output-root", required=True, help="Root path for analytics data.")
     parser.add_argument(
         "--report-month",
-        required=False,
-        help="Optional month YYYY-MM. Defaults to latest available month in curated layer.",
+        action="append",
+        default=None,
+        help="Optional month YYYY-MM. Can be provided multiple times. Defaults to latest available month in curated layer.",
     )
     parser.add_argument(
         "--top-n",
@@ -2060,20 +1122,28 @@ def main() -> None:
     parser.add_argument("--output", required=False, help="Optional custom output file path for KPI JSON.")
     args = parser.parse_args()
 
+    report_months = args.report_month or [None]
+    if args.output and len(report_months) > 1:
+        parser.error("--output can only be used with a single --report-month.")
+
     output_root = Path(args.output_root).expanduser().resolve()
     output = Path(args.output).expanduser().resolve() if args.output else None
     history_months = None if int(args.history_months) == 0 else int(args.history_months)
-    _, output_path, html_path = generate_kpi_report(
-        output_root=output_root,
-        report_month=args.report_month,
-        top_n=int(args.top_n),
-        history_months=history_months,
-        duckdb_threads=int(args.duckdb_threads),
-        duckdb_memory_limit=str(args.duckdb_memory_limit),
-        output_path=output,
-    )
-    print(f"KPI report written: {output_path}")
-    print(f"KPI quicklook html written: {html_path}")
+    # One DuckDB session serves every requested month; the temp tables are replaced per report.
+    with open_kpi_connection(threads=args.duckdb_threads, memory_limit=args.duckdb_memory_limit) as conn:
+        for report_month in report_months:
+            _, output_path, html_path = generate_kpi_report(
+                output_root=output_root,
+                report_month=report_month,
+                top_n=int(args.top_n),
+                history_months=history_months,
+                duckdb_threads=int(args.duckdb_threads),
+                duckdb_memory_limit=str(args.duckdb_memory_limit),
+                output_path=output,
+                conn=conn,
+            )
+            print(f"KPI report written: {output_path}")
+            print(f"KPI quicklook html written: {html_path}")
 
 
 if __name__ == "__main__":
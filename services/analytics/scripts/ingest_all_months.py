@@ -1,31 +1,30 @@
 from __future__ import annotations
 
 import argparse
-import hashlib
+import functools
 import json
+import os
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timezone
 from pathlib import Path
 from typing import Any
 
-import pyarrow.parquet as pq
-
-from common import SCHEMA_ID, parse_report_month
-from ingest_sales_month import ingest_workbook
+from common import (
+    RAW_COMPRESSION_LEVEL,
+    SCHEMA_ID,
+    WORKBOOK_ENGINES,
+    atomic_write_bytes,
+    encode_json,
+    file_sha256,
+    parse_report_month,
+)
 
 
 def utc_now_iso() -> str:
     return datetime.now(timezone.utc).replace(microsecond=0).isoformat()
 
 
-def file_sha256(path: Path) -> str:
-    hasher = hashlib.sha256()
-    with path.open("rb") as f:
-        for chunk in iter(lambda: f.read(1024 * 1024), b""):
-            hasher.update(chunk)
-    return hasher.hexdigest()
-
-
 def stat_modified_iso(path: Path) -> str:
     modified = datetime.fromtimestamp(path.stat().st_mtime, tz=timezone.utc)
     return modified.replace(microsecond=0).isoformat()
@@ -58,7 +57,7 @@ def load_state(state_path: Path) -> dict[str, Any]:
 def save_state(state_path: Path, state: dict[str, Any]) -> None:
     state_path.parent.mkdir(parents=True, exist_ok=True)
     state["updated_at"] = utc_now_iso()
-    state_path.write_text(json.dumps(state, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+    atomic_write_bytes(state_path, encode_json(state, indent=2))
 
 
 def discover_input_files(input_dir: Path) -> tuple[list[dict[str, Any]], list[dict[str, Any]]]:
@@ -77,14 +76,16 @@ def discover_input_files(input_dir: Path) -> tuple[list[dict[str, Any]], list[di
             )
             continue
 
+        stat = path.stat()
         candidates.append(
             {
                 "path": path.resolve(),
                 "file_name": path.name,
                 "report_month": report_month,
-                "size_bytes": path.stat().st_size,
+                "size_bytes": stat.st_size,
                 "modified_at_utc": stat_modified_iso(path),
-                "modified_at_epoch": path.stat().st_mtime,
+                "modified_at_epoch": stat.st_mtime,
+                "modified_at_epoch_ns": stat.st_mtime_ns,
             }
         )
 
@@ -116,6 +117,86 @@ def discover_input_files(input_dir: Path) -> tuple[list[dict[str, Any]], list[di
     return selected, skipped
 
 
+def latest_ingested_sha256_by_month(files: dict[str, dict[str, Any]]) -> dict[str, str | None]:
+    latest: dict[str, tuple[str, str | None]] = {}
+    for entry in files.values():
+        month = entry.get("report_month")
+        ingested_at = entry.get("ingested_at_utc")
+        if not month or not ingested_at:
+            continue
+        current = latest.get(month)
+        if current is None or ingested_at > current[0]:
+            latest[month] = (ingested_at, entry.get("sha256"))
+        elif ingested_at == current[0] and entry.get("sha256") != current[1]:
+            # Two different files ingested in the same second: unknown which one the parquet holds.
+            latest[month] = (ingested_at, None)
+    return {month: sha256 for month, (_, sha256) in latest.items()}
+
+
+def ingest_input_file(
+    file_info: dict[str, Any],
+    checksum: str,
+    *,
+    base_dir: Path,
+    output_root: Path,
+    report_dir: Path,
+    strict_headers: bool,
+    engine: str,
+    compression_level: int = RAW_COMPRESSION_LEVEL,
+) -> dict[str, Any]:
+    # Deferred so runs where every file is unchanged never load pyarrow.
+    from ingest_sales_month import ingest_workbook, write_raw_parquet
+
+    path: Path = file_info["path"]
+    try:
+        table, report = ingest_workbook(
+            input_path=path,
+            base_dir=base_dir,
+            strict_headers=strict_headers,
+            engine=engine,
+        )
+
+        report_month = report["report_month"]
+        raw_dir = output_root / "raw" / "sales_monthly" / "v1" / f"report_month_{report_month}"
+        raw_dir.mkdir(parents=True, exist_ok=True)
+        parquet_path = raw_dir / "sales_monthly_v1.parquet"
+
+        ingest_report_path = report_dir / f"{report_month}_ingest.json"
+        write_raw_parquet(table, parquet_path, compression_level)
+        atomic_write_bytes(ingest_report_path, encode_json(report, indent=2))
+
+        return {
+            "state_entry": {
+                "file_name": path.name,
+                "absolute_path": str(path),
+                "report_month": report_month,
+                "sha256": checksum,
+                "size_bytes": file_info["size_bytes"],
+                "modified_at_utc": file_info["modified_at_utc"],
+                "modified_at_epoch": file_info["modified_at_epoch"],
+                "modified_at_epoch_ns": file_info["modified_at_epoch_ns"],
+                "ingested_at_utc": utc_now_iso(),
+                "rows_loaded": report["totals"].get("rows_loaded", 0),
+                "parquet_path": str(parquet_path),
+                "ingest_report_path": str(ingest_report_path),
+            },
+            "processed": {
+                "file": str(path),
+                "report_month": report_month,
+                "rows_loaded": report["totals"].get("rows_loaded", 0),
+                "parquet_path": str(parquet_path),
+            },
+        }
+    except Exception as error:  # pragma: no cover - operational path
+        return {
+            "failure": {
+                "file": str(path),
+                "report_month": file_info["report_month"],
+                "error": str(error),
+            }
+        }
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(description="Ingest all monthly sales workbooks incrementally.")
     parser.add_argument("--input-dir", required=True, help="Folder containing monthly .xlsx files.")
@@ -130,6 +211,23 @@ def main() -> None:
         action="store_true",
         help="Continue even if source header does not match expected schema header.",
     )
+    parser.add_argument(
+        "--engine",
+        choices=WORKBOOK_ENGINES,
+        default="calamine",
+        help="Excel reader. calamine falls back to openpyxl when python-calamine is not installed.",
+    )
+    parser.add_argument(
+        "--compression-level",
+        type=int,
+        default=RAW_COMPRESSION_LEVEL,
+        help=f"zstd level for raw parquet (default {RAW_COMPRESSION_LEVEL}). Higher is smaller but slower to write.",
+    )
+    parser.add_argument(
+        "--force-rehash",
+        action="store_true",
+        help="Checksum every file even when size and modified time match the state file.",
+    )
     parser.add_argument(
         "--build-curated",
         action="store_true",
@@ -175,6 +273,13 @@ def main() -> None:
     processed: list[dict[str, Any]] = []
     unchanged: list[dict[str, Any]] = []
     failed: list[dict[str, Any]] = []
+    to_ingest: list[tuple[dict[str, Any], str]] = []
+    key_by_month_sha256 = {
+        (entry.get("report_month"), entry["sha256"]): key
+        for key, entry in state["files"].items()
+        if entry.get("sha256")
+    }
+    current_sha256_by_month = latest_ingested_sha256_by_month(state["files"])
 
     for file_info in files_to_consider:
         path: Path = file_info["path"]
@@ -183,13 +288,16 @@ def main() -> None:
 
         same_month = previous.get("report_month") == file_info["report_month"]
         same_size = previous.get("size_bytes") == file_info["size_bytes"]
-        same_mtime = (
-            previous.get("modified_at_epoch") == file_info["modified_at_epoch"]
-            or previous.get("modified_at_utc") == file_info["modified_at_utc"]
-        )
+        if "modified_at_epoch_ns" in previous:
+            same_mtime = previous["modified_at_epoch_ns"] == file_info["modified_at_epoch_ns"]
+        else:
+            same_mtime = (
+                previous.get("modified_at_epoch") == file_info["modified_at_epoch"]
+                or previous.get("modified_at_utc") == file_info["modified_at_utc"]
+            )
 
         # Fast-path: unchanged by file metadata, avoid expensive checksum read.
-        if same_month and same_size and same_mtime:
+        if same_month and same_size and same_mtime and not args.force_rehash:
             unchanged.append(
                 {
                     "file": str(path),
@@ -200,7 +308,12 @@ def main() -> None:
 
         checksum = file_sha256(path)
 
-        if previous.get("sha256") == checksum and previous.get("report_month") == file_info["report_month"]:
+        if previous.get("sha256") == checksum and same_month:
+            # Content is unchanged; remember the new stat so the next run takes the fast path.
+            previous["size_bytes"] = file_info["size_bytes"]
+            previous["modified_at_utc"] = file_info["modified_at_utc"]
+            previous["modified_at_epoch"] = file_info["modified_at_epoch"]
+            previous["modified_at_epoch_ns"] = file_info["modified_at_epoch_ns"]
             unchanged.append(
                 {
                     "file": str(path),
@@ -209,54 +322,57 @@ def main() -> None:
             )
             continue
 
-        try:
-            table, report = ingest_workbook(
-                input_path=path,
-                base_dir=base_dir,
-                strict_headers=not args.allow_header_mismatch,
-            )
-
-            report_month = report["report_month"]
-            raw_dir = output_root / "raw" / "sales_monthly" / "v1" / f"report_month_{report_month}"
-            raw_dir.mkdir(parents=True, exist_ok=True)
-            parquet_path = raw_dir / "sales_monthly_v1.parquet"
-
-            ingest_report_path = report_dir / f"{report_month}_ingest.json"
-            pq.write_table(table, parquet_path, compression="zstd")
-            ingest_report_path.write_text(
-                json.dumps(report, ensure_ascii=False, indent=2) + "\n",
-                encoding="utf-8",
-            )
-
+        # Same content under a new path (renamed or moved file): carry the entry over instead of reingesting,
+        # but only while that content is still what the month's raw parquet was last built from.
+        moved_key = key_by_month_sha256.get((file_info["report_month"], checksum))
+        moved = state["files"].get(moved_key) if moved_key is not None and moved_key != key else None
+        if moved is not None and current_sha256_by_month.get(file_info["report_month"]) == checksum:
             state["files"][key] = {
+                **moved,
                 "file_name": path.name,
                 "absolute_path": str(path),
-                "report_month": report_month,
-                "sha256": checksum,
                 "size_bytes": file_info["size_bytes"],
                 "modified_at_utc": file_info["modified_at_utc"],
                 "modified_at_epoch": file_info["modified_at_epoch"],
-                "ingested_at_utc": utc_now_iso(),
-                "rows_loaded": report["totals"].get("rows_loaded", 0),
-                "parquet_path": str(parquet_path),
-                "ingest_report_path": str(ingest_report_path),
+                "modified_at_epoch_ns": file_info["modified_at_epoch_ns"],
             }
-            processed.append(
-                {
-                    "file": str(path),
-                    "report_month": report_month,
-                    "rows_loaded": report["totals"].get("rows_loaded", 0),
-                    "parquet_path": str(parquet_path),
-                }
-            )
-        except Exception as error:  # pragma: no cover - operational path
-            failed.append(
+            if not Path(moved.get("absolute_path", "")).exists():
+                del state["files"][moved_key]
+            key_by_month_sha256[(file_info["report_month"], checksum)] = key
+            unchanged.append(
                 {
                     "file": str(path),
                     "report_month": file_info["report_month"],
-                    "error": str(error),
+                    "moved_from": moved.get("absolute_path"),
                 }
             )
+            continue
+
+        to_ingest.append((file_info, checksum))
+
+    if to_ingest:
+        ingest_one = functools.partial(
+            ingest_input_file,
+            base_dir=base_dir,
+            output_root=output_root,
+            report_dir=report_dir,
+            strict_headers=not args.allow_header_mismatch,
+            engine=args.engine,
+            compression_level=args.compression_level,
+        )
+        if len(to_ingest) > 1:
+            max_workers = min(len(to_ingest), os.cpu_count() or 1)
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(ingest_one, *zip(*to_ingest)))
+        else:
+            results = [ingest_one(*item) for item in to_ingest]
+        # State is only mutated here, in the parent process, in month order.
+        for (file_info, _), result in zip(to_ingest, results):
+            if "failure" in result:
+                failed.append(result["failure"])
+                continue
+            state["files"][normalize_state_path_key(file_info["path"])] = result["state_entry"]
+            processed.append(result["processed"])
 
     save_state(state_path, state)
 
@@ -346,8 +462,9 @@ def main() -> None:
     run_report_path = runs_dir / f"{run_id}_folder_ingest.json"
     latest_report_path = report_dir / "latest_folder_ingest.json"
 
-    run_report_path.write_text(json.dumps(run_summary, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
-    latest_report_path.write_text(json.dumps(run_summary, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+    run_summary_blob = encode_json(run_summary, indent=2)
+    atomic_write_bytes(run_report_path, run_summary_blob)
+    atomic_write_bytes(latest_report_path, run_summary_blob)
 
     print(f"Discovered files: {len(files_to_consider)}")
     print(f"Processed: {len(processed)}")
@@ -1,64 +1,96 @@
 from __future__ import annotations
 
 import argparse
-import json
 from collections import defaultdict
 from pathlib import Path
 from typing import Any
 
 import pyarrow as pa
+import pyarrow.compute as pc
 import pyarrow.parquet as pq
 
 from common import (
+    RAW_COMPRESSION_LEVEL,
+    WORKBOOK_ENGINES,
+    atomic_write_bytes,
     build_arrow_schema,
+    encode_json,
     header_matches,
     is_empty_row,
     load_schema_definition,
     open_workbook,
-    parse_number,
+    parse_number_column,
     parse_text,
     parse_report_month,
 )
 
 
-def map_row_to_record(
-    row: tuple[Any, ...],
-    *,
-    source_file: str,
-    source_sheet: str,
-    source_row: int,
-    report_month: str,
-) -> dict[str, Any]:
-    padded = list(row[:15]) + [None] * max(0, 15 - len(row))
-    return {
-        "source_file": source_file,
-        "source_sheet": source_sheet,
-        "source_row": source_row,
-        "report_month": report_month,
-        "filial": parse_text(padded[0]),
-        "avdelning": parse_text(padded[1]),
-        "varugrupp": parse_text(padded[2]),
-        "artnr": parse_text(padded[3]),
-        "ean": parse_text(padded[4]),
-        "varutext": parse_text(padded[5]),
-        "huvudleverantor": parse_text(padded[6]),
-        "antal_salda": parse_number(padded[7]),
-        "fors_sum": parse_number(padded[8]),
-        "tb": parse_number(padded[9]),
-        "tg_percent": parse_number(padded[10]),
-        "fors_m_moms": parse_number(padded[11]),
-        "ord_pris": parse_number(padded[12]),
-        "snitt_inpris": parse_number(padded[13]),
-        "lager_antal": parse_number(padded[14]),
-    }
+TEXT_COLUMNS = (
+    "filial",
+    "avdelning",
+    "varugrupp",
+    "artnr",
+    "ean",
+    "varutext",
+    "huvudleverantor",
+)
+NUMBER_COLUMNS = (
+    "antal_salda",
+    "fors_sum",
+    "tb",
+    "tg_percent",
+    "fors_m_moms",
+    "ord_pris",
+    "snitt_inpris",
+    "lager_antal",
+)
+RAW_ROW_GROUP_ROWS = 262_144
+RAW_DICTIONARY_COLUMNS = (
+    "source_file",
+    "source_sheet",
+    "report_month",
+    "filial",
+    "avdelning",
+    "varugrupp",
+    "huvudleverantor",
+)
+
+
+def count_negative(values: pa.Array) -> int:
+    return int(pc.sum(pc.less(values, 0)).as_py() or 0)
+
+
+def write_raw_parquet(
+    table: pa.Table,
+    parquet_path: Path,
+    compression_level: int = RAW_COMPRESSION_LEVEL,
+) -> None:
+    pq.write_table(
+        table,
+        parquet_path,
+        compression="zstd",
+        compression_level=compression_level,
+        use_dictionary=[name for name in RAW_DICTIONARY_COLUMNS if name in table.column_names],
+        row_group_size=RAW_ROW_GROUP_ROWS,
+        data_page_size=1 << 20,
+        write_statistics=True,
+    )
 
 
-def ingest_workbook(input_path: Path, base_dir: Path, strict_headers: bool) -> tuple[pa.Table, dict[str, Any]]:
+def ingest_workbook(
+    input_path: Path,
+    base_dir: Path,
+    strict_headers: bool,
+    engine: str = "calamine",
+) -> tuple[pa.Table, dict[str, Any]]:
     schema = load_schema_definition(base_dir)
     report_month = parse_report_month(input_path)
-    wb = open_workbook(input_path)
+    wb = open_workbook(input_path, engine)
 
-    records: list[dict[str, Any]] = []
+    columns: dict[str, list[Any]] = {
+        name: [] for name in ("source_file", "source_sheet", "source_row", "report_month", *TEXT_COLUMNS)
+    }
+    number_chunks: dict[str, list[pa.Array]] = {name: [] for name in NUMBER_COLUMNS}
     ingest_report: dict[str, Any] = {
         "schema_id": schema.schema_id,
         "input_file": str(input_path),
@@ -74,7 +106,7 @@ def ingest_workbook(input_path: Path, base_dir: Path, strict_headers: bool) -> t
         rows = ws.iter_rows(values_only=True)
         first_row = next(rows, None)
         header = list(first_row or [])
-        header_ok = header_matches(header, schema.expected_header_order)
+        header_ok = header_matches(header, schema)
 
         if strict_headers and not header_ok:
             raise ValueError(
@@ -83,13 +115,12 @@ def ingest_workbook(input_path: Path, base_dir: Path, strict_headers: bool) -> t
             )
 
         rows_seen = 0
-        rows_loaded = 0
         rows_skipped_empty = 0
-        negative_qty = 0
-        negative_tb = 0
-        negative_tg = 0
-        negative_stock = 0
-        missing_ean = 0
+        source_rows: list[int] = []
+        raw_columns: list[list[Any]] = [[] for _ in (*TEXT_COLUMNS, *NUMBER_COLUMNS)]
+        appenders = [values.append for values in raw_columns]
+        column_count = len(raw_columns)
+        add_source_row = source_rows.append
 
         for row_index, row in enumerate(rows, start=2):
             rows_seen += 1
@@ -97,31 +128,32 @@ def ingest_workbook(input_path: Path, base_dir: Path, strict_headers: bool) -> t
                 rows_skipped_empty += 1
                 continue
 
-            record = map_row_to_record(
-                row,
-                source_file=input_path.name,
-                source_sheet=sheet_name,
-                source_row=row_index,
-                report_month=report_month,
-            )
-            records.append(record)
-            rows_loaded += 1
-
-            qty = record["antal_salda"]
-            tb = record["tb"]
-            tg = record["tg_percent"]
-            stock = record["lager_antal"]
-
-            if record["ean"] is None:
-                missing_ean += 1
-            if qty is not None and qty < 0:
-                negative_qty += 1
-            if tb is not None and tb < 0:
-                negative_tb += 1
-            if tg is not None and tg < 0:
-                negative_tg += 1
-            if stock is not None and stock < 0:
-                negative_stock += 1
+            add_source_row(row_index)
+            if len(row) < column_count:
+                row = (*row, *(None,) * (column_count - len(row)))
+            for append, value in zip(appenders, row):
+                append(value)
+
+        sheet_text = [list(map(parse_text, values)) for values in raw_columns[: len(TEXT_COLUMNS)]]
+        raw_numbers = raw_columns[len(TEXT_COLUMNS) :]
+        rows_loaded = len(source_rows)
+        sheet_numbers = {
+            name: parse_number_column(values) for name, values in zip(NUMBER_COLUMNS, raw_numbers)
+        }
+        for name, values in sheet_numbers.items():
+            number_chunks[name].append(values)
+        for name, values in zip(TEXT_COLUMNS, sheet_text):
+            columns[name].extend(values)
+        columns["source_file"].extend([input_path.name] * rows_loaded)
+        columns["source_sheet"].extend([sheet_name] * rows_loaded)
+        columns["source_row"].extend(source_rows)
+        columns["report_month"].extend([report_month] * rows_loaded)
+
+        missing_ean = sum(1 for value in sheet_text[TEXT_COLUMNS.index("ean")] if value is None)
+        negative_qty = count_negative(sheet_numbers["antal_salda"])
+        negative_tb = count_negative(sheet_numbers["tb"])
+        negative_tg = count_negative(sheet_numbers["tg_percent"])
+        negative_stock = count_negative(sheet_numbers["lager_antal"])
 
         ingest_report["sheets"].append(
             {
@@ -153,7 +185,13 @@ def ingest_workbook(input_path: Path, base_dir: Path, strict_headers: bool) -> t
     ingest_report["all_headers_ok"] = all(s["header_ok"] for s in ingest_report["sheets"])
 
     arrow_schema = build_arrow_schema(schema.fields)
-    table = pa.Table.from_pylist(records, schema=arrow_schema)
+    arrays: list[pa.Array] = []
+    for field in arrow_schema:
+        if field.name in number_chunks:
+            arrays.append(pa.concat_arrays(number_chunks[field.name] or [pa.array([], type=pa.float64())]))
+        else:
+            arrays.append(pa.array(columns[field.name], type=field.type))
+    table = pa.Table.from_arrays(arrays, schema=arrow_schema)
     return table, ingest_report
 
 
@@ -170,6 +208,18 @@ def main() -> None:
         action="store_true",
         help="Continue even if source header does not match expected schema header.",
     )
+    parser.add_argument(
+        "--engine",
+        choices=WORKBOOK_ENGINES,
+        default="calamine",
+        help="Excel reader. calamine falls back to openpyxl when python-calamine is not installed.",
+    )
+    parser.add_argument(
+        "--compression-level",
+        type=int,
+        default=RAW_COMPRESSION_LEVEL,
+        help=f"zstd level for raw parquet (default {RAW_COMPRESSION_LEVEL}). Higher is smaller but slower to write.",
+    )
     args = parser.parse_args()
 
     input_path = Path(args.input).expanduser().resolve()
@@ -183,6 +233,7 @@ def main() -> None:
         input_path=input_path,
         base_dir=base_dir,
         strict_headers=not args.allow_header_mismatch,
+        engine=args.engine,
     )
 
     report_month = report["report_month"]
@@ -194,8 +245,8 @@ def main() -> None:
     parquet_path = raw_dir / "sales_monthly_v1.parquet"
     report_path = report_dir / f"{report_month}_ingest.json"
 
-    pq.write_table(table, parquet_path, compression="zstd")
-    report_path.write_text(json.dumps(report, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+    write_raw_parquet(table, parquet_path, args.compression_level)
+    atomic_write_bytes(report_path, encode_json(report, indent=2))
 
     print(f"Rows loaded: {report['totals'].get('rows_loaded', 0)}")
     print(f"Headers OK: {report['all_headers_ok']}")
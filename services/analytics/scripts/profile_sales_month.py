@@ -1,25 +1,34 @@
 from __future__ import annotations
 
 import argparse
-import json
 from collections import defaultdict
 from pathlib import Path
 from typing import Any
 
+import pyarrow as pa
+import pyarrow.compute as pc
+
 from common import (
+    WORKBOOK_ENGINES,
+    atomic_write_bytes,
+    encode_json,
     header_matches,
     is_empty_row,
     load_schema_definition,
     open_workbook,
-    parse_number,
+    parse_number_column,
     parse_text,
     parse_report_month,
 )
 
 
-def profile_workbook(input_path: Path, base_dir: Path) -> dict[str, Any]:
+def count_true(mask: pa.Array) -> int:
+    return int(pc.sum(mask).as_py() or 0)
+
+
+def profile_workbook(input_path: Path, base_dir: Path, engine: str = "calamine") -> dict[str, Any]:
     schema = load_schema_definition(base_dir)
-    wb = open_workbook(input_path)
+    wb = open_workbook(input_path, engine)
     report_month = parse_report_month(input_path)
 
     workbook_summary: dict[str, Any] = {
@@ -37,69 +46,51 @@ def profile_workbook(input_path: Path, base_dir: Path) -> dict[str, Any]:
         rows = ws.iter_rows(values_only=True)
         first_row = next(rows, None)
         header = list(first_row or [])
-        header_ok = header_matches(header, schema.expected_header_order)
+        header_ok = header_matches(header, schema)
 
-        per_col_missing = defaultdict(int)
         data_rows = 0
-        rows_with_any_value = 0
-        negative_qty = 0
-        non_integer_qty = 0
-        zero_sales = 0
-        negative_tb = 0
-        negative_tg = 0
-        tg_over_100 = 0
-        negative_stock = 0
-        unique_artnr = set()
-        unique_ean = set()
-
+        raw_columns: list[list[Any]] = [[] for _ in schema.expected_header_order]
+        appenders = [values.append for values in raw_columns]
+        column_count = len(raw_columns)
         for row in rows:
             data_rows += 1
             if is_empty_row(row):
                 continue
-            rows_with_any_value += 1
-
-            padded = list(row[:15]) + [None] * max(0, 15 - len(row))
-            for idx, source_col in enumerate(schema.expected_header_order):
-                if padded[idx] in (None, ""):
-                    per_col_missing[source_col] += 1
-
-            artnr = parse_text(padded[3])
-            ean = parse_text(padded[4])
-            qty = parse_number(padded[7])
-            sales = parse_number(padded[8])
-            tb = parse_number(padded[9])
-            tg = parse_number(padded[10])
-            stock = parse_number(padded[14])
-
-            if artnr:
-                unique_artnr.add(artnr)
-            if ean:
-                unique_ean.add(ean)
-
-            if qty is not None:
-                if qty < 0:
-                    negative_qty += 1
-                if abs(qty - round(qty)) > 1e-9:
-                    non_integer_qty += 1
-            if sales is not None and abs(sales) < 1e-9:
-                zero_sales += 1
-            if tb is not None and tb < 0:
-                negative_tb += 1
-            if tg is not None:
-                if tg < 0:
-                    negative_tg += 1
-                if tg > 100:
-                    tg_over_100 += 1
-            if stock is not None and stock < 0:
-                negative_stock += 1
+            if len(row) < column_count:
+                row = (*row, *(None,) * (column_count - len(row)))
+            for append, value in zip(appenders, row):
+                append(value)
+        rows_with_any_value = len(raw_columns[0])
+
+        per_col_missing = {
+            source_col: values.count(None) + values.count("")
+            for source_col, values in zip(schema.expected_header_order, raw_columns)
+        }
+        artnr = pa.array(list(map(parse_text, raw_columns[3])), type=pa.string())
+        ean = pa.array(list(map(parse_text, raw_columns[4])), type=pa.string())
+        qty = parse_number_column(raw_columns[7])
+        sales = parse_number_column(raw_columns[8])
+        tb = parse_number_column(raw_columns[9])
+        tg = parse_number_column(raw_columns[10])
+        stock = parse_number_column(raw_columns[14])
+
+        unique_artnr = pc.count_distinct(artnr).as_py()
+        unique_ean = pc.count_distinct(ean).as_py()
+        negative_qty = count_true(pc.less(qty, 0))
+        non_integer_qty = count_true(pc.greater(pc.abs(pc.subtract(qty, pc.round(qty))), 1e-9))
+        zero_sales = count_true(pc.less(pc.abs(sales), 1e-9))
+        negative_tb = count_true(pc.less(tb, 0))
+        negative_tg = count_true(pc.less(tg, 0))
+        tg_over_100 = count_true(pc.greater(tg, 100))
+        negative_stock = count_true(pc.less(stock, 0))
 
         sheet_summary = {
             "sheet_name": sheet_name,
             "header_ok": header_ok,
             "rows_total_excluding_header": data_rows,
             "rows_non_empty": rows_with_any_value,
-            "unique_artnr": len(unique_artnr),
-            "unique_ean": len(unique_ean),
+            "unique_artnr": unique_artnr,
+            "unique_ean": unique_ean,
             "anomalies": {
                 "negative_qty": negative_qty,
                 "non_integer_qty": non_integer_qty,
@@ -136,6 +127,12 @@ def main() -> None:
         required=False,
         help="Optional path for JSON report. If omitted, prints summary only.",
     )
+    parser.add_argument(
+        "--engine",
+        choices=WORKBOOK_ENGINES,
+        default="calamine",
+        help="Excel reader. calamine falls back to openpyxl when python-calamine is not installed.",
+    )
     args = parser.parse_args()
 
     input_path = Path(args.input).expanduser().resolve()
@@ -143,7 +140,7 @@ def main() -> None:
         raise FileNotFoundError(f"Input file not found: {input_path}")
 
     base_dir = Path(__file__).resolve().parents[1]
-    report = profile_workbook(input_path, base_dir)
+    report = profile_workbook(input_path, base_dir, args.engine)
 
     print(f"Profiled file: {input_path.name}")
     print(f"Report month: {report['report_month']}")
@@ -154,7 +151,7 @@ def main() -> None:
     if args.output:
         output_path = Path(args.output).expanduser().resolve()
         output_path.parent.mkdir(parents=True, exist_ok=True)
-        output_path.write_text(json.dumps(report, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+        atomic_write_bytes(output_path, encode_json(report, indent=2))
         print(f"Profile report written: {output_path}")
 
 
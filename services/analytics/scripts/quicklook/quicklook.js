@@ -0,0 +1,1372 @@
+(function () {
+  const data = JSON.parse(document.getElementById("kpiPayload").textContent || "{}");
+  const topN = Number(data.top_n || 10);
+  const formatMoney = new Intl.NumberFormat("sv-SE", { maximumFractionDigits: 0 });
+  const formatQty = new Intl.NumberFormat("sv-SE", { maximumFractionDigits: 0 });
+  const formatDecimal = new Intl.NumberFormat("sv-SE", { minimumFractionDigits: 0, maximumFractionDigits: 2 });
+  const monthNames = ["Jan", "Feb", "Mar", "Apr", "Maj", "Jun", "Jul", "Aug", "Sep", "Okt", "Nov", "Dec"];
+
+  const deptToggle = document.getElementById("deptToggle");
+  const deptPanel = document.getElementById("deptPanel");
+  const deptOptions = document.getElementById("deptOptions");
+  const deptAll = document.getElementById("deptAll");
+  const deptNone = document.getElementById("deptNone");
+  const storeToggle = document.getElementById("storeToggle");
+  const storePanel = document.getElementById("storePanel");
+  const storeOptions = document.getElementById("storeOptions");
+  const storeAll = document.getElementById("storeAll");
+  const storeNone = document.getElementById("storeNone");
+  const yearToggle = document.getElementById("yearToggle");
+  const yearPanel = document.getElementById("yearPanel");
+  const yearOptions = document.getElementById("yearOptions");
+  const yearAll = document.getElementById("yearAll");
+  const yearNone = document.getElementById("yearNone");
+  const monthToggle = document.getElementById("monthToggle");
+  const monthPanel = document.getElementById("monthPanel");
+  const monthOptions = document.getElementById("monthOptions");
+  const monthAll = document.getElementById("monthAll");
+  const monthNone = document.getElementById("monthNone");
+  const selectedInfo = document.getElementById("selectedInfo");
+  const storeTrendEmpty = document.getElementById("storeTrendEmpty");
+  const storeTrendSvg = document.getElementById("storeTrendSvg");
+  const storeTrendLegend = document.getElementById("storeTrendLegend");
+  const storeStockEmpty = document.getElementById("storeStockEmpty");
+  const storeStockBars = document.getElementById("storeStockBars");
+  const storeStockRatioEmpty = document.getElementById("storeStockRatioEmpty");
+  const storeStockRatioBars = document.getElementById("storeStockRatioBars");
+  const topDeptBody = document.getElementById("topDeptBody");
+  const lowMarginBody = document.getElementById("lowMarginBody");
+  const riskAnalysis = document.getElementById("riskAnalysis");
+  const riskPills = document.getElementById("riskPills");
+  const momCard = document.getElementById("momCard");
+  const kpiEls = {
+    sales: document.getElementById("kpiSales"),
+    profit: document.getElementById("kpiProfit"),
+    margin: document.getElementById("kpiMargin"),
+    units: document.getElementById("kpiUnits"),
+    stock: document.getElementById("kpiStock"),
+    avgStockUnitValue: document.getElementById("kpiAvgStockUnitValue"),
+    avgSellingPrice: document.getElementById("kpiAvgSellingPrice"),
+    stockMargin: document.getElementById("kpiStockMargin"),
+    stockMarginPct: document.getElementById("kpiStockMarginPct"),
+    stockCoverageMonths: document.getElementById("kpiStockCoverageMonths"),
+    momRange: document.getElementById("momRange"),
+    momSalesDelta: document.getElementById("momSalesDelta"),
+    momSalesDeltaPct: document.getElementById("momSalesDeltaPct"),
+    momProfitDelta: document.getElementById("momProfitDelta"),
+    momProfitDeltaPct: document.getElementById("momProfitDeltaPct"),
+  };
+
+  const fallbackMonth = String(data.report_month || "");
+  const fallbackYear = fallbackMonth.slice(0, 4);
+  const fallbackMonthNumber = Number(fallbackMonth.slice(5, 7)) || 1;
+  const riskState = { activeKey: "negative_margin" };
+  const aggregateCache = { fingerprint: null, aggregates: null };
+  const riskCache = { fingerprint: null, departmentAgg: null, metrics: null };
+  const selectionCache = { version: -1, fingerprint: null };
+  const lowMarginCache = { fingerprint: null, rows: null };
+  let filtersVersion = 0;
+  let selectedInfoVersion = -1;
+  const checkOptionHandlers = new Map();
+  const checkOptionNodes = new Map();
+  const shareRowNodes = new Map();
+  let renderScheduled = false;
+  const rowOpenHtml = "<tr><td>";
+  const rankOpenHtml = '<tr><td class="num">';
+  const cellHtml = "</td><td>";
+  const numCellHtml = '</td><td class="num">';
+  const rowCloseHtml = "</td></tr>";
+  const aggregateKeys = ["net_sales", "gross_profit", "units_sold", "estimated_stock_value", "stock_units", "stock_margin_value"];
+
+  function esc(value) {
+    return String(value ?? "")
+      .replaceAll("&", "&amp;")
+      .replaceAll("<", "&lt;")
+      .replaceAll(">", "&gt;");
+  }
+
+  function toNumber(value) {
+    if (typeof value === "number") return Number.isFinite(value) ? value : 0;
+    const n = Number(value);
+    return Number.isFinite(n) ? n : 0;
+  }
+
+  function pct(part, total) {
+    if (!Number.isFinite(part) || !Number.isFinite(total) || total === 0) return 0;
+    return (part / total) * 100;
+  }
+
+  function monthLabel(monthNumber) {
+    const n = Number(monthNumber);
+    if (!Number.isFinite(n) || n < 1 || n > 12) return String(monthNumber);
+    return String(n).padStart(2, "0") + " " + monthNames[n - 1];
+  }
+
+  function displayStoreName(value) {
+    const raw = String(value || "");
+    const withoutPrefix = raw.replace(/^EBB_/i, "");
+    return withoutPrefix.replaceAll("_", " ").trim() || raw;
+  }
+
+  function reportMonthLabel(reportMonth) {
+    const text = String(reportMonth || "");
+    if (text.length < 7) return text;
+    const year = text.slice(0, 4);
+    const month = Number(text.slice(5, 7));
+    return monthLabel(month) + " " + year;
+  }
+
+  function memoizeText(format) {
+    const cache = new Map();
+    return (value) => {
+      const key = String(value ?? "");
+      let text = cache.get(key);
+      if (text === undefined) {
+        text = format(key);
+        cache.set(key, text);
+      }
+      return text;
+    };
+  }
+
+  const storeNameHtml = memoizeText((value) => esc(displayStoreName(value)));
+  const reportMonthLabelHtml = memoizeText((value) => esc(reportMonthLabel(value)));
+
+  function daysInReportMonth(reportMonth) {
+    const text = String(reportMonth || "");
+    if (!/^\d{4}-\d{2}$/.test(text)) return 30;
+    const year = Number(text.slice(0, 4));
+    const month = Number(text.slice(5, 7));
+    if (!Number.isFinite(year) || !Number.isFinite(month) || month < 1 || month > 12) return 30;
+    return new Date(year, month, 0).getDate();
+  }
+
+  function encodeDimension(rows, valueFn, groupFn) {
+    const names = [];
+    const index = new Map();
+    const codes = new Uint32Array(rows.length);
+    rows.forEach((row, i) => {
+      const value = valueFn(row);
+      let code = index.get(value);
+      if (code === undefined) {
+        code = names.length;
+        names.push(value);
+        index.set(value, code);
+      }
+      codes[i] = code;
+    });
+    const groupNames = [];
+    const groupIndex = new Map();
+    const groupOf = new Uint32Array(names.length);
+    names.forEach((name, code) => {
+      const label = groupFn(name);
+      let group = groupIndex.get(label);
+      if (group === undefined) {
+        group = groupNames.length;
+        groupNames.push(label);
+        groupIndex.set(label, group);
+      }
+      groupOf[code] = group;
+    });
+    return { names: names, codes: codes, groupNames: groupNames, groupOf: groupOf };
+  }
+
+  function buildColumnStore(rows) {
+    const values = {};
+    for (const key of aggregateKeys) {
+      const column = new Float64Array(rows.length);
+      rows.forEach((row, i) => { column[i] = toNumber(row[key]); });
+      values[key] = column;
+    }
+    const period = encodeDimension(
+      rows,
+      (row) => String(row.report_month || "") + "|" + String(row.report_year || "") + "|" + Number(row.report_month_number),
+      (value) => value.split("|")[0]
+    );
+    return {
+      size: rows.length,
+      values: values,
+      avdelning: encodeDimension(rows, (row) => String(row.avdelning || ""), (value) => value || "Okand"),
+      filial: encodeDimension(rows, (row) => String(row.filial || ""), (value) => value || "Okand"),
+      period: period,
+      monthSlots: new Map(period.groupNames.map((month, slot) => [month, slot])),
+      monthOrder: period.groupNames
+        .map((month, slot) => slot)
+        .filter((slot) => period.groupNames[slot].length > 0)
+        .sort((a, b) => (period.groupNames[a] < period.groupNames[b] ? -1 : 1)),
+      periodYear: period.names.map((value) => value.split("|")[1]),
+      periodMonthNumber: period.names.map((value) => Number(value.split("|")[2])),
+    };
+  }
+
+  function normalizeRows(rows, defaultMonth) {
+    const defaultMonthText = String(defaultMonth || fallbackMonth);
+    const defaultYear = defaultMonthText.slice(0, 4) || fallbackYear;
+    const defaultMonthNum = Number(defaultMonthText.slice(5, 7)) || fallbackMonthNumber;
+    return (rows || []).map((row) => {
+      const reportMonth = String(row.report_month || defaultMonthText);
+      const reportYear = String(row.report_year || reportMonth.slice(0, 4) || defaultYear);
+      const reportMonthNumber = Number(row.report_month_number || Number(reportMonth.slice(5, 7)) || defaultMonthNum);
+      return {
+        ...row,
+        report_month: reportMonth,
+        report_year: reportYear,
+        report_month_number: reportMonthNumber,
+      };
+    });
+  }
+
+  const historyRows = normalizeRows(
+    (data.time_store_department_breakdown && data.time_store_department_breakdown.length > 0)
+      ? data.time_store_department_breakdown
+      : (data.store_department_breakdown || []),
+    fallbackMonth
+  );
+  const marginRiskRows = normalizeRows(
+    (data.time_margin_risk_items_top_n && data.time_margin_risk_items_top_n.length > 0)
+      ? data.time_margin_risk_items_top_n
+      : (data.margin_risk_items_top_n || []),
+    fallbackMonth
+  );
+  const returnRiskRows = normalizeRows(
+    (data.time_return_risk_items_top_n && data.time_return_risk_items_top_n.length > 0)
+      ? data.time_return_risk_items_top_n
+      : (data.return_risk_items_top_n || []),
+    fallbackMonth
+  );
+  const lowMarginRows = normalizeRows(
+    (data.time_low_margin_high_sales_top_n && data.time_low_margin_high_sales_top_n.length > 0)
+      ? data.time_low_margin_high_sales_top_n
+      : (data.low_margin_high_sales_top_n || []),
+    fallbackMonth
+  );
+
+  const historyColumns = buildColumnStore(historyRows);
+  const marginRiskColumns = buildColumnStore(marginRiskRows);
+  const returnRiskColumns = buildColumnStore(returnRiskRows);
+  const lowMarginColumns = buildColumnStore(lowMarginRows);
+
+  const allDepartments = (data.available_departments && data.available_departments.length > 0)
+    ? data.available_departments.map((value) => String(value)).filter((value) => value.length > 0)
+    : Array.from(new Set(historyRows.map((row) => String(row.avdelning || "")).filter((value) => value.length > 0))).sort();
+  const allStores = (data.available_stores && data.available_stores.length > 0)
+    ? data.available_stores.map((value) => String(value)).filter((value) => value.length > 0)
+    : Array.from(new Set(historyRows.map((row) => String(row.filial || "")).filter((value) => value.length > 0))).sort();
+  const allYears = (data.available_report_years && data.available_report_years.length > 0)
+    ? data.available_report_years.map((value) => String(value)).filter((value) => value.length > 0)
+    : Array.from(new Set(historyRows.map((row) => String(row.report_year || "")).filter((value) => value.length > 0))).sort();
+  const allMonthNumbers = (data.available_month_numbers && data.available_month_numbers.length > 0)
+    ? data.available_month_numbers.map((value) => Number(value)).filter((value) => Number.isFinite(value)).sort((a, b) => a - b)
+    : Array.from(new Set(historyRows.map((row) => Number(row.report_month_number)).filter((value) => Number.isFinite(value)))).sort((a, b) => a - b);
+
+  const selectedDepartments = new Set(allDepartments);
+  const selectedStores = new Set(allStores);
+  const selectedYears = new Set(allYears);
+  const selectedMonthNumbers = new Set(allMonthNumbers);
+
+  function fmtMoney(value) { return formatMoney.format(toNumber(value)); }
+  function fmtQty(value) { return formatQty.format(toNumber(value)); }
+  function fmtDecimal(value) { return formatDecimal.format(toNumber(value)); }
+  function fmtPct(value, decimals = 1) { return toNumber(value).toFixed(decimals) + "%"; }
+  function sumByKeys(rows, keys) {
+    const totals = keys.map(() => 0);
+    for (const row of rows) {
+      for (let k = 0; k < keys.length; k += 1) totals[k] += toNumber(row[keys[k]]);
+    }
+    return totals;
+  }
+
+  function formatEan(value) {
+    const text = String(value ?? "").trim();
+    return text.length > 0 ? text : "-";
+  }
+
+  function aggregateBy(rows, key, valueKey) {
+    const totals = new Map();
+    for (const row of rows) {
+      const group = String(row[key] || "Okand");
+      totals.set(group, (totals.get(group) || 0) + toNumber(row[valueKey]));
+    }
+    return Array.from(totals.entries()).map(([name, total]) => ({ name, total }));
+  }
+
+  function topKIndices(values, k, descending) {
+    const ranksBefore = (i, j) => {
+      if (values[i] !== values[j]) return descending ? values[i] > values[j] : values[i] < values[j];
+      return i < j;
+    };
+    const heap = [];
+    const siftDown = (start) => {
+      let parent = start;
+      for (;;) {
+        const left = parent * 2 + 1;
+        const right = left + 1;
+        let last = parent;
+        if (left < heap.length && ranksBefore(heap[last], heap[left])) last = left;
+        if (right < heap.length && ranksBefore(heap[last], heap[right])) last = right;
+        if (last === parent) return;
+        const swap = heap[parent];
+        heap[parent] = heap[last];
+        heap[last] = swap;
+        parent = last;
+      }
+    };
+    for (let i = 0; i < values.length && k > 0; i += 1) {
+      if (heap.length < k) {
+        heap.push(i);
+        let child = heap.length - 1;
+        while (child > 0) {
+          const parent = (child - 1) >> 1;
+          if (!ranksBefore(heap[parent], heap[child])) break;
+          const swap = heap[parent];
+          heap[parent] = heap[child];
+          heap[child] = swap;
+          child = parent;
+        }
+      } else if (ranksBefore(i, heap[0])) {
+        heap[0] = i;
+        siftDown(0);
+      }
+    }
+    return heap.sort((i, j) => (ranksBefore(i, j) ? -1 : 1));
+  }
+
+  function topKRows(rows, k, key, descending) {
+    const values = Float64Array.from(rows, (row) => toNumber(row[key]));
+    return topKIndices(values, k, descending).map((index) => rows[index]);
+  }
+
+  function internId(ids, value) {
+    let id = ids.get(value);
+    if (id === undefined) {
+      id = ids.size;
+      ids.set(value, id);
+    }
+    return id;
+  }
+
+  function aggregateArticles(rows, sortKey, ascending) {
+    const avdelningIds = new Map();
+    const artnrIds = new Map();
+    const eanIds = new Map();
+    const varutextIds = new Map();
+    const articleIds = new Uint32Array(rows.length * 4);
+    rows.forEach((row, i) => {
+      articleIds[i * 4] = internId(avdelningIds, String(row.avdelning || "Okand"));
+      articleIds[i * 4 + 1] = internId(artnrIds, String(row.artnr || ""));
+      articleIds[i * 4 + 2] = internId(eanIds, String(row.ean || ""));
+      articleIds[i * 4 + 3] = internId(varutextIds, String(row.varutext || ""));
+    });
+    const avdelningNames = Array.from(avdelningIds.keys());
+    const artnrNames = Array.from(artnrIds.keys());
+    const eanNames = Array.from(eanIds.keys());
+    const varutextNames = Array.from(varutextIds.keys());
+    const numericKeys = avdelningIds.size * artnrIds.size * eanIds.size * varutextIds.size <= Number.MAX_SAFE_INTEGER;
+
+    const grouped = new Map();
+    for (let i = 0; i < rows.length; i += 1) {
+      const row = rows[i];
+      const a = articleIds[i * 4];
+      const r = articleIds[i * 4 + 1];
+      const e = articleIds[i * 4 + 2];
+      const v = articleIds[i * 4 + 3];
+      const key = numericKeys
+        ? ((a * artnrIds.size + r) * eanIds.size + e) * varutextIds.size + v
+        : a + ":" + r + ":" + e + ":" + v;
+      const current = grouped.get(key) || {
+        avdelning: avdelningNames[a],
+        artnr: artnrNames[r],
+        ean: eanNames[e],
+        varutext: varutextNames[v],
+        net_sales: 0,
+        gross_profit: 0,
+        units_sold: 0,
+      };
+      current.net_sales += toNumber(row.net_sales);
+      current.gross_profit += toNumber(row.gross_profit);
+      current.units_sold += toNumber(row.units_sold);
+      grouped.set(key, current);
+    }
+    return Array.from(grouped.values())
+      .map((row) => ({
+        ...row,
+        gross_margin_percent: pct(toNumber(row.gross_profit), toNumber(row.net_sales)),
+      }))
+      .sort((a, b) => {
+        const diff = toNumber(a[sortKey]) - toNumber(b[sortKey]);
+        return ascending ? diff : -diff;
+      });
+  }
+
+  function selectionFlags(names, isSelected) {
+    const flags = new Uint8Array(names.length);
+    names.forEach((name, code) => { flags[code] = isSelected(name, code) ? 1 : 0; });
+    return flags;
+  }
+
+  function buildSelectionFlags(columns, includeDepartments) {
+    return {
+      departments: selectionFlags(columns.avdelning.names, (name) => !includeDepartments || selectedDepartments.has(name)),
+      stores: selectionFlags(columns.filial.names, (name) => selectedStores.has(name)),
+      periods: selectionFlags(
+        columns.period.names,
+        (name, code) => selectedYears.has(columns.periodYear[code]) && selectedMonthNumbers.has(columns.periodMonthNumber[code])
+      ),
+    };
+  }
+
+  function compileRowFilter(columns, flags) {
+    const checks = [
+      [flags.departments, columns.avdelning.codes],
+      [flags.stores, columns.filial.codes],
+      [flags.periods, columns.period.codes],
+    ].filter((check) => check[0].some((flag) => flag === 0));
+    if (checks.some((check) => !check[0].includes(1))) return null;
+    if (checks.length === 0) return () => 1;
+    const [flagsA, codesA] = checks[0];
+    if (checks.length === 1) return (i) => flagsA[codesA[i]];
+    const [flagsB, codesB] = checks[1];
+    if (checks.length === 2) return (i) => flagsA[codesA[i]] & flagsB[codesB[i]];
+    const [flagsC, codesC] = checks[2];
+    return (i) => flagsA[codesA[i]] & flagsB[codesB[i]] & flagsC[codesC[i]];
+  }
+
+  function buildFilterMask(columns, includeDepartments) {
+    const isSelected = compileRowFilter(columns, buildSelectionFlags(columns, includeDepartments));
+    const mask = new Uint8Array(columns.size);
+    if (!isSelected) return mask;
+    for (let i = 0; i < mask.length; i += 1) {
+      mask[i] = isSelected(i);
+    }
+    return mask;
+  }
+
+  function groupRowsByFirstSeen(names, firstSeen, sums, offsetOf) {
+    const groups = [];
+    for (let group = 0; group < names.length; group += 1) {
+      if (firstSeen[group] >= 0) groups.push(group);
+    }
+    groups.sort((a, b) => firstSeen[a] - firstSeen[b]);
+    return groups.map((group) => {
+      const row = { name: names[group] };
+      const offset = offsetOf(group);
+      aggregateKeys.forEach((key, k) => { row[key] = sums[offset + k]; });
+      return row;
+    });
+  }
+
+  function selectionFingerprint() {
+    if (selectionCache.version !== filtersVersion) {
+      selectionCache.version = filtersVersion;
+      selectionCache.fingerprint = [selectedDepartments, selectedStores, selectedYears, selectedMonthNumbers]
+        .map((selected) => Array.from(selected, (value) => String(value)).sort().join("\u0001"))
+        .join("\u0002");
+    }
+    return selectionCache.fingerprint;
+  }
+
+  function computeAllAggregates() {
+    const fingerprint = selectionFingerprint();
+    if (aggregateCache.fingerprint === fingerprint) {
+      return aggregateCache.aggregates;
+    }
+    aggregateCache.fingerprint = fingerprint;
+    aggregateCache.aggregates = computeSelectionAggregates();
+    return aggregateCache.aggregates;
+  }
+
+  function computeSelectionAggregates() {
+    const columns = historyColumns;
+    const keyCount = aggregateKeys.length;
+    const values = aggregateKeys.map((key) => columns.values[key]);
+    const netSales = columns.values.net_sales;
+    const isSelected = compileRowFilter(columns, buildSelectionFlags(columns, true));
+    const departments = columns.avdelning;
+    const stores = columns.filial;
+    const departmentCodes = departments.codes;
+    const storeCodes = stores.codes;
+    const periodCodes = columns.period.codes;
+    const monthOf = columns.period.groupOf;
+    const monthNames = columns.period.groupNames;
+    const monthCount = monthNames.length;
+    const departmentCount = departments.groupNames.length;
+    const storeCount = stores.groupNames.length;
+
+    const totals = new Float64Array(keyCount);
+    const monthTotals = new Float64Array(monthCount * keyCount);
+    const monthSeen = new Uint8Array(monthCount);
+    const departmentTotals = new Float64Array(departmentCount * keyCount);
+    const departmentFirst = new Int32Array(departmentCount).fill(-1);
+    const storeTotals = new Float64Array(storeCount * keyCount);
+    const storeFirst = new Int32Array(storeCount).fill(-1);
+    const storeMonthTotals = new Float64Array(storeCount * monthCount * keyCount);
+    const storeMonthFirst = new Int32Array(storeCount * monthCount).fill(-1);
+    const trendSales = new Float64Array(stores.names.length * monthCount);
+    const trendFirst = new Int32Array(stores.names.length).fill(-1);
+
+    const rowCount = isSelected ? columns.size : 0;
+    for (let i = 0; i < rowCount; i += 1) {
+      if (!isSelected(i)) continue;
+      const storeCode = storeCodes[i];
+      const periodCode = periodCodes[i];
+      const department = departments.groupOf[departmentCodes[i]];
+      const store = stores.groupOf[storeCode];
+      const month = monthOf[periodCode];
+      const storeMonth = store * monthCount + month;
+      monthSeen[month] = 1;
+      if (departmentFirst[department] < 0) departmentFirst[department] = i;
+      if (storeFirst[store] < 0) storeFirst[store] = i;
+      if (storeMonthFirst[storeMonth] < 0) storeMonthFirst[storeMonth] = i;
+      for (let k = 0; k < keyCount; k += 1) {
+        const value = values[k][i];
+        totals[k] += value;
+        monthTotals[month * keyCount + k] += value;
+        departmentTotals[department * keyCount + k] += value;
+        storeTotals[store * keyCount + k] += value;
+        storeMonthTotals[storeMonth * keyCount + k] += value;
+      }
+      if (stores.names[storeCode] && monthNames[month]) {
+        if (trendFirst[storeCode] < 0) trendFirst[storeCode] = i;
+        trendSales[storeCode * monthCount + month] += netSales[i];
+      }
+    }
+
+    function keyedTotals(sums, offset) {
+      const row = {};
+      aggregateKeys.forEach((key, k) => { row[key] = sums[offset + k]; });
+      return row;
+    }
+
+    const monthSlots = columns.monthSlots;
+    const selectedSlots = columns.monthOrder.filter((slot) => monthSeen[slot] === 1);
+    const months = selectedSlots.map((slot) => monthNames[slot]);
+    const latestSlot = selectedSlots.length === 0 ? -1 : selectedSlots[selectedSlots.length - 1];
+    const latestMonth = latestSlot < 0 ? null : monthNames[latestSlot];
+    const emptyTotals = keyedTotals(new Float64Array(keyCount), 0);
+    const trendStores = stores.names.map((name, code) => code).filter((code) => trendFirst[code] >= 0);
+    trendStores.sort((a, b) => trendFirst[a] - trendFirst[b]);
+    return {
+      months: months,
+      latestMonth: latestMonth,
+      totals: keyedTotals(totals, 0),
+      monthTotals: (month) => (monthSlots.has(month) ? keyedTotals(monthTotals, monthSlots.get(month) * keyCount) : emptyTotals),
+      departmentAgg: groupRowsByFirstSeen(departments.groupNames, departmentFirst, departmentTotals, (group) => group * keyCount),
+      storeAgg: groupRowsByFirstSeen(stores.groupNames, storeFirst, storeTotals, (group) => group * keyCount),
+      latestStoreAgg: latestSlot < 0
+        ? []
+        : groupRowsByFirstSeen(
+          stores.groupNames,
+          Int32Array.from(stores.groupNames, (name, group) => storeMonthFirst[group * monthCount + latestSlot]),
+          storeMonthTotals,
+          (group) => (group * monthCount + latestSlot) * keyCount
+        ),
+      storeTrend: trendStores.map((code) => ({
+        store: stores.names[code],
+        values: selectedSlots.map((slot) => trendSales[code * monthCount + slot]),
+      })),
+    };
+  }
+
+  function filterSelectedRows(rows, columns) {
+    const mask = buildFilterMask(columns, true);
+    return rows.filter((row, i) => mask[i] === 1);
+  }
+
+  function getLowMarginRows() {
+    const fingerprint = selectionFingerprint();
+    if (lowMarginCache.fingerprint !== fingerprint) {
+      lowMarginCache.fingerprint = fingerprint;
+      lowMarginCache.rows = aggregateArticles(filterSelectedRows(lowMarginRows, lowMarginColumns), "net_sales", false).slice(0, topN);
+    }
+    return lowMarginCache.rows;
+  }
+
+  function getDepartmentFilterOrder() {
+    const mask = buildFilterMask(historyColumns, false);
+    const departments = historyColumns.avdelning;
+    const netSales = historyColumns.values.net_sales;
+    const totals = new Float64Array(departments.names.length);
+    for (let i = 0; i < mask.length; i += 1) {
+      if (mask[i]) totals[departments.codes[i]] += netSales[i];
+    }
+    const salesByDepartment = new Map();
+    departments.names.forEach((department, code) => {
+      if (department) salesByDepartment.set(department, totals[code]);
+    });
+    return [...allDepartments].sort((a, b) => {
+      const salesDiff = (salesByDepartment.get(b) || 0) - (salesByDepartment.get(a) || 0);
+      if (Math.abs(salesDiff) > 0.000001) return salesDiff;
+      return a.localeCompare(b, "sv");
+    });
+  }
+
+  function renderCheckOptions(container, values, selectedSet, dataKey, labelFn, parseValueFn) {
+    if (!container) return;
+    const rendered = checkOptionNodes.get(container);
+    if (rendered && rendered.values.length === values.length && rendered.values.every((value, index) => value === values[index])) {
+      rendered.inputs.forEach((input, index) => { input.checked = selectedSet.has(values[index]); });
+    } else {
+      const fragment = document.createDocumentFragment();
+      const inputs = values.map((value) => {
+        const label = document.createElement("label");
+        label.className = "check-row";
+        const input = document.createElement("input");
+        input.setAttribute("type", "checkbox");
+        input.setAttribute("data-" + dataKey, String(value));
+        input.checked = selectedSet.has(value);
+        label.appendChild(input);
+        label.appendChild(document.createTextNode(labelFn(value)));
+        fragment.appendChild(label);
+        return input;
+      });
+      container.replaceChildren(fragment);
+      checkOptionNodes.set(container, { values: values.slice(), inputs: inputs });
+    }
+    const installed = checkOptionHandlers.has(container);
+    checkOptionHandlers.set(container, { selectedSet: selectedSet, dataKey: dataKey, parseValueFn: parseValueFn });
+    if (installed) return;
+    container.addEventListener("change", (event) => {
+      const target = event.target;
+      if (!(target instanceof HTMLInputElement)) return;
+      const options = checkOptionHandlers.get(container);
+      const raw = target.getAttribute("data-" + options.dataKey);
+      if (raw === null) return;
+      const parsed = options.parseValueFn(raw);
+      if (target.checked) options.selectedSet.add(parsed); else options.selectedSet.delete(parsed);
+      filtersVersion += 1;
+      scheduleRender();
+    });
+  }
+
+  function createShareRowNodes(label) {
+    const row = document.createElement("div");
+    row.className = "share-row";
+    const labelNode = document.createElement("div");
+    labelNode.textContent = label;
+    const nodes = { row: row };
+    const cells = [labelNode];
+    for (const kind of ["sales", "profit"]) {
+      const wrap = document.createElement("div");
+      wrap.className = "bar-wrap";
+      const bar = document.createElement("div");
+      bar.className = "bar bar-" + kind;
+      wrap.appendChild(bar);
+      const value = document.createElement("div");
+      cells.push(wrap, value);
+      nodes[kind + "Bar"] = bar;
+      nodes[kind + "Pct"] = value;
+    }
+    cells.forEach((cell) => row.appendChild(cell));
+    return nodes;
+  }
+
+  function buildShareRows(groups, labelKey, totalSales, totalProfit) {
+    return groups.map((group) => ({
+      [labelKey]: group.name,
+      sales_share_percent: pct(group.net_sales, totalSales),
+      profit_share_percent: pct(group.gross_profit, totalProfit),
+      net_sales: group.net_sales,
+      gross_profit: group.gross_profit,
+      gross_margin_percent: pct(group.gross_profit, group.net_sales),
+    })).sort((a, b) => b.net_sales - a.net_sales);
+  }
+
+  function renderShareRows(containerId, rows, labelKey) {
+    const container = document.getElementById(containerId);
+    if (!container) return;
+    if (rows.length === 0) {
+      shareRowNodes.delete(containerId);
+      container.innerHTML = '<p class="meta">Ingen data för valt urval.</p>';
+      return;
+    }
+    const keys = rows.map((row) => String(row[labelKey] || ""));
+    const labelOf = labelKey === "filial" ? displayStoreName : String;
+    let rendered = shareRowNodes.get(containerId);
+    if (!rendered || rendered.keys.length !== keys.length || rendered.keys.some((key, index) => key !== keys[index])) {
+      const fragment = document.createDocumentFragment();
+      const nodes = keys.map((key) => {
+        const rowNodes = createShareRowNodes(labelOf(key));
+        fragment.appendChild(rowNodes.row);
+        return rowNodes;
+      });
+      container.replaceChildren(fragment);
+      rendered = { keys: keys, nodes: nodes };
+      shareRowNodes.set(containerId, rendered);
+    }
+    rows.forEach((row, index) => {
+      const nodes = rendered.nodes[index];
+      const salesPct = Math.max(0, Math.min(100, toNumber(row.sales_share_percent)));
+      const profitPct = Math.max(0, Math.min(100, toNumber(row.profit_share_percent)));
+      nodes.salesBar.style.width = salesPct.toFixed(2) + "%";
+      nodes.salesPct.textContent = fmtPct(salesPct, 1);
+      nodes.profitBar.style.width = profitPct.toFixed(2) + "%";
+      nodes.profitPct.textContent = fmtPct(profitPct, 1);
+    });
+  }
+
+  function renderStoreTrend(months, storeTrend) {
+    if (!storeTrendEmpty || !storeTrendSvg || !storeTrendLegend) return;
+    if (months.length < 2) {
+      storeTrendEmpty.textContent = "Välj minst två perioder för att visa grafen.";
+      storeTrendEmpty.style.display = "block";
+      storeTrendSvg.style.display = "none";
+      storeTrendSvg.innerHTML = "";
+      storeTrendLegend.innerHTML = "";
+      return;
+    }
+
+    if (storeTrend.length === 0) {
+      storeTrendEmpty.textContent = "Ingen butiksdata för valt urval.";
+      storeTrendEmpty.style.display = "block";
+      storeTrendSvg.style.display = "none";
+      storeTrendSvg.innerHTML = "";
+      storeTrendLegend.innerHTML = "";
+      return;
+    }
+
+    const series = storeTrend.map((row) => {
+      const total = row.values.reduce((acc, value) => acc + value, 0);
+      return { store: row.store, values: row.values, total: total };
+    }).sort((a, b) => b.total - a.total);
+
+    let minValue = 0;
+    let maxValue = 0;
+    for (const row of series) {
+      for (const value of row.values) {
+        if (value < minValue) minValue = value;
+        if (value > maxValue) maxValue = value;
+      }
+    }
+    if (Math.abs(maxValue - minValue) < 0.000001) {
+      maxValue = minValue + 1;
+    }
+
+    const width = 760;
+    const height = 260;
+    const left = 44;
+    const right = 10;
+    const top = 12;
+    const bottom = 26;
+    const plotWidth = width - left - right;
+    const plotHeight = height - top - bottom;
+    const xStep = months.length > 1 ? plotWidth / (months.length - 1) : 0;
+    const palette = ["#0284c7", "#16a34a", "#ea580c", "#7c3aed", "#0f766e", "#be123c", "#0369a1", "#4338ca"];
+
+    function xAt(index) {
+      return left + (index * xStep);
+    }
+
+    function yAt(value) {
+      return top + ((maxValue - value) / (maxValue - minValue)) * plotHeight;
+    }
+
+    const parts = [];
+    const ticks = 4;
+    const gridStart = left.toFixed(2);
+    const gridEnd = (left + plotWidth).toFixed(2);
+    const tickLabelX = (left - 6).toFixed(2);
+    const monthLabelY = (height - 7).toFixed(2);
+    let axis = "";
+    for (let index = 0; index <= ticks; index += 1) {
+      const value = maxValue - ((maxValue - minValue) * index / ticks);
+      const y = yAt(value);
+      const yLabel = y.toFixed(2);
+      axis += '<line x1="' + gridStart + '" y1="' + yLabel + '" x2="' + gridEnd + '" y2="' + yLabel + '" stroke="#e6edf7" stroke-width="1" />'
+        + '<text x="' + tickLabelX + '" y="' + (y + 4).toFixed(2) + '" fill="#6b7280" font-size="10" text-anchor="end">' + esc(fmtMoney(value)) + "</text>";
+    }
+
+    if (minValue < 0 && maxValue > 0) {
+      const yZero = yAt(0).toFixed(2);
+      axis += '<line x1="' + gridStart + '" y1="' + yZero + '" x2="' + gridEnd + '" y2="' + yZero + '" stroke="#9ca3af" stroke-width="1.2" stroke-dasharray="3 3" />';
+    }
+
+    const labelStep = months.length > 8 ? Math.ceil(months.length / 8) : 1;
+    for (let index = 0; index < months.length; index += 1) {
+      if (index % labelStep === 0 || index === months.length - 1) {
+        axis += '<text x="' + xAt(index).toFixed(2) + '" y="' + monthLabelY + '" fill="#6b7280" font-size="10" text-anchor="middle">' + reportMonthLabelHtml(months[index]) + "</text>";
+      }
+    }
+    parts.push(axis);
+
+    const xLabels = months.map((month, index) => xAt(index).toFixed(2));
+    const baseline = (top + plotHeight).toFixed(2);
+    const points = new Array(months.length);
+    for (let seriesIndex = 0; seriesIndex < series.length; seriesIndex += 1) {
+      const row = series[seriesIndex];
+      const color = palette[seriesIndex % palette.length];
+      let lastY = "";
+      for (let index = 0; index < row.values.length; index += 1) {
+        lastY = yAt(row.values[index]).toFixed(2);
+        points[index] = xLabels[index] + "," + lastY;
+      }
+      const pointList = points.join(" ");
+      const lastIndex = row.values.length - 1;
+      let seriesSvg = "";
+      if (row.values.length > 1) {
+        seriesSvg += '<path d="M' + pointList + " L" + xLabels[lastIndex] + "," + baseline + " L" + xLabels[0] + "," + baseline + ' Z" fill="' + color + '" opacity="0.06" />';
+      }
+      seriesSvg += '<polyline points="' + pointList + '" fill="none" stroke="' + color + '" stroke-width="2.2" stroke-linecap="round" stroke-linejoin="round" />';
+      if (lastIndex >= 0) {
+        seriesSvg += '<circle cx="' + xLabels[lastIndex] + '" cy="' + lastY + '" r="2.8" fill="' + color + '" />';
+      }
+      parts.push(seriesSvg);
+    }
+
+    storeTrendEmpty.style.display = "none";
+    storeTrendSvg.style.display = "block";
+    storeTrendSvg.innerHTML = parts.join("");
+    storeTrendLegend.innerHTML = series.map((row, index) => {
+      const color = palette[index % palette.length];
+      return '<span class="trend-legend-item"><span class="trend-dot" style="background:' + color + '"></span>' + storeNameHtml(row.store) + " (" + esc(fmtMoney(row.total)) + ")</span>";
+    }).join("");
+  }
+
+  function renderStoreStockBars(latestStoreAgg, latestMonth) {
+    if (!storeStockEmpty || !storeStockBars || !storeStockRatioEmpty || !storeStockRatioBars) return;
+    if (!latestMonth) {
+      storeStockEmpty.textContent = "Ingen lagerdata för valt urval.";
+      storeStockEmpty.style.display = "block";
+      storeStockBars.innerHTML = "";
+      storeStockRatioEmpty.textContent = "Ingen data för dagberäkning.";
+      storeStockRatioEmpty.style.display = "block";
+      storeStockRatioBars.innerHTML = "";
+      return;
+    }
+
+    let maxStock = 1;
+    const stockValues = new Float64Array(latestStoreAgg.length);
+    const stockOrder = new Uint32Array(latestStoreAgg.length);
+    for (let index = 0; index < latestStoreAgg.length; index += 1) {
+      const stockValue = Math.max(0, toNumber(latestStoreAgg[index].estimated_stock_value));
+      if (stockValue > maxStock) maxStock = stockValue;
+      stockValues[index] = stockValue;
+      stockOrder[index] = index;
+    }
+    stockOrder.sort((a, b) => stockValues[b] - stockValues[a] || a - b);
+    const storeStocks = Array.from(stockOrder, (index) => {
+      const row = latestStoreAgg[index];
+      return {
+        label_html: storeNameHtml(row.name),
+        stock_html: esc(fmtMoney(stockValues[index])),
+        estimated_stock_value: stockValues[index],
+        net_sales: toNumber(row.net_sales),
+      };
+    });
+
+    if (storeStocks.length === 0) {
+      storeStockEmpty.textContent = "Ingen lagerdata i senaste valda period.";
+      storeStockEmpty.style.display = "block";
+      storeStockBars.innerHTML = "";
+      storeStockRatioEmpty.textContent = "Ingen data för dagberäkning.";
+      storeStockRatioEmpty.style.display = "block";
+      storeStockRatioBars.innerHTML = "";
+      return;
+    }
+
+    storeStockEmpty.textContent = "Senaste valda period: " + reportMonthLabel(latestMonth);
+    storeStockEmpty.style.display = "block";
+    storeStockBars.innerHTML = storeStocks.map((row) => {
+      const width = Math.max(0, Math.min(100, (row.estimated_stock_value / maxStock) * 100));
+      return '<div class="stock-bar-row">'
+        + '<div class="stock-bar-label">' + row.label_html + '</div>'
+        + '<div class="stock-bar-track"><div class="stock-bar-fill" style="width:' + width.toFixed(2) + '%"></div></div>'
+        + '<div class="stock-bar-value">' + row.stock_html + '</div>'
+        + '</div>';
+    }).join("");
+
+    const daysInMonth = daysInReportMonth(latestMonth);
+    const daysText = String(daysInMonth);
+    let maxRatio = 0;
+    const ratioValues = new Float64Array(storeStocks.length);
+    const withDays = [];
+    const withoutDays = [];
+    const ratioSource = storeStocks.map((row, index) => {
+      const daysInStock = row.net_sales > 0 ? (row.estimated_stock_value / row.net_sales) * daysInMonth : null;
+      if (daysInStock === null) {
+        withoutDays.push(index);
+      } else {
+        ratioValues[index] = daysInStock;
+        withDays.push(index);
+        if (daysInStock > maxRatio) maxRatio = daysInStock;
+      }
+      return {
+        label_html: row.label_html,
+        stock_html: row.stock_html,
+        stock_days: daysInStock,
+        net_sales: row.net_sales,
+      };
+    });
+    const ratioOrder = Uint32Array.from(withDays).sort((a, b) => ratioValues[b] - ratioValues[a] || a - b);
+    const ratioRows = Array.from(ratioOrder, (index) => ratioSource[index]);
+    for (const index of withoutDays) ratioRows.push(ratioSource[index]);
+
+    if (maxRatio === 0) maxRatio = 1;
+
+    if (ratioRows.length === 0) {
+      storeStockRatioEmpty.textContent = "Ingen data för dagberäkning.";
+      storeStockRatioEmpty.style.display = "block";
+      storeStockRatioBars.innerHTML = "";
+      return;
+    }
+
+    storeStockRatioEmpty.textContent = "Formel: (Lagerestimat / Nettoförsäljning) x " + daysText + " dagar.";
+    storeStockRatioEmpty.style.display = "block";
+    storeStockRatioBars.innerHTML = ratioRows.map((row) => {
+      const ratioText = row.stock_days === null ? "-" : (fmtDecimal(row.stock_days) + " dagar");
+      const width = row.stock_days === null ? 0 : Math.max(0, Math.min(100, (toNumber(row.stock_days) / maxRatio) * 100));
+      return '<div class="stock-ratio-row">'
+        + '<div class="stock-bar-label">' + row.label_html + '</div>'
+        + '<div class="stock-ratio-track"><div class="stock-ratio-fill" style="width:' + width.toFixed(2) + '%"></div></div>'
+        + '<div class="stock-ratio-value" title="Lagerestimat: ' + row.stock_html + ', Netto: ' + esc(fmtMoney(row.net_sales)) + ', Dagar i period: ' + daysText + '">' + esc(ratioText) + '</div>'
+        + '</div>';
+    }).join("");
+  }
+
+  function renderTopDepartments(rows) {
+    if (!topDeptBody) return;
+    if (rows.length === 0) {
+      topDeptBody.innerHTML = '<tr><td colspan="4">Ingen data</td></tr>';
+      return;
+    }
+    topDeptBody.innerHTML = rows.map((row) =>
+      rowOpenHtml + esc(row.avdelning) + cellHtml + fmtMoney(row.net_sales) + cellHtml + fmtMoney(row.gross_profit) + cellHtml + fmtPct(row.gross_margin_percent, 2) + rowCloseHtml
+    ).join("");
+  }
+
+  function renderLowMargin(rows) {
+    if (!lowMarginBody) return;
+    if (rows.length === 0) {
+      lowMarginBody.innerHTML = '<tr><td colspan="6">Ingen data</td></tr>';
+      return;
+    }
+    lowMarginBody.innerHTML = rows.map((row) =>
+      articleCellsHtml(row) + numCellHtml + fmtPct(row.gross_margin_percent, 2) + rowCloseHtml
+    ).join("");
+  }
+
+  function articleCellsHtml(row) {
+    return rowOpenHtml + esc(row.avdelning)
+      + cellHtml + esc(row.varutext || row.artnr)
+      + '</td><td class="col-ean">' + esc(formatEan(row.ean))
+      + numCellHtml + fmtQty(row.units_sold)
+      + numCellHtml + fmtMoney(row.net_sales);
+  }
+
+  function buildRiskTable(title, headerHtml, rowHtml, emptyColspan, emptyText) {
+    const bodyHtml = rowHtml && rowHtml.length > 0
+      ? rowHtml
+      : '<tr><td colspan="' + String(emptyColspan) + '" class="risk-empty">' + esc(emptyText) + "</td></tr>";
+    return '<section class="risk-table-wrap">'
+      + '<h4 class="risk-section-title">' + esc(title) + "</h4>"
+      + '<table class="risk-table"><thead><tr>' + headerHtml + "</tr></thead><tbody>" + bodyHtml + "</tbody></table>"
+      + "</section>";
+  }
+
+  function buildRiskAnalysisHtml(metrics, filteredDepartments) {
+    if (filteredDepartments.length === 0) {
+      return '<h3>Snabbanalys</h3><p class="meta">Välj minst en avdelning för att se riskanalys.</p>';
+    }
+
+    if (riskState.activeKey === "departments") {
+      const topSalesDepartments = topKRows(metrics.departmentRows, 8, "net_sales", true);
+      const topRows = topSalesDepartments.map((row, index) =>
+        rankOpenHtml + String(index + 1) + cellHtml + esc(row.avdelning) + numCellHtml + fmtMoney(row.net_sales) + numCellHtml + fmtPct(row.gross_margin_percent, 2) + rowCloseHtml
+      ).join("");
+      return (
+        '<h3>Snabbanalys: valda avdelningar</h3>'
+        + '<div class="risk-kpi-grid">'
+        + '<div class="risk-kpi"><span>Valda avdelningar</span><strong>' + fmtQty(filteredDepartments.length) + '</strong></div>'
+        + '<div class="risk-kpi"><span>Netto för urval</span><strong>' + fmtMoney(metrics.totalSales) + '</strong></div>'
+        + '<div class="risk-kpi"><span>TB för urval</span><strong>' + fmtMoney(metrics.totalProfit) + '</strong></div>'
+        + '</div>'
+        + '<div class="risk-table-grid">'
+        + buildRiskTable(
+          "Storst avdelningar (netto)",
+          '<th class="num">#</th><th>Avdelning</th><th class="num">Netto</th><th class="num">TB %</th>',
+          topRows,
+          4,
+          "Ingen data för valt urval."
+        )
+        + '</div>'
+      );
+    }
+
+    if (riskState.activeKey === "negative_margin") {
+      const rows = metrics.negativeRows;
+      const [riskSales, riskProfit] = sumByKeys(rows, ["net_sales", "gross_profit"]);
+      const worstDepartments = topKRows(aggregateBy(rows, "avdelning", "gross_profit"), 8, "total", false);
+      const articleRows = aggregateArticles(rows, "gross_profit", true).slice(0, topN);
+      const deptTableRows = worstDepartments.map((item, index) =>
+        rankOpenHtml + String(index + 1) + cellHtml + esc(item.name) + numCellHtml + fmtMoney(item.total) + rowCloseHtml
+      ).join("");
+      const articleTableRows = articleRows.map((item) =>
+        articleCellsHtml(item) + numCellHtml + fmtMoney(item.gross_profit) + numCellHtml + fmtPct(item.gross_margin_percent, 2) + rowCloseHtml
+      ).join("");
+      return (
+        '<h3>Snabbanalys: negativ marginal</h3>'
+        + '<div class="meta">Baserad på riskartiklar i topp-listan, filtrerad på valda avdelningar.</div>'
+        + '<div class="risk-kpi-grid">'
+        + '<div class="risk-kpi"><span>Riskartiklar (topp)</span><strong>' + fmtQty(rows.length) + '</strong></div>'
+        + '<div class="risk-kpi"><span>Netto i risklista</span><strong>' + fmtMoney(riskSales) + '</strong></div>'
+        + '<div class="risk-kpi"><span>TB i risklista</span><strong>' + fmtMoney(riskProfit) + '</strong></div>'
+        + '</div>'
+        + '<div class="risk-table-grid">'
+        + buildRiskTable(
+          "Avdelningar med storst negativ TB",
+          '<th class="num">#</th><th>Avdelning</th><th class="num">TB</th>',
+          deptTableRows,
+          3,
+          "Ingen negativ marginal i topp-listan för valt urval."
+        )
+        + buildRiskTable(
+          "Riskartiklar",
+          '<th>Avdelning</th><th>Artikel</th><th>EAN</th><th class="num">Antal</th><th class="num">Netto</th><th class="num">TB</th><th class="num">TB %</th>',
+          articleTableRows,
+          7,
+          "Inga riskartiklar för valt urval."
+        )
+        + '</div>'
+      );
+    }
+
+    if (riskState.activeKey === "net_returns") {
+      const rows = metrics.returnRows;
+      const [returnSales, returnUnits] = sumByKeys(rows, ["net_sales", "units_sold"]);
+      const worstDepartments = topKRows(aggregateBy(rows, "avdelning", "net_sales"), 8, "total", false);
+      const articleRows = aggregateArticles(rows, "net_sales", true).slice(0, topN);
+      const deptTableRows = worstDepartments.map((item, index) =>
+        rankOpenHtml + String(index + 1) + cellHtml + esc(item.name) + numCellHtml + fmtMoney(item.total) + rowCloseHtml
+      ).join("");
+      const articleTableRows = articleRows.map((item) =>
+        articleCellsHtml(item) + numCellHtml + fmtMoney(item.gross_profit) + rowCloseHtml
+      ).join("");
+      return (
+        '<h3>Snabbanalys: nettoreturer</h3>'
+        + '<div class="meta">Baserad på retur-riskartiklar i topp-listan, filtrerad på valda avdelningar.</div>'
+        + '<div class="risk-kpi-grid">'
+        + '<div class="risk-kpi"><span>Returartiklar (topp)</span><strong>' + fmtQty(rows.length) + '</strong></div>'
+        + '<div class="risk-kpi"><span>Nettoeffekt</span><strong>' + fmtMoney(returnSales) + '</strong></div>'
+        + '<div class="risk-kpi"><span>Enheter i retur</span><strong>' + fmtQty(returnUnits) + '</strong></div>'
+        + '</div>'
+        + '<div class="risk-table-grid">'
+        + buildRiskTable(
+          "Avdelningar med storst nettoretur",
+          '<th class="num">#</th><th>Avdelning</th><th class="num">Netto</th>',
+          deptTableRows,
+          3,
+          "Ingen nettoretur i topp-listan för valt urval."
+        )
+        + buildRiskTable(
+          "Returartiklar",
+          '<th>Avdelning</th><th>Artikel</th><th>EAN</th><th class="num">Antal</th><th class="num">Netto</th><th class="num">TB</th>',
+          articleTableRows,
+          6,
+          "Inga returartiklar för valt urval."
+        )
+        + '</div>'
+      );
+    }
+
+    const ratio = metrics.tbRatio;
+    const status = ratio < 35 ? "Hog risk" : ratio < 45 ? "Bevaka" : "Stabil";
+    const lowMarginDepartments = topKRows(metrics.departmentRows, 8, "gross_margin_percent", false);
+    const lowMarginRows = lowMarginDepartments.map((row, index) =>
+      rankOpenHtml + String(index + 1) + cellHtml + esc(row.avdelning) + numCellHtml + fmtPct(row.gross_margin_percent, 2) + numCellHtml + fmtMoney(row.net_sales) + rowCloseHtml
+    ).join("");
+    return (
+      '<h3>Snabbanalys: TB/netto-forhallande</h3>'
+      + '<div class="risk-kpi-grid">'
+      + '<div class="risk-kpi"><span>TB/netto</span><strong>' + fmtPct(ratio, 2) + '</strong></div>'
+      + '<div class="risk-kpi"><span>Status</span><strong>' + esc(status) + '</strong></div>'
+      + '<div class="risk-kpi"><span>Netto för urval</span><strong>' + fmtMoney(metrics.totalSales) + '</strong></div>'
+      + '<div class="risk-kpi"><span>TB för urval</span><strong>' + fmtMoney(metrics.totalProfit) + '</strong></div>'
+      + '</div>'
+      + '<div class="risk-table-grid">'
+      + buildRiskTable(
+        "Avdelningar med lagst TB %",
+        '<th class="num">#</th><th>Avdelning</th><th class="num">TB %</th><th class="num">Netto</th>',
+        lowMarginRows,
+        4,
+        "Ingen data för valt urval."
+      )
+      + '</div>'
+    );
+  }
+
+  function renderRiskAnalysis(metrics, filteredDepartments) {
+    if (!riskAnalysis) return;
+    let html = metrics.analysisHtml.get(riskState.activeKey);
+    if (html === undefined) {
+      html = buildRiskAnalysisHtml(metrics, filteredDepartments);
+      metrics.analysisHtml.set(riskState.activeKey, html);
+    }
+    riskAnalysis.innerHTML = html;
+  }
+
+  function getRiskMetrics(departmentAgg) {
+    const fingerprint = selectionFingerprint();
+    if (riskCache.fingerprint === fingerprint && riskCache.departmentAgg === departmentAgg) {
+      return riskCache.metrics;
+    }
+    const departmentRows = departmentAgg.map((row) => ({
+      avdelning: row.name,
+      net_sales: row.net_sales,
+      gross_profit: row.gross_profit,
+      gross_margin_percent: pct(row.gross_profit, row.net_sales),
+      units_sold: row.units_sold,
+      estimated_stock_value: row.estimated_stock_value,
+    }));
+    const [totalSales, totalProfit] = sumByKeys(departmentRows, ["net_sales", "gross_profit"]);
+    const negativeRows = filterSelectedRows(marginRiskRows, marginRiskColumns);
+    const returnRows = filterSelectedRows(returnRiskRows, returnRiskColumns);
+    const metrics = {
+      departmentRows: departmentRows,
+      totalSales: totalSales,
+      totalProfit: totalProfit,
+      tbRatio: pct(totalProfit, totalSales),
+      negativeRows: negativeRows,
+      returnRows: returnRows,
+      analysisHtml: new Map(),
+    };
+    riskCache.fingerprint = fingerprint;
+    riskCache.departmentAgg = departmentAgg;
+    riskCache.metrics = metrics;
+    return metrics;
+  }
+
+  function renderRiskPills(filteredDepartments, departmentAgg) {
+    if (!riskPills) return;
+    const metrics = getRiskMetrics(departmentAgg);
+    const pills = [
+      { key: "departments", label: "Valda avdelningar", value: String(filteredDepartments.length) },
+      { key: "negative_margin", label: "Negativ marginal artiklar (topp)", value: String(metrics.negativeRows.length) },
+      { key: "net_returns", label: "Nettoretur artiklar (topp)", value: String(metrics.returnRows.length) },
+      { key: "tb_ratio", label: "Forhallande TB/netto", value: fmtPct(metrics.tbRatio, 2) },
+    ];
+    if (!pills.some((pill) => pill.key === riskState.activeKey)) {
+      riskState.activeKey = "negative_margin";
+    }
+    riskPills.innerHTML = pills
+      .map((pill) => {
+        const isActive = pill.key === riskState.activeKey;
+        return '<button type="button" class="warn-pill-btn' + (isActive ? ' active' : '') + '" data-risk-key="' + esc(pill.key) + '" aria-pressed="' + (isActive ? 'true' : 'false') + '">'
+          + esc(pill.label) + ': ' + esc(pill.value)
+          + '</button>';
+      })
+      .join("");
+
+    riskPills.querySelectorAll("button[data-risk-key]").forEach((node) => {
+      node.addEventListener("click", (event) => {
+        const target = event.currentTarget;
+        if (!(target instanceof HTMLElement)) return;
+        const key = target.getAttribute("data-risk-key") || "";
+        if (!key) return;
+        riskState.activeKey = key;
+        renderRiskPills(filteredDepartments, departmentAgg);
+      });
+    });
+    renderRiskAnalysis(metrics, filteredDepartments);
+  }
+
+  function renderMoM(aggregates) {
+    const months = aggregates.months;
+    if (!momCard) return;
+    if (months.length < 2) {
+      momCard.style.display = "none";
+      return;
+    }
+    const currentMonth = months[months.length - 1];
+    const previousMonth = months[months.length - 2];
+    const current = aggregates.monthTotals(currentMonth);
+    const previous = aggregates.monthTotals(previousMonth);
+
+    const currentSales = current.net_sales;
+    const previousSales = previous.net_sales;
+    const currentProfit = current.gross_profit;
+    const previousProfit = previous.gross_profit;
+
+    const salesDelta = currentSales - previousSales;
+    const salesDeltaPct = previousSales === 0 ? null : (salesDelta / previousSales) * 100;
+    const profitDelta = currentProfit - previousProfit;
+    const profitDeltaPct = previousProfit === 0 ? null : (profitDelta / previousProfit) * 100;
+
+    momCard.style.display = "block";
+    kpiEls.momRange.textContent = previousMonth + " till " + currentMonth;
+    kpiEls.momSalesDelta.textContent = fmtMoney(salesDelta);
+    kpiEls.momSalesDeltaPct.textContent = salesDeltaPct === null ? "-" : fmtPct(salesDeltaPct, 2);
+    kpiEls.momProfitDelta.textContent = fmtMoney(profitDelta);
+    kpiEls.momProfitDeltaPct.textContent = profitDeltaPct === null ? "-" : fmtPct(profitDeltaPct, 2);
+  }
+
+  function scheduleRender() {
+    if (renderScheduled) return;
+    renderScheduled = true;
+    requestAnimationFrame(() => {
+      renderScheduled = false;
+      render();
+    });
+  }
+
+  function render() {
+    const aggregates = computeAllAggregates();
+    const filteredMonths = aggregates.months;
+    if (selectedInfo && selectedInfoVersion !== filtersVersion) {
+      selectedInfoVersion = filtersVersion;
+      selectedInfo.textContent =
+        selectedDepartments.size + "/" + allDepartments.length + " avd, "
+        + selectedStores.size + "/" + allStores.length + " butiker, "
+        + selectedMonthNumbers.size + "/" + allMonthNumbers.length + " månader, "
+        + filteredMonths.length + " perioder";
+    }
+
+    const totalSales = aggregates.totals.net_sales;
+    const totalProfit = aggregates.totals.gross_profit;
+    const totalUnits = aggregates.totals.units_sold;
+    const avgSellingPrice = totalUnits > 0 ? totalSales / totalUnits : null;
+    const latestMonth = aggregates.latestMonth;
+    const latestTotals = aggregates.monthTotals(latestMonth);
+    const totalStock = latestTotals.estimated_stock_value;
+    const totalStockUnits = latestTotals.stock_units;
+    const totalStockMargin = latestTotals.stock_margin_value;
+    const stockSellingValue = totalStock + totalStockMargin;
+    const stockMarginPct = stockSellingValue > 0 ? (totalStockMargin / stockSellingValue) * 100 : null;
+    const latestMonthSales = latestTotals.net_sales;
+    const latestMonthProfit = latestTotals.gross_profit;
+    const latestMonthCogs = latestMonthSales - latestMonthProfit;
+    const stockCoverageMonths = latestMonthCogs > 0 ? totalStock / latestMonthCogs : null;
+    const avgStockUnitValue = totalStockUnits > 0 ? totalStock / totalStockUnits : null;
+
+    kpiEls.sales.textContent = fmtMoney(totalSales);
+    kpiEls.profit.textContent = fmtMoney(totalProfit);
+    kpiEls.margin.textContent = fmtPct(pct(totalProfit, totalSales), 2);
+    kpiEls.units.textContent = fmtQty(totalUnits);
+    kpiEls.stock.textContent = fmtMoney(totalStock);
+    kpiEls.avgStockUnitValue.textContent = avgStockUnitValue === null ? "-" : fmtMoney(avgStockUnitValue);
+    kpiEls.avgSellingPrice.textContent = avgSellingPrice === null ? "-" : fmtMoney(avgSellingPrice);
+    kpiEls.stockMargin.textContent = fmtMoney(totalStockMargin);
+    kpiEls.stockMarginPct.textContent = stockMarginPct === null ? "-" : fmtPct(stockMarginPct, 2);
+    kpiEls.stockCoverageMonths.textContent = stockCoverageMonths === null ? "-" : (fmtDecimal(stockCoverageMonths) + " man");
+
+    const deptAgg = aggregates.departmentAgg;
+    const deptShare = buildShareRows(deptAgg, "avdelning", totalSales, totalProfit);
+    renderShareRows("deptShareRows", deptShare, "avdelning");
+
+    const [storeTotalSales, storeTotalProfit] = sumByKeys(aggregates.storeAgg, ["net_sales", "gross_profit"]);
+    const storeShare = buildShareRows(aggregates.storeAgg, "filial", storeTotalSales, storeTotalProfit);
+    renderShareRows("storeShareRows", storeShare, "filial");
+    renderStoreTrend(filteredMonths, aggregates.storeTrend);
+    renderStoreStockBars(aggregates.latestStoreAgg, latestMonth);
+
+    renderTopDepartments(deptShare.slice(0, topN));
+    renderLowMargin(getLowMarginRows());
+    renderRiskPills(Array.from(selectedDepartments), deptAgg);
+    renderMoM(aggregates);
+  }
+
+  function closePanels() {
+    [deptPanel, storePanel, yearPanel, monthPanel].forEach((panel) => {
+      if (panel) panel.classList.remove("open");
+    });
+  }
+
+  function bindToggle(toggle, panel) {
+    if (!toggle || !panel) return;
+    toggle.addEventListener("click", (event) => {
+      event.stopPropagation();
+      const wasOpen = panel.classList.contains("open");
+      closePanels();
+      if (!wasOpen) panel.classList.add("open");
+    });
+  }
+
+  bindToggle(deptToggle, deptPanel);
+  bindToggle(storeToggle, storePanel);
+  bindToggle(yearToggle, yearPanel);
+  bindToggle(monthToggle, monthPanel);
+
+  document.addEventListener("click", (event) => {
+    if (!(event.target instanceof Node)) return;
+    const wrappers = [
+      [deptPanel, deptToggle],
+      [storePanel, storeToggle],
+      [yearPanel, yearToggle],
+      [monthPanel, monthToggle],
+    ];
+    for (const pair of wrappers) {
+      const panel = pair[0];
+      const toggle = pair[1];
+      if (!panel || !toggle) continue;
+      if (!panel.contains(event.target) && !toggle.contains(event.target)) {
+        panel.classList.remove("open");
+      }
+    }
+  });
+
+  function setAll(selectedSet, values) {
+    selectedSet.clear();
+    values.forEach((value) => selectedSet.add(value));
+    filtersVersion += 1;
+  }
+
+  function clearAll(selectedSet) {
+    selectedSet.clear();
+    filtersVersion += 1;
+  }
+
+  function bindClick(node, handler) {
+    if (!node) return;
+    node.addEventListener("click", handler);
+  }
+
+  function renderFilterOptions() {
+    const sortedDepartments = getDepartmentFilterOrder();
+    renderCheckOptions(deptOptions, sortedDepartments, selectedDepartments, "dept", (value) => value, (value) => String(value));
+    renderCheckOptions(storeOptions, allStores, selectedStores, "store", (value) => displayStoreName(value), (value) => String(value));
+    renderCheckOptions(yearOptions, allYears, selectedYears, "year", (value) => value, (value) => String(value));
+    renderCheckOptions(monthOptions, allMonthNumbers, selectedMonthNumbers, "month", (value) => monthLabel(value), (value) => Number(value));
+  }
+
+  bindClick(deptAll, () => {
+    setAll(selectedDepartments, allDepartments);
+    renderFilterOptions();
+    scheduleRender();
+  });
+  bindClick(deptNone, () => {
+    clearAll(selectedDepartments);
+    renderFilterOptions();
+    scheduleRender();
+  });
+  bindClick(storeAll, () => {
+    setAll(selectedStores, allStores);
+    renderFilterOptions();
+    scheduleRender();
+  });
+  bindClick(storeNone, () => {
+    clearAll(selectedStores);
+    renderFilterOptions();
+    scheduleRender();
+  });
+  bindClick(yearAll, () => {
+    setAll(selectedYears, allYears);
+    renderFilterOptions();
+    scheduleRender();
+  });
+  bindClick(yearNone, () => {
+    clearAll(selectedYears);
+    renderFilterOptions();
+    scheduleRender();
+  });
+  bindClick(monthAll, () => {
+    setAll(selectedMonthNumbers, allMonthNumbers);
+    renderFilterOptions();
+    scheduleRender();
+  });
+  bindClick(monthNone, () => {
+    clearAll(selectedMonthNumbers);
+    renderFilterOptions();
+    scheduleRender();
+  });
+
+  renderFilterOptions();
+  render();
+})();
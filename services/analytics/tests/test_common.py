@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+import math
+import sys
+from decimal import Decimal
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "scripts"))
+
+from common import parse_number, parse_number_column  # noqa: E402
+
+
+PARSE_NUMBER_CASES = [
+    None,
+    "",
+    "   ",
+    True,
+    False,
+    0,
+    -3,
+    2**53 + 1,
+    2**60,
+    -(2**63),
+    1.5,
+    float("nan"),
+    "12",
+    " 1 234,50 ",
+    "1 000",
+    "-0,25",
+    ".5",
+    "1e3",
+    "abc",
+    "1,2,3",
+    Decimal("2.5"),
+]
+
+
+@pytest.mark.parametrize("value", PARSE_NUMBER_CASES, ids=repr)
+def test_parse_number_column_matches_scalar(value):
+    expected = parse_number(value)
+    actual = parse_number_column([value]).to_pylist()[0]
+    if expected is None or (isinstance(expected, float) and math.isnan(expected)):
+        assert actual is None
+    else:
+        assert actual == expected
+
+
+def test_parse_number_column_accepts_large_ints():
+    values = [2**60, 7, "8"]
+    assert parse_number_column(values).to_pylist() == [parse_number(value) for value in values]